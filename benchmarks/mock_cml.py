@@ -0,0 +1,496 @@
+"""A local stand-in for a CML 2.4 controller.
+
+Implements the API endpoints used by the modules and the inventory plugin of this collection on
+synthetic labs held in memory, counts the requests it serves and can add a fixed latency to every
+request.  It is meant for benchmarks only, there is no validation beyond what the collection needs.
+
+Run it standalone to point a playbook at it::
+
+    python benchmarks/mock_cml.py --port 8443 --sizes 10,100
+"""
+
+import argparse
+import copy
+import json
+import os
+import re
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+INTERFACES_PER_NODE = 4
+
+
+def make_lab(lab_id, title, size, booted=True, tags=None, owner='admin-id'):
+    """Return a lab of size nodes connected in a chain, every node with four interfaces and a day0 config."""
+    nodes = []
+    interface_id = 0
+    for n in range(size):
+        interfaces = []
+        for slot in range(INTERFACES_PER_NODE):
+            interfaces.append({
+                'id': 'i{0}'.format(interface_id),
+                'label': 'GigabitEthernet{0}'.format(slot + 1),
+                'slot': slot,
+                'type': 'physical'
+            })
+            interface_id += 1
+        nodes.append({
+            'id': 'n{0}'.format(n),
+            'label': 'r{0}'.format(n + 1),
+            'x': 0,
+            'y': 0,
+            'node_definition': 'iosv',
+            'image_definition': None,
+            'ram': 512,
+            'cpus': 1,
+            'cpu_limit': 100,
+            'data_volume': None,
+            'boot_disk_size': None,
+            'tags': list(tags or ['router', 'ansible_group=routers']),
+            'configuration': 'hostname r{0}\n'.format(n + 1) + '!\n' * 200,
+            'interfaces': interfaces,
+            'state': 'BOOTED' if booted else 'DEFINED_ON_CORE',
+        })
+    links = []
+    for n in range(1, size):
+        links.append({
+            'id': 'l{0}'.format(n),
+            'interface_a': nodes[n - 1]['interfaces'][1]['id'],
+            'interface_b': nodes[n]['interfaces'][2]['id'],
+            'state': 'STARTED' if booted else 'DEFINED_ON_CORE',
+        })
+    return {
+        'id': lab_id,
+        'title': title,
+        'description': '',
+        'notes': '',
+        'owner': owner,
+        'state': 'STARTED' if booted else 'DEFINED_ON_CORE',
+        'created': '2024-01-01T00:00:00+00:00',
+        'modified': '2024-01-01T00:00:00+00:00',
+        'nodes': nodes,
+        'links': links,
+    }
+
+
+class Controller(object):
+    """State of the mock controller: labs, users, issued tokens and served requests."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.labs = {}
+        self.users = {
+            'admin-id': {
+                'id': 'admin-id',
+                'username': 'admin',
+                'fullname': '',
+                'description': '',
+                'admin': True,
+                'groups': []
+            }
+        }
+        self.groups = {'g1': {'id': 'g1', 'name': 'students', 'description': '', 'members': [], 'labs': []}}
+        self.tokens = set()
+        self.started = time.time()
+        # Number of upcoming requests that are answered with 503 Service Unavailable
+        self.errors = 0
+        # Seconds a started node takes to boot, and the most nodes seen booting at the same time
+        self.boot_time = 0.0
+        self.max_booting = 0
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+    def add_lab(self, lab):
+        self.labs[lab['id']] = lab
+
+    def new_lab(self, title):
+        lab = make_lab('lab' + uuid.uuid4().hex[:8], title, 0)
+        self.add_lab(lab)
+        return lab
+
+    def request_count(self):
+        with self.lock:
+            return sum(self.requests.values())
+
+    def reset_requests(self):
+        with self.lock:
+            self.requests.clear()
+
+    def snapshot(self):
+        """Return a copy of the labs, users and groups, to restore after a run that changed them."""
+        with self.lock:
+            return copy.deepcopy((self.labs, self.users, self.groups))
+
+    def restore(self, snapshot):
+        with self.lock:
+            self.labs, self.users, self.groups = copy.deepcopy(snapshot)
+
+
+def _tile(lab):
+    return {
+        'id': lab['id'],
+        'lab_title': lab['title'],
+        'lab_description': lab['description'],
+        'lab_notes': lab['notes'],
+        'owner': lab['owner'],
+        'state': lab['state'],
+        'created': lab['created'],
+        'modified': lab['modified'],
+        'node_count': len(lab['nodes']),
+        'link_count': len(lab['links'])
+    }
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def controller(self):
+        return self.server.controller
+
+    def _send(self, code, body=None):
+        data = b'' if code == 204 else json.dumps(body).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        # Count per endpoint, with the ids replaced by placeholders
+        endpoint = re.sub(r'/(lab|n|i|l|u)[0-9a-f]+(?=/|$)', r'/{\1}', parts.path)
+        with self.controller.lock:
+            self.controller.requests[(method, endpoint)] += 1
+        if self.controller.latency:
+            time.sleep(self.controller.latency)
+        with self.controller.lock:
+            overloaded = self.controller.errors > 0
+            self.controller.errors -= overloaded
+        if overloaded:
+            return self._send(503, {'description': 'overloaded'})
+        if not parts.path.startswith('/api/v0/'):
+            return self._send(404, {'description': 'not found'})
+        path = parts.path[len('/api/v0/'):]
+        if path == 'system_information':
+            return self._send(200, {'version': '2.4.0', 'ready': True})
+        if path == 'authenticate' and method == 'POST':
+            token = uuid.uuid4().hex
+            self.controller.tokens.add(token)
+            return self._send(200, token)
+        authorization = self.headers.get('Authorization', '')
+        if authorization[7:] not in self.controller.tokens:
+            return self._send(401, {'description': 'unauthorized'})
+        match = re.match(r'labs/([^/]+)/(nodes|interfaces|links)', path)
+        if method != 'GET' and match and match.group(1) in self.controller.labs:
+            # Like the controller, record when the topology of a lab was last changed
+            self.controller.labs[match.group(1)]['modified'] = time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime())
+        try:
+            return self.route(method, path, parse_qs(parts.query), body)
+        except (KeyError, IndexError) as e:
+            return self._send(404, {'description': 'not found: {0}'.format(e)})
+
+    def route(self, method, path, query, body):
+        controller = self.controller
+        if path == 'authok':
+            return self._send(200, True)
+        if path == 'populate_lab_tiles':
+            return self._send(200, {'lab_tiles': dict((lab['id'], _tile(lab)) for lab in controller.labs.values())})
+        if path == 'labs':
+            if method == 'POST':
+                lab = controller.new_lab(query.get('title', ['untitled'])[0])
+                return self._send(200, _tile(lab))
+            return self._send(200, list(controller.labs))
+        if path == 'import' and method == 'POST':
+            lab = controller.new_lab(query.get('title', ['untitled'])[0])
+            return self._send(200, {'id': lab['id'], 'warnings': []})
+        if path == 'users':
+            if method == 'POST':
+                user = json.loads(body)
+                user.pop('password', None)
+                user['id'] = 'u' + uuid.uuid4().hex[:8]
+                controller.users[user['id']] = user
+                return self._send(200, user)
+            return self._send(200, list(controller.users.values()))
+        if path == 'groups':
+            return self._send(200, list(controller.groups.values()))
+        match = re.match(r'^users/([^/]+)/id$', path)
+        if match:
+            for user in controller.users.values():
+                if user['username'] == match.group(1):
+                    return self._send(200, user['id'])
+            return self._send(404, {'description': 'User does not exist'})
+        match = re.match(r'^users/([^/]+)$', path)
+        if match:
+            user = controller.users[match.group(1)]
+            if method == 'DELETE':
+                del controller.users[user['id']]
+                return self._send(204)
+            if method == 'PATCH':
+                changes = json.loads(body)
+                changes.pop('password', None)
+                user.update(changes)
+            return self._send(200, user)
+        match = re.match(r'^labs/([^/]+)(?:/(.*))?$', path)
+        if match:
+            return self.route_lab(method, controller.labs[match.group(1)], match.group(2) or '', query, body)
+        return self._send(404, {'description': 'no such endpoint'})
+
+    def route_lab(self, method, lab, path, query, body):
+        if path == '':
+            if method == 'PATCH':
+                changes = json.loads(body)
+                for key in ('title', 'description', 'notes'):
+                    if key in changes:
+                        lab[key] = changes[key]
+                return self._send(200, _tile(lab))
+            if method == 'DELETE':
+                del self.controller.labs[lab['id']]
+                return self._send(204)
+            return self._send(200, _tile(lab))
+        if path == 'topology':
+            exclude = query.get('exclude_configurations', ['False'])[0].lower() == 'true'
+            nodes = []
+            for node in lab['nodes']:
+                node = dict(node)
+                del node['state']
+                node.pop('booted_at', None)
+                if exclude:
+                    del node['configuration']
+                nodes.append(node)
+            links = [dict((k, link[k]) for k in ('id', 'interface_a', 'interface_b')) for link in lab['links']]
+            summary = dict((k, lab[k]) for k in ('title', 'description', 'notes', 'owner'))
+            summary['version'] = '0.1.0'
+            return self._send(200, {'lab': summary, 'nodes': nodes, 'links': links})
+        if path == 'lab_element_state':
+            now = time.time()
+            for node in lab['nodes']:
+                if node['state'] == 'STARTED' and node.get('booted_at', 0) <= now:
+                    node['state'] = 'BOOTED'
+            interfaces = {}
+            for node in lab['nodes']:
+                for interface in node['interfaces']:
+                    interfaces[interface['id']] = 'STARTED' if node['state'] == 'BOOTED' else 'DEFINED_ON_CORE'
+            return self._send(
+                200, {
+                    'nodes': dict((node['id'], node['state']) for node in lab['nodes']),
+                    'interfaces': interfaces,
+                    'links': dict((link['id'], link['state']) for link in lab['links'])
+                })
+        if path == 'layer3_addresses':
+            addresses = {}
+            for n, node in enumerate(lab['nodes']):
+                if node['state'] == 'BOOTED':
+                    mac = '52:54:00:00:{0:02x}:{1:02x}'.format(n // 256, n % 256)
+                    address = '10.{0}.{1}.{2}'.format(n // 62500, n // 250 % 250, n % 250 + 1)
+                    addresses[node['id']] = {
+                        'name': node['label'],
+                        'interfaces': {
+                            mac: {
+                                'label': node['interfaces'][0]['label'],
+                                'ip4': [address],
+                                'ip6': []
+                            }
+                        }
+                    }
+            return self._send(200, addresses)
+        if path == 'simulation_stats':
+            # Started links carry a steady 100 kbit/s in one and 200 kbit/s in the other direction
+            elapsed = time.time() - self.controller.started
+            counters = {'readbytes': 1000, 'readpackets': 10, 'writebytes': 2000, 'writepackets': 20}
+            running = {
+                'readbytes': 1000 + int(elapsed * 12500),
+                'readpackets': 10 + int(elapsed * 25),
+                'writebytes': 2000 + int(elapsed * 25000),
+                'writepackets': 20 + int(elapsed * 50)
+            }
+            return self._send(
+                200, {
+                    'nodes': dict((node['id'], {'cpu_usage': 1.0}) for node in lab['nodes']),
+                    'links': dict((link['id'], running if link['state'] == 'STARTED' else counters)
+                                  for link in lab['links'])
+                })
+        if path == 'state':
+            return self._send(200, lab['state'])
+        if path == 'check_if_converged':
+            return self._send(200, True)
+        if path in ('start', 'stop', 'wipe'):
+            lab['state'] = {'start': 'STARTED', 'stop': 'STOPPED', 'wipe': 'DEFINED_ON_CORE'}[path]
+            for node in lab['nodes']:
+                node['state'] = {'start': 'BOOTED', 'stop': 'STOPPED', 'wipe': 'DEFINED_ON_CORE'}[path]
+            return self._send(204)
+        if path == 'nodes' and method == 'POST':
+            spec = json.loads(body)
+            node = {
+                'id': 'n' + uuid.uuid4().hex[:8],
+                'label': spec['label'],
+                'x': spec.get('x', 0),
+                'y': spec.get('y', 0),
+                'node_definition': spec['node_definition'],
+                'image_definition': spec.get('image_definition'),
+                'ram': spec.get('ram', 512),
+                'cpus': spec.get('cpus', 1),
+                'cpu_limit': spec.get('cpu_limit', 100),
+                'data_volume': spec.get('data_volume'),
+                'boot_disk_size': spec.get('boot_disk_size'),
+                'tags': spec.get('tags') or [],
+                'configuration': spec.get('configuration') or '',
+                'interfaces': [],
+                'state': 'DEFINED_ON_CORE'
+            }
+            lab['nodes'].append(node)
+            return self._send(200, {'id': node['id']})
+        if path == 'interfaces' and method == 'POST':
+            spec = json.loads(body)
+            node = [node for node in lab['nodes'] if node['id'] == spec['node']][0]
+            created = []
+            # Like the controller, a slot is created together with the missing slots below it
+            for slot in range(len(node['interfaces']), spec.get('slot', len(node['interfaces'])) + 1):
+                interface = {
+                    'id': 'i' + uuid.uuid4().hex[:8],
+                    'label': 'GigabitEthernet{0}'.format(slot + 1),
+                    'slot': slot,
+                    'type': 'physical'
+                }
+                node['interfaces'].append(interface)
+                created.append(dict(interface, node=node['id']))
+            return self._send(200, created)
+        if path == 'links' and method == 'POST':
+            spec = json.loads(body)
+            link = {
+                'id': 'l' + uuid.uuid4().hex[:8],
+                'interface_a': spec['src_int'],
+                'interface_b': spec['dst_int'],
+                'state': 'DEFINED_ON_CORE'
+            }
+            lab['links'].append(link)
+            return self._send(200, {'id': link['id']})
+        match = re.match(r'^links/([^/]+)(?:/(.*))?$', path)
+        if match:
+            link = [link for link in lab['links'] if link['id'] == match.group(1)][0]
+            if match.group(2) in ('state/start', 'state/stop'):
+                link['state'] = 'STARTED' if match.group(2) == 'state/start' else 'STOPPED'
+                return self._send(204)
+            if method == 'DELETE':
+                lab['links'].remove(link)
+                return self._send(204)
+            return self._send(200, link)
+        match = re.match(r'^interfaces/([^/]+)$', path)
+        if match and method == 'DELETE':
+            for node in lab['nodes']:
+                node['interfaces'] = [i for i in node['interfaces'] if i['id'] != match.group(1)]
+            lab['links'] = [
+                link for link in lab['links'] if match.group(1) not in (link['interface_a'], link['interface_b'])
+            ]
+            return self._send(204)
+        match = re.match(r'^nodes/([^/]+)(?:/(.*))?$', path)
+        if match:
+            node = [node for node in lab['nodes'] if node['id'] == match.group(1)][0]
+            action = match.group(2) or ''
+            if action == '':
+                if method == 'DELETE':
+                    lab['nodes'].remove(node)
+                    ids = set(interface['id'] for interface in node['interfaces'])
+                    lab['links'] = [
+                        link for link in lab['links'] if not ids & set([link['interface_a'], link['interface_b']])
+                    ]
+                    return self._send(204)
+                if method == 'PATCH':
+                    node.update(json.loads(body))
+                return self._send(200, node)
+            if action in ('config', 'extract_configuration'):
+                return self._send(200, node['configuration'])
+            if action == 'check_if_converged':
+                return self._send(200, True)
+            if action in ('state/start', 'state/stop'):
+                node['state'] = 'BOOTED' if action == 'state/start' else 'STOPPED'
+                if action == 'state/start' and self.controller.boot_time:
+                    node.update(state='STARTED', booted_at=time.time() + self.controller.boot_time)
+                    booting = sum(1 for lab in self.controller.labs.values() for node in lab['nodes']
+                                  if node['state'] == 'STARTED' and node['booted_at'] > time.time())
+                    self.controller.max_booting = max(self.controller.max_booting, booting)
+                return self._send(204)
+            if action == 'wipe_disks':
+                node['state'] = 'DEFINED_ON_CORE'
+                return self._send(204)
+        return self._send(404, {'description': 'no such lab endpoint'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def _certificate(directory):
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    if not os.path.exists(cert):
+        subprocess.check_call([
+            'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key, '-out', cert, '-days', '1',
+            '-subj', '/CN=localhost'
+        ],
+                              stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+def serve(controller, port=0, cert_dir=None):
+    """Serve controller over https on localhost in a background thread, return the server."""
+    cert, key = _certificate(cert_dir or tempfile.mkdtemp(prefix='mock-cml-'))
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    server.daemon_threads = True
+    server.controller = controller
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--sizes', default='10', help='comma separated node counts, one lab per count')
+    parser.add_argument('--wiped', action='store_true', help='create the labs with wiped nodes')
+    args = parser.parse_args()
+
+    controller = Controller(latency=args.latency)
+    for size in args.sizes.split(','):
+        controller.add_lab(make_lab('lab{0}'.format(size), 'bench-{0}'.format(size), int(size), booted=not args.wiped))
+    server = serve(controller, args.port)
+    print('Serving {0} on https://localhost:{1}, user admin with any password'.format(
+        ', '.join('bench-{0}'.format(size) for size in args.sizes.split(',')), server.server_address[1]))
+    try:
+        while True:
+            time.sleep(10)
+            print('{0} requests served'.format(controller.request_count()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Benchmark the modules and the inventory plugin against the mock CML controller.
+
+For every lab size a booted lab ``bench-<size>`` and a wiped lab ``bench-<size>-wiped`` are
+generated.  Each scenario runs a module, or ansible-inventory for the inventory plugin, in its own
+process and reports the wall time, the number of API requests and the peak RSS of that process::
+
+    python benchmarks/run.py --sizes 10,100,1000 --latency 0.005
+
+The scenarios run in order and some of them change the labs, e.g. nodes-start boots the wiped lab
+that lab-wait then waits for.  With --repeat, the labs and users are restored before every run of a
+scenario, so that a scenario that changes them, e.g. nodes-start, does the same work every time.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import mock_cml  # noqa: E402
+
+COLLECTION_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, module or None for the inventory, arguments), {size}, {nodes} and {users} are substituted
+SCENARIOS = [
+    ('inventory', None, {'lab': 'bench-{size}'}),
+    ('lab-facts', 'cml_lab_facts', {'lab': 'bench-{size}'}),
+    ('lab-facts-state', 'cml_lab_facts', {'lab': 'bench-{size}', 'gather_subset': ['state']}),
+    ('lab-present', 'cml_lab', {'lab': 'bench-{size}', 'state': 'present'}),
+    ('node-start', 'cml_node', {'lab': 'bench-{size}-wiped', 'name': 'r1', 'state': 'started'}),
+    ('nodes-start', 'cml_nodes', {'lab': 'bench-{size}-wiped', 'nodes': '{nodes}'}),
+    ('lab-wait', 'cml_lab_wait', {'lab': 'bench-{size}-wiped'}),
+    ('user-present', 'cml_users', {'name': 'bench-{size}', 'user_pass': 'secret'}),
+    ('users-present', 'cml_users', {'users': '{users}'}),
+]
+
+
+def substitute(value, size):
+    if value == '{nodes}':
+        return [{'name': 'r{0}'.format(n + 1), 'state': 'started'} for n in range(size)]
+    if value == '{users}':
+        return [{'name': 'bench-{0}-{1}'.format(size, n + 1), 'user_pass': 'secret'} for n in range(size)]
+    if isinstance(value, str):
+        return value.format(size=size)
+    if isinstance(value, list):
+        return [substitute(item, size) for item in value]
+    return value
+
+
+def collection_path():
+    """Return a directory where the collection in this checkout is importable as cisco.cml."""
+    path = tempfile.mkdtemp(prefix='cml-bench-')
+    os.makedirs(os.path.join(path, 'ansible_collections', 'cisco'))
+    os.symlink(COLLECTION_ROOT, os.path.join(path, 'ansible_collections', 'cisco', 'cml'))
+    return path
+
+
+def run(command, env, workdir):
+    """Run command, return its wall time, peak RSS in MiB, exit status and output."""
+    output_path = os.path.join(workdir, 'output')
+    with open(output_path, 'w') as output:
+        started = time.time()
+        process = subprocess.Popen(command, env=env, stdout=output, stderr=subprocess.STDOUT)
+        dummy, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.time() - started
+    process.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+    with open(output_path) as output:
+        text = output.read()
+    # ru_maxrss is in KiB on Linux
+    return elapsed, usage.ru_maxrss / 1024.0, process.returncode, text
+
+
+def scenario_command(name, module, arguments, size, env, workdir):
+    if module is None:
+        env['CML_LAB'] = arguments['lab'].format(size=size)
+        inventory = os.path.join(workdir, 'bench.cml.yml')
+        with open(inventory, 'w') as f:
+            f.write('plugin: cisco.cml.cml_inventory\n')
+        return ['ansible-inventory', '-i', inventory, '--list']
+    arguments = dict((key, substitute(value, size)) for key, value in arguments.items())
+    arguments.update(host=env['CML_HOST'], username=env['CML_USERNAME'], password=env['CML_PASSWORD'])
+    arguments_path = os.path.join(workdir, '{0}.json'.format(name))
+    with open(arguments_path, 'w') as f:
+        json.dump({'ANSIBLE_MODULE_ARGS': arguments}, f)
+    return [sys.executable, '-m', 'ansible_collections.cisco.cml.plugins.modules.{0}'.format(module), arguments_path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000', help='comma separated node counts (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every API request')
+    parser.add_argument('--labs', type=int, default=0, help='number of additional small labs on the controller')
+    parser.add_argument('--scenarios', help='comma separated scenarios to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per scenario, the fastest is reported')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    selected = args.scenarios.split(',') if args.scenarios else [scenario[0] for scenario in SCENARIOS]
+    unknown = set(selected) - set(scenario[0] for scenario in SCENARIOS)
+    if unknown:
+        parser.error('unknown scenarios: {0}'.format(', '.join(sorted(unknown))))
+
+    controller = mock_cml.Controller(latency=args.latency)
+    for size in sizes:
+        controller.add_lab(mock_cml.make_lab('lab{0:x}0'.format(size), 'bench-{0}'.format(size), size))
+        controller.add_lab(
+            mock_cml.make_lab('lab{0:x}1'.format(size), 'bench-{0}-wiped'.format(size), size, booted=False))
+    for n in range(args.labs):
+        controller.add_lab(mock_cml.make_lab('lab{0:x}2'.format(n), 'other-{0}'.format(n), 2))
+    workdir = tempfile.mkdtemp(prefix='cml-bench-run-')
+    server = mock_cml.serve(controller, cert_dir=workdir)
+
+    path = collection_path()
+    env = dict((key, value) for key, value in os.environ.items() if not key.startswith('CML_'))
+    # requests prefers these over verify=False, which would reject the self-signed certificate
+    env.pop('REQUESTS_CA_BUNDLE', None)
+    env.pop('CURL_CA_BUNDLE', None)
+    env.update(CML_HOST='localhost:{0}'.format(server.server_address[1]),
+               CML_USERNAME='admin',
+               CML_PASSWORD='admin',
+               ANSIBLE_COLLECTIONS_PATH=path,
+               PYTHONPATH=os.pathsep.join([path] + [p for p in [os.environ.get('PYTHONPATH')] if p]))
+
+    results = []
+    print('{0:<16} {1:>6} {2:>9} {3:>9} {4:>9}'.format('scenario', 'nodes', 'wall [s]', 'requests', 'rss [MiB]'))
+    for size in sizes:
+        for name, module, arguments in SCENARIOS:
+            if name not in selected:
+                continue
+            best = None
+            snapshot = controller.snapshot() if args.repeat > 1 else None
+            for repeat in range(args.repeat):
+                if repeat:
+                    controller.restore(snapshot)
+                scenario_env = dict(env)
+                command = scenario_command(name, module, arguments, size, scenario_env, workdir)
+                controller.reset_requests()
+                elapsed, rss, status, output = run(command, scenario_env, workdir)
+                if status != 0:
+                    print('{0} failed for {1} nodes:\n{2}'.format(name, size, output[-2000:]), file=sys.stderr)
+                if best is None or elapsed < best['wall']:
+                    best = dict(scenario=name,
+                                nodes=size,
+                                wall=round(elapsed, 3),
+                                requests=controller.request_count(),
+                                rss=round(rss, 1),
+                                failed=status != 0)
+            results.append(best)
+            print('{scenario:<16} {nodes:>6} {wall:>9.3f} {requests:>9} {rss:>9.1f}{0}'.format(
+                ' FAILED' if best['failed'] else '', **best))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(latency=args.latency, labs=args.labs, results=results), f, indent=2)
+    server.shutdown()
+    return 1 if any(result['failed'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -24,7 +24,9 @@ options:
         required: true
         type: str
     timeout:
-        description: API Timeout
+        description:
+            - Seconds to wait for the response to an API request that is retried when it fails, see I(retries).
+            - Other requests, e.g. to stop, wipe or delete a large lab, wait as long as the controller takes.
         required: false
         type: int
         default: 30
@@ -33,4 +35,64 @@ options:
         required: false
         type: bool
         default: false
+    token_cache:
+        description:
+            - Reuse the API token of the user between tasks instead of logging in for every task (CML_TOKEN_CACHE).
+            - The token is stored in a file only readable by its owner in I(token_cache_dir).
+            - An expired or revoked token is replaced by logging in again once.
+        required: false
+        type: bool
+        default: false
+    token_cache_dir:
+        description: Directory of the token cache (CML_TOKEN_CACHE_DIR)
+        required: false
+        type: path
+        default: ~/.ansible/cml/tokens
+    retries:
+        description:
+            - Number of times an API request is retried after a connection error, a timeout, a 429 or a 5xx
+              response (CML_RETRIES).
+            - Only GET, PUT and DELETE requests and logins are retried, other requests only when they could not
+              connect.  The delay before every retry grows exponentially and is randomized.
+            - With retries, these requests also time out after I(timeout) seconds, so a long running request, e.g.
+              to stop or wipe a large lab, can fail or be sent again while the controller is still working on it.
+        required: false
+        type: int
+        default: 0
+    rate_limit:
+        description:
+            - Maximum number of API requests per second sent to the CML server by all tasks of the user on this
+              machine together, C(0) for no limit (CML_RATE_LIMIT).
+            - The tasks share a token bucket in a file in the temporary directory.
+        required: false
+        type: float
+        default: 0
+    persistent:
+        description:
+            - Send the API calls through a local process that stays logged in to the CML server (CML_PERSISTENT).
+            - The first task starts the process, later tasks with the same host, credentials, I(token_cache),
+              I(retries), I(timeout) and I(rate_limit) reuse its connections instead of connecting and logging in
+              again.
+            - If the process cannot be started, the module connects directly.
+        required: false
+        type: bool
+        default: false
+    persistent_idle_timeout:
+        description: Seconds after which an unused persistent connection process exits (CML_PERSISTENT_IDLE_TIMEOUT)
+        required: false
+        type: int
+        default: 60
+    persistent_dir:
+        description: Directory of the sockets of the persistent connection processes (CML_PERSISTENT_DIR)
+        required: false
+        type: path
+        default: ~/.ansible/cml/persistent
+    metrics:
+        description:
+            - Return the metrics of the API requests made by the task in C(cml_metrics) (CML_METRICS).
+            - Per endpoint, with the ids in the path replaced by C({id}), the number of requests, their total and
+              maximum time in seconds, the bytes received, the count per status code and a latency histogram.
+        required: false
+        type: bool
+        default: false
 '''
@@ -42,39 +42,168 @@ DOCUMENTATION = r'''
             description: user pass for the target system
             required: false
         lab:
-            description: The name of the cml lab
+            description:
+                - The name of the cml lab, or a list of lab names.
+                - Shell-style wildcards such as C(ci-*) select every lab with a matching title.
+            type: list
+            elements: string
+            required: false
+        all_labs:
+            description: Add the nodes of every lab owned by the user, ignoring C(lab)
+            type: bool
+            default: false
+            required: false
+        lab_group_prefix:
+            description: Prefix of the per-lab group that the nodes of each lab are put in
+            type: string
+            default: cml_lab_
+            required: false
+        unique_hostnames:
+            description:
+                - Name hosts C(<lab>_<node>) instead of C(<node>).
+                - Use this when several labs contain nodes with the same label.
+            type: bool
+            default: false
+            required: false
+        max_workers:
+            description: The maximum number of labs fetched from the CML server concurrently
+            type: int
+            default: 8
             required: false
         group:
             description: The name of group in which to put nodes
             required: false
+        include_config:
+            description:
+                - Add the day0 configuration of every node to C(cml_facts.config).
+                - Set to C(false) to fetch the topology without configurations.  Playbooks can still get the
+                  configuration of a node with the C(cisco.cml.cml_node_config) lookup.
+            type: bool
+            default: true
+            required: false
         group_tags:
             description: The list of tags for which to make and populate groups
             type: list
             elements: string
             required: false
+        incremental_refresh:
+            description:
+                - Keep the topology of every lab in memory and, when the inventory is refreshed with the
+                  C(refresh_inventory) meta task, only fetch it again if the lab was modified since.
+                - The node states and addresses are always fetched again.
+            type: bool
+            default: true
+            required: false
+        tag_patterns:
+            description:
+                - Put the nodes with a tag that matches a pattern in a group.
+                - C(pattern) is a regular expression searched in each tag, C(group) is the name of the group and can
+                  refer to the groups of the pattern, e.g. C(\1) or C(\g<name>).  The group name is sanitized.
+            type: list
+            elements: dict
+            required: false
         validate_certs:
             description: certificate validation
             required: false
             choices: ['yes', 'no']
+        token_cache:
+            description:
+                - Reuse the API token of the user instead of logging in on every inventory parse.
+                - The cache is shared with the modules of this collection.
+            type: bool
+            default: false
+            required: false
+            env:
+                - name: CML_TOKEN_CACHE
+        token_cache_dir:
+            description: Directory of the token cache
+            type: path
+            default: ~/.ansible/cml/tokens
+            required: false
+            env:
+                - name: CML_TOKEN_CACHE_DIR
+        metrics_file:
+            description:
+                - Write the metrics of the API requests made to fetch the inventory to this file, as JSON.
+                - The metrics are also shown with C(-vvv).
+            type: path
+            required: false
+            env:
+                - name: CML_METRICS_FILE
+    extends_documentation_fragment:
+        - constructed
+        - inventory_cache
 '''
 
+import fnmatch
+import hashlib
+import json
 import os
-import traceback
 import re
-from ansible.plugins.inventory import BaseInventoryPlugin
+from ansible.plugins.inventory import BaseInventoryPlugin, Cacheable, Constructable
 from ansible.errors import AnsibleError, AnsibleParserError
 from ansible.module_utils._text import to_text
-
-try:
-    from virl2_client import ClientLibrary
-except ImportError:
-    HAS_VIRL2CLIENT = False
-    VIRL2CLIENT_IMPORT_ERROR = traceback.format_exc()
-else:
-    HAS_VIRL2CLIENT = True
-
-
-class InventoryModule(BaseInventoryPlugin):
+from ansible.module_utils.basic import missing_required_lib
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import (HAS_VIRL2CLIENT, CMLMetrics, cml_client,
+                                                                          get_lab_snapshot, get_lab_tiles,
+                                                                          get_lab_topology, set_pool_size)
+from concurrent.futures import ThreadPoolExecutor
+
+# Topologies fetched by this process with the modified time of their lab, reused by later refreshes
+_TOPOLOGIES = {}
+
+
+class TagClassifier(object):
+    """Classify the tags of nodes into host variables, PAT markers and groups.
+
+    All patterns are compiled once.  Every distinct tag is classified the first time it is seen, and
+    nodes sharing a tag reuse that result, so one pass over the tags of a node does all the work.
+    """
+
+    # ansible:<variable>=<number> sets a host variable, pat:[tcp:|udp:]<outside>:<inside> marks a PAT node
+    BUILTIN = re.compile(r"^(?:ansible:(?P<fact>[^=]+)=(?P<value>\d+)$"
+                         r"|pat:(?:tcp|udp)?:?(?P<outside>\d+):(?P<inside>\d+))")
+
+    def __init__(self, group_tags=None, tag_patterns=None, sanitize=None):
+        self.group_tags = frozenset(group_tags or [])
+        self.patterns = [(re.compile(pattern['pattern']), pattern.get('group') or '\\g<0>')
+                         for pattern in tag_patterns or []]
+        self.sanitize = sanitize or (lambda name: name)
+        self._classified = {}
+
+    def _classify_tag(self, tag):
+        facts = []
+        pat = None
+        groups = []
+        match = self.BUILTIN.match(tag)
+        if match and match.group('fact') is not None:
+            facts.append((match.group('fact'), match.group('value')))
+        elif match:
+            pat = (match.group('outside'), match.group('inside'))
+        if tag in self.group_tags:
+            groups.append(tag)
+        for pattern, group in self.patterns:
+            match = pattern.search(tag)
+            if match:
+                groups.append(self.sanitize(match.expand(group)))
+        return facts, pat, groups
+
+    def classify(self, tags):
+        """Return the host variables, the first PAT ports or None, and the groups of a node with these tags."""
+        facts = []
+        pat = None
+        groups = []
+        for tag in tags:
+            classified = self._classified.get(tag)
+            if classified is None:
+                classified = self._classified[tag] = self._classify_tag(tag)
+            facts.extend(classified[0])
+            pat = pat or classified[1]
+            groups.extend(group for group in classified[2] if group not in groups)
+        return facts, pat, groups
+
+
+class InventoryModule(BaseInventoryPlugin, Constructable, Cacheable):
 
     NAME = 'cisco.cml.cml_inventory'
 
@@ -86,7 +215,10 @@ class InventoryModule(BaseInventoryPlugin):
         self.password = None
         self.host = None
         self.lab = None
+        self.all_labs = False
         self.group = None
+        self.classifier = None
+        self._tiles = None
 
     def verify_file(self, path):
 
@@ -97,6 +229,14 @@ class InventoryModule(BaseInventoryPlugin):
         self.display.debug("cml inventory filename must end with 'cml.yml' or 'cml.yaml'")
         return False
 
+    def get_cache_key(self, path):
+        # The same inventory file can point at another controller, user or lab
+        # through the CML_* environment variables, so those are part of the key
+        key = super(InventoryModule, self).get_cache_key(path)
+        options = '{0}|{1}|{2}|{3}|{4}|{5}'.format(self.host, self.username, ','.join(self.lab or []), self.all_labs,
+                                                    self.group, self.get_option('include_config'))
+        return '{0}_{1}'.format(key, hashlib.sha256(options.encode('utf-8')).hexdigest()[:8])
+
     def parse(self, inventory, loader, path, cache=True):
 
         # call base method to ensure properties are available for use with other helper methods
@@ -132,13 +272,14 @@ class InventoryModule(BaseInventoryPlugin):
             self.password = self.get_option('password')
 
         if 'CML_LAB' in os.environ and len(os.environ['CML_LAB']):
-            self.lab = os.environ['CML_LAB']
+            self.lab = [os.environ['CML_LAB']]
         else:
             self.lab = self.get_option('lab')
 
         self.display.vvv("cml.py - CML_LAB: {0}".format(self.lab))
 
-        if not self.lab:
+        self.all_labs = self.get_option('all_labs')
+        if not self.lab and not self.all_labs:
             self.display.vvv("No lab defined.  Nothing to do.")
             return
 
@@ -155,101 +296,252 @@ class InventoryModule(BaseInventoryPlugin):
         self.inventory.set_variable('all', 'cml_host', self.host)
         self.inventory.set_variable('all', 'cml_username', self.username)
         self.inventory.set_variable('all', 'cml_password', self.password)
-        self.inventory.set_variable('all', 'cml_lab', self.lab)
-
-        url = 'https://{0}'.format(self.host)
-        client = ClientLibrary(url, username=self.username, password=self.password, ssl_verify=False)
-
-        labs = (client.find_labs_by_title(self.lab))
-        if not labs:
+        if self.lab and len(self.lab) == 1:
+            self.inventory.set_variable('all', 'cml_lab', self.lab[0])
+
+        cache_key = self.get_cache_key(path)
+        # cache may be True or False at this point to indicate if the inventory is being refreshed
+        # get the user's cache option too to see if we should save the cache if it is changing
+        user_cache_setting = self.get_option('cache')
+        # read if the user has caching enabled and the cache isn't being refreshed
+        attempt_to_read_cache = user_cache_setting and cache
+        # update if the user has caching enabled and the cache is being refreshed
+        cache_needs_update = user_cache_setting and not cache
+
+        lab_data = None
+        if attempt_to_read_cache:
+            try:
+                lab_data = self._cache[cache_key]
+                self.display.vvv("cml.py - Using cached inventory for {0}".format(','.join(self.lab or ['all labs'])))
+            except KeyError:
+                # if cache expires or cache file doesn't exist
+                cache_needs_update = True
+
+        if lab_data is None:
+            lab_data = self._get_lab_data()
+
+        if cache_needs_update:
+            self._cache[cache_key] = lab_data
+
+        if not lab_data['labs']:
             return
 
-        group = "None"
         try:
-            group = self.inventory.add_group(self.group)
-        except AnsibleError as e:
-            raise AnsibleParserError("Unable to add group %s: %s" % (group, to_text(e)))
-        group_dict = {}
-
-        lab = labs[0]
-        lab.sync()
-        for node in lab.nodes():
-            self.inventory.add_host(node.label, group=self.group)
+            self.classifier = TagClassifier(self.group_tags, self.get_option('tag_patterns'), self._sanitize_group_name)
+        except (re.error, KeyError, TypeError) as e:
+            raise AnsibleParserError("Invalid tag_patterns: {0}".format(to_text(e)))
+        self._populate(lab_data)
+
+    def _find_lab_ids(self, client):
+        """Return the ids of the labs selected by the lab and all_labs options, in order."""
+        self._tiles = None
+        if self.all_labs:
+            # Without show_all the controller only returns the labs owned by the user
+            return client.get_lab_list()
+
+        tiles = self._tiles = get_lab_tiles(client)
+
+        lab_ids = []
+        for pattern in self.lab:
+            matches = [lab_id for lab_id, tile in tiles.items() if fnmatch.fnmatchcase(tile['lab_title'], pattern)]
+            if not any(c in pattern for c in '*?['):
+                # A plain title only selects the first lab with that title
+                matches = matches[:1]
+            for lab_id in matches:
+                if lab_id not in lab_ids:
+                    lab_ids.append(lab_id)
+        return lab_ids
+
+    def _get_lab_data(self):
+        """Fetch the nodes of the selected labs from the CML controller.
+
+        The labs are synced on a bounded thread pool.  The result only holds plain
+        data so that it can be stored in the inventory cache.
+        """
+        if not HAS_VIRL2CLIENT:
+            raise AnsibleError(missing_required_lib('virl2_client'))
+
+        token_cache_dir = self.get_option('token_cache_dir') if self.get_option('token_cache') else None
+        metrics = CMLMetrics()
+        try:
+            client = cml_client(self.host,
+                                self.username,
+                                self.password,
+                                token_cache_dir=token_cache_dir,
+                                metrics=metrics)
+
+            lab_ids = self._find_lab_ids(client)
+            self.display.vvv("cml.py - Found {0} lab(s)".format(len(lab_ids)))
+            if not lab_ids:
+                return {'labs': []}
+
+            modified = self._lab_modified(client, lab_ids)
+            max_workers = max(1, min(self.get_option('max_workers'), len(lab_ids)))
+            # Give every worker its own pooled connection to the controller
+            set_pool_size(client, max_workers)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                labs = list(
+                    executor.map(lambda lab_id: self._get_lab_nodes(client, lab_id, modified.get(lab_id)), lab_ids))
+            return {'labs': labs}
+        finally:
+            self._report_metrics(metrics)
+
+    def _report_metrics(self, metrics):
+        for line in metrics.summary():
+            self.display.vvv("cml.py - {0}".format(line))
+        metrics_file = self.get_option('metrics_file')
+        if metrics_file:
+            try:
+                with open(metrics_file, 'w') as f:
+                    json.dump(metrics.as_dict(), f, indent=2, sort_keys=True)
+            except (IOError, OSError) as e:
+                self.display.warning("cml.py - Cannot write metrics to {0}: {1}".format(metrics_file, to_text(e)))
+
+    def _lab_modified(self, client, lab_ids):
+        """Return a dict of lab id to the time the lab was last modified, from the lab tiles."""
+        if not self.get_option('incremental_refresh'):
+            return {}
+        if self._tiles is None:
+            # With all_labs the labs were listed without their tiles
+            self._tiles = get_lab_tiles(client)
+        return dict((lab_id, self._tiles.get(lab_id, {}).get('modified')) for lab_id in lab_ids)
+
+    def _topology_key(self, lab_id):
+        return (self.host, self.username, lab_id, self.get_option('include_config'))
+
+    def _get_lab_topology(self, client, lab_id, modified):
+        """Return the topology of a lab, reusing the one kept from an earlier parse if the lab was not modified."""
+        include_config = self.get_option('include_config')
+        if not self.get_option('incremental_refresh'):
+            return get_lab_topology(client, lab_id, include_config)
+        key = self._topology_key(lab_id)
+        kept = _TOPOLOGIES.get(key)
+        if kept is not None and modified is not None and kept['modified'] == modified:
+            self.display.vvv("cml.py - Lab {0} was not modified, reusing its topology".format(lab_id))
+            return kept['topology']
+        # The modified time comes from the tile fetched before the topology, so a change in between refetches it
+        topology = get_lab_topology(client, lab_id, include_config)
+        if modified is not None:
+            _TOPOLOGIES[key] = dict(modified=modified, topology=topology)
+        return topology
+
+    def _get_lab_nodes(self, client, lab_id, modified=None):
+        include_config = self.get_option('include_config')
+        lab = get_lab_snapshot(client,
+                               lab_id,
+                               configurations=include_config,
+                               statistics=False,
+                               topology=self._get_lab_topology(client, lab_id, modified))
+        nodes = []
+        for node in lab['nodes']:
             cml = {
-                'state': node.state,
-                'image_definition': node.image_definition,
-                'node_definition': node.node_definition,
-                'cpus': node.cpus,
-                'ram': node.ram,
-                'config': node.config,
-                'data_volume': node.data_volume,
+                'state': node['state'],
+                'image_definition': node['image_definition'],
+                'node_definition': node['node_definition'],
+                'cpus': node['cpus'],
+                'ram': node['ram'],
+                'data_volume': node['data_volume'],
             }
+            if include_config:
+                cml['config'] = node['config']
             interface_list = []
-            ansible_host = None
-            ansible_port = None
-            # pat_regex_list = [r"^pat:tcp:(\d+):22", r"^pat:(\d+):22"]
-            for tag in node.tags():
-                fact_match = re.search(r"^ansible:([^=]+)=(\d+)$", tag)
-                pat_match = re.search(r"^pat:(?:tcp|udp)?:?(\d+):(\d+)", tag)
-                if fact_match:
-                    self.display.vvv("Add fact to node {0}: {1}={2}".format(node.label, fact_match.group(1), fact_match.group(2)))
-                    self.inventory.set_variable(node.label, fact_match.group(1), fact_match.group(2))
-                # for regex_pattern in pat_regex_list:
-                #     # Use re.search to find a match
-                elif pat_match:
-                    self.display.vvv("Found PAT: outside_port={0}, inside_port={1}".format(pat_match.group(1), pat_match.group(2)))
-                    # Extract values from capture groups
-                    # outside_port = match.group(1)
-                    ansible_host = self.host
-                    # ansible_port = match.group(1)
-                    # break  # Exit the inner loop once a match is found
-                else:
-                    continue  # Continue with the next string if no match was found
-            for interface in node.interfaces():
-                if node.state == 'BOOTED':
+            for interface in node['interfaces']:
+                if node['state'] == 'BOOTED':
                     # Fill out the oper data if the node is not fully booted
                     interface_dict = {
-                        'name': interface.label,
-                        'state': interface.state,
-                        'ipv4_addresses': interface.discovered_ipv4,
-                        'ipv6_addresses': interface.discovered_ipv6,
-                        'mac_address': interface.discovered_mac_address
+                        'name': interface['label'],
+                        'state': interface['state'],
+                        'ipv4_addresses': interface['ipv4_addresses'],
+                        'ipv6_addresses': interface['ipv6_addresses'],
+                        'mac_address': interface['mac_address']
                     }
-                    # See if we can use this for ansible_host
-                    if interface.discovered_ipv4 and not ansible_host:
-                        ansible_host = interface.discovered_ipv4[0]
                 else:
                     # Otherwise, set oper data to empty
                     interface_dict = {
-                        'name': interface.label,
-                        'state': interface.state,
+                        'name': interface['label'],
+                        'state': interface['state'],
                         'ipv4_addresses': [],
                         'ipv6_addresses': [],
                         'mac_address': None
                     }
                 interface_list.append(interface_dict)
             cml.update({'interfaces': interface_list})
-            if ansible_host:
-                self.inventory.set_variable(node.label, 'ansible_host', ansible_host)
-            if ansible_port:
-                self.inventory.set_variable(node.label, 'ansible_port', ansible_port)
-            self.inventory.set_variable(node.label, 'cml_facts', cml)
-            self.display.vvv("Adding {0}({1}) to group {2}, state: {3}, ansible_host: {4}".format(
-                node.label, node.node_definition, self.group, node.state, ansible_host))
-            # Group by node_definition
-            if node.node_definition not in group_dict:
+            nodes.append({'label': node['label'], 'tags': node['tags'], 'cml_facts': cml})
+        return {'id': lab['id'], 'title': lab['title'], 'nodes': nodes}
+
+    def _populate(self, lab_data):
+        group = "None"
+        try:
+            group = self.inventory.add_group(self.group)
+        except AnsibleError as e:
+            raise AnsibleParserError("Unable to add group %s: %s" % (group, to_text(e)))
+        group_dict = {}
+        hosts = {}
+
+        for lab in lab_data['labs']:
+            lab_group = self._sanitize_group_name('{0}{1}'.format(self.get_option('lab_group_prefix'), lab['title']))
+            try:
+                group_dict[lab_group] = self.inventory.add_group(lab_group)
+            except AnsibleError as e:
+                raise AnsibleParserError("Unable to add group %s: %s" % (lab_group, to_text(e)))
+            for node in lab['nodes']:
+                if self.get_option('unique_hostnames'):
+                    label = re.sub(r'[^\w.-]', '_', '{0}_{1}'.format(lab['title'], node['label']))
+                else:
+                    label = node['label']
+                if label in hosts:
+                    self.display.warning("Host {0} is in both lab {1} and lab {2}, its variables are overwritten. "
+                                         "Set unique_hostnames to keep both".format(label, hosts[label], lab['title']))
+                hosts[label] = lab['title']
+                self._populate_node(label, node, lab, group_dict)
+                self.inventory.add_host(label, group=lab_group)
+
+    def _populate_node(self, label, node, lab, group_dict):
+        cml = node['cml_facts']
+        self.inventory.add_host(label, group=self.group)
+        self.inventory.set_variable(label, 'cml_lab', lab['title'])
+        self.inventory.set_variable(label, 'cml_node_label', node['label'])
+        ansible_host = None
+        ansible_port = None
+        facts, pat, tag_groups = self.classifier.classify(node['tags'])
+        for name, value in facts:
+            self.display.vvv("Add fact to node {0}: {1}={2}".format(label, name, value))
+            self.inventory.set_variable(label, name, value)
+        if pat:
+            self.display.vvv("Found PAT: outside_port={0}, inside_port={1}".format(*pat))
+            # ansible_port is set with an ansible:ansible_port=<outside port> tag
+            ansible_host = self.host
+        for interface in cml['interfaces']:
+            # See if we can use this for ansible_host
+            if interface['ipv4_addresses'] and not ansible_host:
+                ansible_host = interface['ipv4_addresses'][0]
+        if ansible_host:
+            self.inventory.set_variable(label, 'ansible_host', ansible_host)
+        if ansible_port:
+            self.inventory.set_variable(label, 'ansible_port', ansible_port)
+        self.inventory.set_variable(label, 'cml_facts', cml)
+        self.display.vvv("Adding {0}({1}) to group {2}, state: {3}, ansible_host: {4}".format(
+            label, cml['node_definition'], self.group, cml['state'], ansible_host))
+        # Group by node_definition
+        if cml['node_definition'] not in group_dict:
+            try:
+                group_dict[cml['node_definition']] = self.inventory.add_group(cml['node_definition'])
+            except AnsibleError as e:
+                raise AnsibleParserError("Unable to add group %s: %s" % (cml['node_definition'], to_text(e)))
+        self.inventory.add_host(label, group=cml['node_definition'])
+        # Add the host to the groups of its tags
+        for group in tag_groups:
+            if group not in group_dict:
                 try:
-                    group_dict[node.node_definition] = self.inventory.add_group(node.node_definition)
+                    group_dict[group] = self.inventory.add_group(group)
                 except AnsibleError as e:
                     raise AnsibleParserError("Unable to add group %s: %s" % (group, to_text(e)))
-            self.inventory.add_host(node.label, group=node.node_definition)
-            # Find the group to create and add this host to
-            if self.group_tags:
-                for group in list(set(self.group_tags) & set(node.tags())):
-                    if group not in group_dict:
-                        try:
-                            group_dict[group] = self.inventory.add_group(group)
-                        except AnsibleError as e:
-                            raise AnsibleParserError("Unable to add group %s: %s" % (group, to_text(e)))
-                    self.inventory.add_host(node.label, group=group)
-                    self.display.vvv("Adding {0} to group {1}".format(node.label, group))
+            self.inventory.add_host(label, group=group)
+            self.display.vvv("Adding {0} to group {1}".format(label, group))
+        self.inventory.set_variable(label, 'cml_tags', node['tags'])
+        if self.get_option('compose') or self.get_option('groups') or self.get_option('keyed_groups'):
+            hostvars = self.inventory.get_host(label).get_vars()
+            strict = self.get_option('strict')
+            self._set_composite_vars(self.get_option('compose'), hostvars, label, strict=strict)
+            self._add_host_to_composed_groups(self.get_option('groups'), hostvars, label, strict=strict)
+            self._add_host_to_keyed_groups(self.get_option('keyed_groups'), hostvars, label, strict=strict)
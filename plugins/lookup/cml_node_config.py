@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+    name: cml_node_config
+    short_description: Returns the configuration of CML nodes
+    description:
+        - Returns the day0 configuration of the nodes of a CML lab, fetched when the lookup is used.
+        - The configurations of all nodes of the lab are fetched with one request and kept in a local cache
+          for I(cache_timeout) seconds, so that the lookups of other hosts and tasks do not fetch them again.
+        - Together with the C(include_config) option of the inventory plugin, configurations are only
+          fetched by the playbooks that use them.
+    options:
+        _terms:
+            description: The names of the nodes
+            required: true
+        lab:
+            description: The name of the CML lab
+            type: string
+            required: true
+            vars:
+                - name: cml_lab
+            env:
+                - name: CML_LAB
+        host:
+            description: FQDN of the CML server
+            type: string
+            required: true
+            vars:
+                - name: cml_host
+            env:
+                - name: CML_HOST
+        username:
+            description: user credential for the CML server
+            type: string
+            required: true
+            vars:
+                - name: cml_username
+            env:
+                - name: CML_USERNAME
+        password:
+            description: user pass for the CML server
+            type: string
+            required: true
+            vars:
+                - name: cml_password
+            env:
+                - name: CML_PASSWORD
+        token_cache:
+            description: Reuse the API token of the user, shared with the modules and the inventory plugin
+            type: bool
+            default: false
+            env:
+                - name: CML_TOKEN_CACHE
+        token_cache_dir:
+            description: Directory of the token cache
+            type: path
+            default: ~/.ansible/cml/tokens
+            env:
+                - name: CML_TOKEN_CACHE_DIR
+        cache_dir:
+            description: Directory of the configuration cache, only readable by its owner
+            type: path
+            default: ~/.ansible/cml/configs
+            env:
+                - name: CML_CONFIG_CACHE_DIR
+        cache_timeout:
+            description:
+                - Seconds the cached configurations of a lab are used.
+                - C(0) disables the cache, the configurations are then fetched once per task.
+            type: int
+            default: 600
+            env:
+                - name: CML_CONFIG_CACHE_TIMEOUT
+'''
+
+EXAMPLES = r'''
+- name: Save the configuration of every node
+  hosts: cml_hosts
+  gather_facts: no
+  tasks:
+    - name: Write the configuration
+      copy:
+        content: "{{ lookup('cisco.cml.cml_node_config', cml_node_label) }}"
+        dest: "configs/{{ inventory_hostname }}.cfg"
+      delegate_to: localhost
+'''
+
+RETURN = r'''
+    _raw:
+        description: The configuration of each node, an empty string for nodes without a configuration
+        type: list
+        elements: str
+'''
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_text
+from ansible.module_utils.basic import missing_required_lib
+from ansible.plugins.lookup import LookupBase
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import (HAS_VIRL2CLIENT, cml_api_get, cml_client,
+                                                                          get_lab_tiles)
+
+
+class CMLConfigCache(object):
+    """Node configurations of one lab, stored in a file only readable by its owner."""
+
+    def __init__(self, directory, host, username, lab, timeout):
+        self.directory = os.path.expanduser(directory)
+        key = hashlib.sha256('{0}\0{1}\0{2}'.format(host, username, lab).encode('utf-8')).hexdigest()
+        self.path = os.path.join(self.directory, '{0}.json'.format(key))
+        self.timeout = timeout
+
+    def lock(self):
+        """Return an open, exclusively locked file that serializes the fetches of this lab."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, 0o700)
+        lock = open(self.path + '.lock', 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get('fetched', 0) + self.timeout < time.time():
+            return None
+        return data.get('configs')
+
+    def save(self, configs):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.configs')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(fetched=time.time(), configs=configs), f)
+            # mkstemp already creates the file with 0600 permissions
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            # The cache is an optimization only
+            pass
+
+
+class LookupModule(LookupBase):
+
+    def run(self, terms, variables=None, **kwargs):
+        self.set_options(var_options=variables, direct=kwargs)
+        if not HAS_VIRL2CLIENT:
+            raise AnsibleError(missing_required_lib('virl2_client'))
+
+        lab = self.get_option('lab')
+        cache = None
+        if self.get_option('cache_timeout') > 0:
+            cache = CMLConfigCache(self.get_option('cache_dir'), self.get_option('host'), self.get_option('username'),
+                                   lab, self.get_option('cache_timeout'))
+        configs = self._get_configs(cache)
+        if configs is None:
+            raise AnsibleError("Cannot find lab {0}".format(lab))
+        if any(term not in configs for term in terms) and cache is not None:
+            # The lab may have changed since the configurations were cached
+            configs = self._get_configs(cache, refresh=True)
+
+        ret = []
+        for term in terms:
+            if term not in configs:
+                raise AnsibleError("Cannot find node {0} in lab {1}".format(term, lab))
+            ret.append(configs[term] or '')
+        return ret
+
+    def _get_configs(self, cache, refresh=False):
+        """Return a dict of node label to configuration, or None if there is no such lab."""
+        if cache is None:
+            return self._fetch_configs()
+        # Only one of the lookups running at the same time in other forks fetches the configurations
+        try:
+            lock = cache.lock()
+        except (IOError, OSError) as e:
+            self._display.warning("Cannot use the CML configuration cache: {0}".format(to_text(e)))
+            return self._fetch_configs()
+        try:
+            configs = None if refresh else cache.load()
+            if configs is None:
+                configs = self._fetch_configs()
+                if configs is not None:
+                    cache.save(configs)
+            return configs
+        finally:
+            lock.close()
+
+    def _fetch_configs(self):
+        token_cache_dir = self.get_option('token_cache_dir') if self.get_option('token_cache') else None
+        try:
+            client = cml_client(self.get_option('host'),
+                                self.get_option('username'),
+                                self.get_option('password'),
+                                token_cache_dir=token_cache_dir)
+            lab_ids = [lab_id for lab_id, tile in get_lab_tiles(client).items()
+                       if tile['lab_title'] == self.get_option('lab')]
+            if not lab_ids:
+                return None
+            topology = cml_api_get(client, 'labs/{0}/topology'.format(lab_ids[0]))
+        except Exception as e:
+            raise AnsibleError("Cannot fetch the node configurations from CML: {0}".format(to_text(e)))
+        self._display.vvv("cml_node_config - fetched the configurations of lab {0}".format(self.get_option('lab')))
+        return dict((node['label'], node.get('configuration')) for node in topology['nodes'])
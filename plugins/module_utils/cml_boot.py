@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Boot the nodes of a CML lab in waves.
+
+Starting a lab asks the controller to boot all of its nodes at once.  Here the nodes are split into
+waves, the nodes of a wave are started with at most a given number booting at the same time, and the
+next wave is started once all nodes of the previous one have booted.  The node states are polled with
+one request per poll for the whole lab.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+import time
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import Backoff, cml_api_get
+
+START_STRATEGIES = ['all', 'tags', 'weight', 'links']
+
+# Node definitions that other nodes depend on for their links
+LINK_ROOTS = ['external_connector', 'unmanaged_switch']
+
+
+def _tag_waves(nodes, tags):
+    """One wave per tag in the order given, the nodes without any of the tags last."""
+    waves = [[] for dummy in range(len(tags or []) + 1)]
+    for node in nodes:
+        node_tags = node.get('tags') or []
+        index = [i for i, tag in enumerate(tags or []) if tag in node_tags]
+        waves[index[0] if index else -1].append(node['id'])
+    return waves
+
+
+def _weight_waves(nodes, weights):
+    """One wave per distinct (cpus, ram) of the nodes, the heaviest first."""
+    waves = {}
+    for node in nodes:
+        waves.setdefault(weights[node['id']], []).append(node['id'])
+    return [waves[weight] for weight in sorted(waves, reverse=True)]
+
+
+def link_endpoints(topology):
+    """Return a dict of link id to the ids of the two nodes it connects."""
+    node_of = {}
+    for node in topology['nodes']:
+        for interface in node.get('interfaces') or []:
+            node_of[interface['id']] = node['id']
+    endpoints = {}
+    for link in topology.get('links') or []:
+        a = node_of.get(link.get('interface_a', link.get('i1')))
+        b = node_of.get(link.get('interface_b', link.get('i2')))
+        if a is not None and b is not None:
+            endpoints[link['id']] = (a, b)
+    return endpoints
+
+
+def _link_waves(nodes, endpoints, tags):
+    """Breadth first from the root nodes over the links, the nodes without links last.
+
+    The roots are the nodes with one of tags, or else external connectors and unmanaged switches, or
+    else the nodes with the most links.
+    """
+    neighbors = dict((node['id'], set()) for node in nodes)
+    for a, b in endpoints.values():
+        if a != b:
+            neighbors[a].add(b)
+            neighbors[b].add(a)
+
+    linked = [node for node in nodes if neighbors[node['id']]]
+    roots = [node['id'] for node in linked if set(node.get('tags') or []) & set(tags or [])]
+    if not roots:
+        roots = [node['id'] for node in linked if node['node_definition'] in LINK_ROOTS]
+    if not roots and linked:
+        most = max(len(neighbors[node['id']]) for node in linked)
+        roots = [node['id'] for node in linked if len(neighbors[node['id']]) == most]
+
+    waves = []
+    seen = set(roots)
+    wave = roots
+    while wave:
+        waves.append(wave)
+        wave = sorted(set(neighbor for node_id in wave for neighbor in neighbors[node_id]) - seen)
+        seen.update(wave)
+    # Nodes that cannot be reached from the roots, e.g. islands, go last
+    rest = [node['id'] for node in nodes if node['id'] not in seen]
+    if rest:
+        waves.append(rest)
+    return waves
+
+
+def node_weights(client, nodes):
+    """Return a dict of node id to (cpus, ram), from the node definitions for nodes that use their defaults."""
+    defaults = {}
+    weights = {}
+    for node in nodes:
+        cpus, ram = node.get('cpus'), node.get('ram')
+        if cpus is None or ram is None:
+            definition = node['node_definition']
+            if definition not in defaults:
+                sim = cml_api_get(client, 'node_definitions/{0}'.format(definition)).get('sim') or {}
+                native = sim.get('linux_native') or {}
+                defaults[definition] = (native.get('cpus') or 0, native.get('ram') or 0)
+            cpus = defaults[definition][0] if cpus is None else cpus
+            ram = defaults[definition][1] if ram is None else ram
+        weights[node['id']] = (cpus, ram)
+    return weights
+
+
+def boot_waves(client, topology, strategy, tags=None):
+    """Return the waves to boot the nodes of a topology in, as lists of node ids."""
+    nodes = topology['nodes']
+    if strategy == 'tags':
+        waves = _tag_waves(nodes, tags)
+    elif strategy == 'weight':
+        waves = _weight_waves(nodes, node_weights(client, nodes))
+    elif strategy == 'links':
+        waves = _link_waves(nodes, link_endpoints(topology), tags)
+    else:
+        waves = [[node['id'] for node in nodes]]
+    return [wave for wave in waves if wave]
+
+
+class StagedBoot(object):
+    """Start the nodes of a lab wave by wave, with at most max_booting nodes booting at the same time.
+
+    Once a wave has booted, the links between the nodes booted so far are started, endpoints maps the
+    link ids to the ids of their nodes.
+    """
+
+    def __init__(self, client, lab_id, waves, endpoints, max_booting=0, delay=1.0, max_delay=10.0):
+        self.client = client
+        self.lab_id = lab_id
+        self.waves = waves
+        self.endpoints = endpoints
+        self.max_booting = max_booting
+        self.delay = delay
+        self.max_delay = max_delay
+        self.states = {}
+        self.link_states = {}
+        self.results = []
+        self.pending = []
+
+    def _url(self, path):
+        return '{0}labs/{1}/{2}'.format(self.client._base_url, self.lab_id, path)
+
+    def _put(self, path):
+        response = self.client.session.put(self._url(path))
+        response.raise_for_status()
+
+    def poll(self):
+        """Fetch the node and link states, return whether any node changed its state."""
+        states = cml_api_get(self.client, 'labs/{0}/lab_element_state'.format(self.lab_id))
+        changed = states.get('nodes', {}) != self.states
+        self.states = states.get('nodes', {})
+        self.link_states = states.get('links', {})
+        return changed
+
+    def start_links(self):
+        """Start the links whose nodes have both booted."""
+        for link_id, (a, b) in sorted(self.endpoints.items()):
+            if (self.link_states.get(link_id) != 'STARTED' and self.states.get(a) == 'BOOTED'
+                    and self.states.get(b) == 'BOOTED'):
+                self._put('links/{0}/state/start'.format(link_id))
+                self.link_states[link_id] = 'STARTED'
+
+    def run_wave(self, wave, deadline, wait=True):
+        """Start the nodes of a wave and wait until they have booted, return the nodes that did not."""
+        queue = [node_id for node_id in wave if self.states.get(node_id) not in ('STARTED', 'QUEUED', 'BOOTED')]
+        started = set()
+        backoff = Backoff(self.delay, self.max_delay)
+        while True:
+            booting = [node_id for node_id in wave
+                       if (node_id in started and self.states.get(node_id) != 'BOOTED')
+                       or self.states.get(node_id) in ('STARTED', 'QUEUED')]
+            while queue and (not self.max_booting or len(booting) < self.max_booting):
+                node_id = queue.pop(0)
+                self._put('nodes/{0}/state/start'.format(node_id))
+                started.add(node_id)
+                booting.append(node_id)
+            pending = [node_id for node_id in wave if self.states.get(node_id) != 'BOOTED']
+            if not pending or (not wait and not queue) or time.time() > deadline:
+                return pending
+            time.sleep(min(backoff.next(), max(deadline - time.time(), 0)))
+            if self.poll():
+                backoff.reset()
+
+    def run(self, timeout, wait=True, labels=None):
+        """Boot the waves, without waiting for the last one unless wait is set, and start the links.
+
+        Results per wave, with the node labels from labels, are kept in results and the nodes that did
+        not boot in pending.
+        """
+        labels = labels or {}
+        deadline = time.time() + timeout
+        self.poll()
+        for index, wave in enumerate(self.waves):
+            started = time.time()
+            last = index == len(self.waves) - 1
+            pending = self.run_wave(wave, deadline, wait or not last)
+            self.results.append(dict(nodes=[labels.get(node_id, node_id) for node_id in wave],
+                                     seconds=round(time.time() - started, 1)))
+            if pending and (wait or not last):
+                self.pending = [labels.get(node_id, node_id) for node_id in pending]
+                return
+            if not last:
+                self.start_links()
+        # The links, and any node added since the waves were planned, start with the lab
+        self._put('start')
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Persistent connections to a CML controller.
+
+Every module runs in a new process, so each task would otherwise connect, negotiate TLS
+and authenticate again.  In persistent mode the first task forks a local daemon that
+holds one authenticated, pooled client per controller, credentials and client settings.  The daemon
+is only forked from module processes, never from the Ansible worker.  The modules forward
+their HTTP requests to it over a unix socket, and the daemon exits after being idle for
+a while.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+import base64
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import traceback
+
+REQUESTS_IMPORT_ERROR = None
+try:
+    from requests.adapters import BaseAdapter
+    from requests.exceptions import ConnectTimeout, ReadTimeout
+    from requests.models import Response
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+except ImportError:
+    HAS_REQUESTS = False
+    REQUESTS_IMPORT_ERROR = traceback.format_exc()
+    BaseAdapter = object
+else:
+    HAS_REQUESTS = True
+
+DEFAULT_PERSISTENT_DIR = os.path.join('~', '.ansible', 'cml', 'persistent')
+
+# How long a module waits for a new daemon to log in and listen, and for a socket by default
+CONNECT_TIMEOUT = 30
+
+_HEADER = struct.Struct('!I')
+
+
+def _send_message(sock, message):
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError('CML persistent connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv_message(sock):
+    size = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))[0]
+    return json.loads(_recv_exactly(sock, size).decode('utf-8'))
+
+
+def _encode_body(body):
+    if body is None:
+        return None
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    return base64.b64encode(body).decode('ascii')
+
+
+def socket_path(directory, host, username, password, settings=()):
+    """Return the daemon socket for these credentials and client settings.
+
+    The password is part of the key so that a daemon is never used with other credentials
+    than the ones it logged in with, and the settings, e.g. the retries, so that it is never
+    used with other settings than the ones its client was created with.
+    """
+    key = hashlib.sha256('{0}\0{1}\0{2}\0{3}'.format(host, username, password,
+                                                     json.dumps(list(settings))).encode('utf-8')).hexdigest()
+    return os.path.join(os.path.expanduser(directory), '{0}.sock'.format(key[:32]))
+
+
+class CMLPersistentAdapter(BaseAdapter):
+    """Requests transport adapter that sends every request through the local daemon.
+
+    A request with a timeout is sent by the daemon with that timeout and waited for as long, other
+    requests are waited for timeout seconds, which should cover the retries of the daemon, or as long
+    as they take when timeout is None, like they would on a direct connection.
+    """
+
+    def __init__(self, path, timeout=None):
+        super(CMLPersistentAdapter, self).__init__()
+        self.path = path
+        self.timeout = timeout
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if isinstance(timeout, tuple):
+            timeout = timeout[1]
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(CONNECT_TIMEOUT)
+            try:
+                sock.connect(self.path)
+            except socket.timeout:
+                raise ConnectTimeout('CML persistent connection timed out', request=request)
+            sock.settimeout(timeout or self.timeout)
+            try:
+                _send_message(sock, dict(method=request.method,
+                                         url=request.url,
+                                         headers=dict(request.headers),
+                                         body=_encode_body(request.body),
+                                         timeout=timeout))
+                result = _recv_message(sock)
+            except socket.timeout:
+                raise ReadTimeout('CML persistent connection timed out', request=request)
+        finally:
+            sock.close()
+        if 'error' in result:
+            raise IOError('CML persistent connection: {0}'.format(result['error']))
+
+        response = Response()
+        response.status_code = result['status']
+        response.reason = result['reason']
+        response.headers = CaseInsensitiveDict(result['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response._content = base64.b64decode(result['body'])
+        response._content_consumed = True
+        return response
+
+    def close(self):
+        pass
+
+
+class CMLConnectionServer(object):
+    """The daemon side: serves requests from modules with one logged in client."""
+
+    def __init__(self, path, client, idle_timeout):
+        self.path = path
+        self.client = client
+        self.idle_timeout = idle_timeout
+        self.last_activity = time.time()
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def handle(self, conn):
+        with self.lock:
+            self.active += 1
+        try:
+            request = _recv_message(conn)
+            if not request['url'].startswith(self.client._base_url):
+                result = dict(error='{0} is not on {1}'.format(request['url'], self.client._base_url))
+            else:
+                headers = dict((k, v) for k, v in request['headers'].items()
+                               if k.lower() not in ('authorization', 'content-length', 'host'))
+                body = base64.b64decode(request['body']) if request['body'] is not None else None
+                try:
+                    # The handler threads share the session, CMLTokenAuth logs in again once for all of them
+                    response = self.client.session.request(request['method'], request['url'], headers=headers,
+                                                           data=body, allow_redirects=False,
+                                                           timeout=request.get('timeout'))
+                except Exception as e:
+                    result = dict(error=str(e))
+                else:
+                    result = dict(status=response.status_code,
+                                  reason=response.reason,
+                                  headers=dict(response.headers),
+                                  body=_encode_body(response.content))
+            _send_message(conn, result)
+        except (EOFError, IOError, OSError, ValueError):
+            pass
+        finally:
+            conn.close()
+            with self.lock:
+                self.active -= 1
+                self.last_activity = time.time()
+
+    def serve(self, listener):
+        listener.settimeout(1)
+        while True:
+            try:
+                conn, dummy = listener.accept()
+            except socket.timeout:
+                with self.lock:
+                    if not self.active and time.time() - self.last_activity > self.idle_timeout:
+                        break
+                continue
+            with self.lock:
+                self.last_activity = time.time()
+            # Only the messages are read and written with this timeout, not the request to the controller
+            conn.settimeout(CONNECT_TIMEOUT)
+            thread = threading.Thread(target=self.handle, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+
+def _connectable(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        sock.close()
+
+
+def _run_daemon(path, client_factory, idle_timeout):
+    """Run in the detached daemon process, never returns."""
+    status = 0
+    try:
+        try:
+            client = client_factory()
+        except Exception:
+            with open(path + '.err', 'w') as f:
+                f.write(traceback.format_exc())
+            raise
+        if os.path.exists(path):
+            os.remove(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        os.chmod(path, 0o600)
+        listener.listen(64)
+        try:
+            CMLConnectionServer(path, client, idle_timeout).serve(listener)
+        finally:
+            listener.close()
+            os.remove(path)
+    except Exception:
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def detach():
+    """Fork a process detached from the module and its stdio, return True in that process and False in the caller.
+
+    The detached process must end with os._exit.
+    """
+    pid = os.fork()
+    if pid:
+        # The intermediate child exits right away, reap it
+        os.waitpid(pid, 0)
+        return False
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        # Detach from the module's stdio, Ansible waits for those to be closed
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        os.closerange(3, 256)
+        os.chdir('/')
+    except Exception:
+        os._exit(1)
+    return True
+
+
+def _spawn_daemon(path, client_factory, idle_timeout):
+    if detach():
+        _run_daemon(path, client_factory, idle_timeout)
+
+
+def persistent_adapter(directory,
+                       host,
+                       username,
+                       password,
+                       client_factory,
+                       idle_timeout=60,
+                       timeout=None,
+                       settings=(),
+                       spawn=True):
+    """Return an adapter connected to the daemon for these credentials and settings, starting the daemon if needed.
+
+    settings are the JSON serializable settings of the client that client_factory creates.  The adapter
+    waits timeout seconds for the responses of requests without a timeout.  Without spawn, only a
+    running daemon is used.  Returns None when there is no daemon, the caller then connects directly.
+    """
+    if not HAS_REQUESTS:
+        return None
+    path = socket_path(directory, host, username, password, settings)
+    if _connectable(path):
+        return CMLPersistentAdapter(path, timeout)
+    if not spawn:
+        return None
+
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            return None
+    # Only one of the concurrently started modules spawns the daemon
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if not _connectable(path):
+                if os.path.exists(path + '.err'):
+                    os.remove(path + '.err')
+                _spawn_daemon(path, client_factory, idle_timeout)
+                deadline = time.time() + CONNECT_TIMEOUT
+                while not _connectable(path):
+                    if os.path.exists(path + '.err') or time.time() > deadline:
+                        return None
+                    time.sleep(0.05)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return CMLPersistentAdapter(path, timeout)
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Compare a desired CML topology with a live lab.
+
+Both sides are brought into the same model, keyed by what a topology author controls rather than
+by the ids the controller assigns: nodes by label, interfaces by node label and slot, and links by
+the unordered pair of their interfaces.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+import hashlib
+import json
+import traceback
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import (get_notes_marker, set_notes_marker,
+                                                                          strip_notes_marker)
+
+YAML_IMPORT_ERROR = None
+try:
+    import yaml
+except ImportError:
+    HAS_YAML = False
+    YAML_IMPORT_ERROR = traceback.format_exc()
+else:
+    HAS_YAML = True
+
+# Node properties that are compared, None in the desired topology means "keep the current value"
+NODE_PROPERTIES = ('image_definition', 'configuration', 'ram', 'cpus', 'cpu_limit', 'data_volume', 'boot_disk_size',
+                   'x', 'y', 'tags')
+# Node properties that can only be changed while the node is wiped
+BOOT_PROPERTIES = ('image_definition', 'configuration', 'ram', 'cpus', 'cpu_limit', 'data_volume', 'boot_disk_size')
+# Names of the node properties on virl2_client Node objects
+NODE_ATTRIBUTES = {'configuration': 'config'}
+# Prefix of the line in the lab notes that records the fingerprint of the topology the lab matches
+FINGERPRINT_MARKER = 'cisco.cml topology fingerprint: '
+
+
+def load_topology(text):
+    """Parse a topology in the CML YAML (or JSON) export format."""
+    topology = yaml.safe_load(text)
+    if not isinstance(topology, dict) or not isinstance(topology.get('nodes', []), list):
+        raise ValueError('The topology has no list of nodes')
+    return topology
+
+
+def _slot_order(slot):
+    # Loopbacks have no slot and go first
+    return -1 if slot is None else slot
+
+
+def _link_key(a, b):
+    return tuple(sorted([a, b], key=lambda endpoint: (endpoint[0], _slot_order(endpoint[1]))))
+
+
+def desired_model(topology):
+    """Return the model of a topology in the CML export format.
+
+    The export numbers the interfaces of every node from i0, so links are resolved by node and interface
+    id.  Topologies from the API, whose links name only their globally unique interface ids, work too.
+    """
+    nodes = {}
+    interfaces = {}
+    interface_ids = {}
+    for node in topology.get('nodes') or []:
+        properties = dict((name, node.get(name)) for name in NODE_PROPERTIES)
+        if not isinstance(properties['configuration'], (str, type(None))):
+            # Multiple configuration files are not compared
+            properties['configuration'] = None
+        nodes[node['label']] = dict(node_definition=node['node_definition'], properties=properties, interfaces={})
+        for interface in node.get('interfaces') or []:
+            endpoint = (node['label'], interface.get('slot'))
+            nodes[node['label']]['interfaces'][endpoint[1]] = interface.get('label')
+            interfaces[(node['id'], interface['id'])] = endpoint
+            interface_ids[interface['id']] = endpoint
+    links = set()
+    for link in topology.get('links') or []:
+        if 'n1' in link:
+            a = interfaces[(link['n1'], link['i1'])]
+            b = interfaces[(link['n2'], link['i2'])]
+        else:
+            a = interface_ids[link.get('i1', link.get('interface_a'))]
+            b = interface_ids[link.get('i2', link.get('interface_b'))]
+        links.add(_link_key(a, b))
+    lab = topology.get('lab') or {}
+    return dict(nodes=nodes,
+                links=links,
+                description=lab.get('description'),
+                notes=lab.get('notes'))
+
+
+def live_model(lab):
+    """Return the model of a synced virl2_client Lab, with the client objects in nodes, interfaces and links."""
+    nodes = {}
+    node_objects = {}
+    for node in lab.nodes():
+        properties = dict((name, getattr(node, NODE_ATTRIBUTES.get(name, name))) for name in NODE_PROPERTIES
+                          if name != 'tags')
+        properties['tags'] = node.tags()
+        nodes[node.label] = dict(node_definition=node.node_definition, properties=properties, interfaces={})
+        node_objects[node.label] = node
+    interface_objects = {}
+    for interface in lab.interfaces():
+        nodes[interface.node.label]['interfaces'][interface.slot] = interface.label
+        interface_objects[(interface.node.label, interface.slot)] = interface
+    links = set()
+    link_objects = {}
+    for link in lab.links():
+        key = _link_key((link.interface_a.node.label, link.interface_a.slot),
+                        (link.interface_b.node.label, link.interface_b.slot))
+        links.add(key)
+        link_objects[key] = link
+    return dict(nodes=nodes,
+                links=links,
+                description=lab.description,
+                notes=strip_fingerprint(lab.notes),
+                node_objects=node_objects,
+                interface_objects=interface_objects,
+                link_objects=link_objects)
+
+
+def _differs(desired, current):
+    if isinstance(desired, str) or isinstance(current, str):
+        return (desired or '').strip() != (current or '').strip()
+    if isinstance(desired, list):
+        return sorted(desired) != sorted(current or [])
+    return desired != current
+
+
+def diff_topology(desired, live):
+    """Return the changes that turn the live model into the desired one.
+
+    Nodes with another node definition are removed and added again.  Links of removed nodes and
+    interfaces go away with them and are not listed separately.  Loopback interfaces, which have no
+    slot, come and go with their node and are never added or removed.
+    """
+    plan = dict(remove_links=[],
+                remove_nodes=[],
+                remove_interfaces=[],
+                update_nodes={},
+                add_nodes=[],
+                add_interfaces=[],
+                add_links=[],
+                update_lab={})
+    for label, node in sorted(live['nodes'].items()):
+        if label not in desired['nodes'] or desired['nodes'][label]['node_definition'] != node['node_definition']:
+            plan['remove_nodes'].append(label)
+    for label, node in sorted(desired['nodes'].items()):
+        if label not in live['nodes'] or label in plan['remove_nodes']:
+            plan['add_nodes'].append(label)
+            plan['add_interfaces'].extend((label, slot) for slot in sorted(node['interfaces'], key=_slot_order)
+                                          if slot is not None)
+            continue
+        current = live['nodes'][label]
+        changes = dict((name, value) for name, value in node['properties'].items()
+                       if value is not None and _differs(value, current['properties'][name]))
+        if changes:
+            plan['update_nodes'][label] = changes
+        plan['add_interfaces'].extend((label, slot) for slot in sorted(node['interfaces'], key=_slot_order)
+                                      if slot is not None and slot not in current['interfaces'])
+        plan['remove_interfaces'].extend((label, slot) for slot in sorted(current['interfaces'], key=_slot_order)
+                                         if slot is not None and slot not in node['interfaces'])
+
+    removed = set(plan['remove_nodes'])
+    removed_interfaces = set(plan['remove_interfaces'])
+    for key in sorted(live['links'] - desired['links']):
+        if not any(endpoint[0] in removed or endpoint in removed_interfaces for endpoint in key):
+            plan['remove_links'].append(key)
+    for key in sorted(desired['links']):
+        if key not in live['links'] or any(endpoint[0] in removed for endpoint in key):
+            plan['add_links'].append(key)
+
+    for name in ('description', 'notes'):
+        if desired[name] is not None and _differs(desired[name], live[name]):
+            plan['update_lab'][name] = desired[name]
+    return plan
+
+
+def plan_summary(plan):
+    """Return the plan with readable names, e.g. r1:0 for slot 0 of node r1 and r1:0-r2:1 for a link."""
+
+    def interface(endpoint):
+        return '{0}:{1}'.format(*endpoint)
+
+    return dict(remove_links=['-'.join(interface(e) for e in key) for key in plan['remove_links']],
+                remove_nodes=list(plan['remove_nodes']),
+                remove_interfaces=[interface(e) for e in plan['remove_interfaces']],
+                update_nodes=dict((label, sorted(changes)) for label, changes in plan['update_nodes'].items()),
+                add_nodes=list(plan['add_nodes']),
+                add_interfaces=[interface(e) for e in plan['add_interfaces']],
+                add_links=['-'.join(interface(e) for e in key) for key in plan['add_links']],
+                update_lab=sorted(plan['update_lab']))
+
+
+def plan_is_empty(plan):
+    return not any(plan.values())
+
+
+def topology_fingerprint(model):
+    """Return a hash of a desired model that does not depend on the ids, order or formatting of the topology."""
+
+    def normalized(value):
+        if isinstance(value, str):
+            return value.strip()
+        if isinstance(value, list):
+            return sorted(value)
+        return value
+
+    canonical = dict(nodes=dict((label, dict(node_definition=node['node_definition'],
+                                             properties=dict((name, normalized(value))
+                                                             for name, value in node['properties'].items()),
+                                             interfaces=sorted(node['interfaces'].items(),
+                                                               key=lambda item: _slot_order(item[0]))))
+                                for label, node in model['nodes'].items()),
+                     links=sorted(model['links']),
+                     description=normalized(model['description']),
+                     notes=normalized(model['notes']))
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_fingerprint(notes):
+    """Return the fingerprint recorded in lab notes, or None."""
+    return get_notes_marker(notes, FINGERPRINT_MARKER)
+
+
+def strip_fingerprint(notes):
+    """Return lab notes without the fingerprint line."""
+    return strip_notes_marker(notes, FINGERPRINT_MARKER)
+
+
+def set_fingerprint(notes, fingerprint):
+    """Return lab notes with fingerprint recorded in their last line."""
+    return set_notes_marker(notes, FINGERPRINT_MARKER, fingerprint)
@@ -1,25 +1,757 @@
 from __future__ import (absolute_import, division, print_function)
 
 __metaclass__ = type
+import base64
+import fcntl
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
 import traceback
 from ansible.module_utils.basic import env_fallback, missing_required_lib
+from ansible_collections.cisco.cml.plugins.module_utils.cml_persistent import DEFAULT_PERSISTENT_DIR, persistent_adapter
 
 VIRL2CLIENT_IMPORT_ERROR = None
 try:
     from virl2_client import ClientLibrary
+    from virl2_client.exceptions import NodeNotFound
+    from virl2_client.models import TokenAuth
+    # requests is a dependency of virl2_client
+    from requests.adapters import HTTPAdapter
+    from requests.exceptions import ConnectionError as RequestsConnectionError
+    from requests.exceptions import ConnectTimeout, SSLError, Timeout
 except ImportError:
     HAS_VIRL2CLIENT = False
     VIRL2CLIENT_IMPORT_ERROR = traceback.format_exc()
+    ClientLibrary = TokenAuth = HTTPAdapter = object
+    NodeNotFound = Exception
 else:
     HAS_VIRL2CLIENT = True
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # Python 2 without the futures backport, run_concurrently calls one item after the other
+    HAS_CONCURRENT_FUTURES = False
+else:
+    HAS_CONCURRENT_FUTURES = True
+
+DEFAULT_TOKEN_CACHE_DIR = os.path.join('~', '.ansible', 'cml', 'tokens')
+
 
 def cml_argument_spec():
     return dict(host=dict(type='str', required=True, fallback=(env_fallback, ['CML_HOST'])),
                 username=dict(type='str', required=True, aliases=['user'], fallback=(env_fallback, ['CML_USERNAME'])),
                 password=dict(type='str', required=True, no_log=True, fallback=(env_fallback, ['CML_PASSWORD'])),
                 validate_certs=dict(type='bool', required=False, default=False),
-                timeout=dict(type='int', default=30))
+                timeout=dict(type='int', default=30),
+                token_cache=dict(type='bool', default=False, fallback=(env_fallback, ['CML_TOKEN_CACHE'])),
+                token_cache_dir=dict(type='path',
+                                     default=DEFAULT_TOKEN_CACHE_DIR,
+                                     fallback=(env_fallback, ['CML_TOKEN_CACHE_DIR'])),
+                retries=dict(type='int', default=0, fallback=(env_fallback, ['CML_RETRIES'])),
+                rate_limit=dict(type='float', default=0, fallback=(env_fallback, ['CML_RATE_LIMIT'])),
+                persistent=dict(type='bool', default=False, fallback=(env_fallback, ['CML_PERSISTENT'])),
+                persistent_idle_timeout=dict(type='int',
+                                             default=60,
+                                             fallback=(env_fallback, ['CML_PERSISTENT_IDLE_TIMEOUT'])),
+                persistent_dir=dict(type='path',
+                                    default=DEFAULT_PERSISTENT_DIR,
+                                    fallback=(env_fallback, ['CML_PERSISTENT_DIR'])),
+                metrics=dict(type='bool', default=False, fallback=(env_fallback, ['CML_METRICS'])))
+
+
+class CMLTokenCache(object):
+    """API token of one user on one CML host, stored in a file only readable by its owner.
+
+    The password is part of the key, so a task with another, e.g. a wrong or rotated, password logs in
+    instead of using the token.
+    """
+
+    # Do not hand out tokens that are about to expire
+    EXPIRY_MARGIN = 60
+
+    def __init__(self, directory, host, username, password):
+        self.directory = os.path.expanduser(directory)
+        key = hashlib.sha256('{0}\0{1}\0{2}'.format(host, username, password).encode('utf-8')).hexdigest()
+        self.path = os.path.join(self.directory, '{0}.json'.format(key))
+
+    @staticmethod
+    def expiry(token):
+        """Return the expiry time of a JWT token, or None if it cannot be read."""
+        try:
+            payload = token.split('.')[1]
+            payload += '=' * (-len(payload) % 4)
+            return float(json.loads(base64.urlsafe_b64decode(payload.encode('ascii')))['exp'])
+        except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+            return None
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        expires = data.get('expires')
+        if expires is not None and expires - self.EXPIRY_MARGIN < time.time():
+            return None
+        return data.get('token')
+
+    def save(self, token):
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory, 0o700)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.token')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(dict(token=token, expires=self.expiry(token)), f)
+            # mkstemp already creates the file with 0600 permissions
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            # The cache is an optimization only
+            pass
+
+    def invalidate(self):
+        try:
+            os.remove(self.path)
+        except (IOError, OSError):
+            pass
+
+
+class CMLTokenAuth(TokenAuth):
+    """TokenAuth that logs in again once when its token expires, optionally sharing the token through a cache."""
+
+    def __init__(self, client_library, token_cache=None):
+        super(CMLTokenAuth, self).__init__(client_library)
+        self.token_cache = token_cache
+        self.token = token_cache.load() if token_cache is not None else None
+        # The threads of a module, or of the persistent connection process, share the client
+        self.lock = threading.Lock()
+
+    def authenticate(self):
+        with self.lock:
+            if self.token is None:
+                self.token = super(CMLTokenAuth, self).authenticate()
+                if self.token_cache is not None:
+                    self.token_cache.save(self.token)
+            return self.token
+
+    def handle_401_unauthorized(self, resp, **kwargs):
+        if resp.status_code != 401:
+            return super(CMLTokenAuth, self).handle_401_unauthorized(resp, **kwargs)
+        # The token expired or was revoked, log in once more and repeat the request.
+        # Unlike TokenAuth, pass on the send arguments so that ssl verification settings are kept.
+        with self.lock:
+            # Of the requests that failed with the same token, only the first logs in again
+            if self.token is None or resp.request.headers.get('Authorization') == 'Bearer {0}'.format(self.token):
+                if self.token_cache is not None:
+                    self.token_cache.invalidate()
+                self.token = None
+        request = resp.request.copy()
+        request.headers['Authorization'] = 'Bearer {0}'.format(self.authenticate())
+        request.deregister_hook('response', self.handle_401_unauthorized)
+        # Release the connection before reusing it
+        resp.content
+        resp.close()
+        new_resp = resp.connection.send(request, **kwargs)
+        new_resp.history.append(resp)
+        new_resp.request = request
+        return new_resp
+
+
+class CMLMetrics(object):
+    """Count, latency, size and status codes of the API requests of a client, per endpoint.
+
+    record() is a requests response hook.  The ids in the request paths are replaced by {id}, so that
+    e.g. the topology requests of all labs are counted as one endpoint.
+    """
+
+    # Upper bounds of the latency histogram buckets in milliseconds
+    BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+    COLLECTIONS = ('labs', 'nodes', 'interfaces', 'links', 'users', 'groups')
+
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def endpoint(self, request):
+        path = re.sub(r'^https?://[^/]+(/api/v0)?/', '', request.url.split('?')[0])
+        segments = path.split('/')
+        for i in range(1, len(segments)):
+            if segments[i - 1] in self.COLLECTIONS:
+                segments[i] = '{id}'
+        return '{0} {1}'.format(request.method, '/'.join(segments))
+
+    def record(self, response, *args, **kwargs):
+        latency = response.elapsed.total_seconds()
+        size = response.headers.get('Content-Length')
+        size = int(size) if size is not None else len(response.content or b'')
+        endpoint = self.endpoint(response.request)
+        bucket = next(('<={0}ms'.format(b) for b in self.BUCKETS if latency * 1000 <= b),
+                      '>{0}ms'.format(self.BUCKETS[-1]))
+        with self.lock:
+            metrics = self.endpoints.setdefault(endpoint, dict(count=0, time=0.0, max_time=0.0, bytes=0, status={},
+                                                               histogram={}))
+            metrics['count'] += 1
+            metrics['time'] += latency
+            metrics['max_time'] = max(metrics['max_time'], latency)
+            metrics['bytes'] += size
+            metrics['status'][str(response.status_code)] = metrics['status'].get(str(response.status_code), 0) + 1
+            metrics['histogram'][bucket] = metrics['histogram'].get(bucket, 0) + 1
+
+    def as_dict(self):
+        """Return the totals and the metrics per endpoint, the times in seconds."""
+        with self.lock:
+            endpoints = {}
+            for endpoint, metrics in self.endpoints.items():
+                endpoints[endpoint] = dict(metrics,
+                                           time=round(metrics['time'], 4),
+                                           max_time=round(metrics['max_time'], 4),
+                                           status=dict(metrics['status']),
+                                           histogram=dict(metrics['histogram']))
+        return dict(requests=sum(m['count'] for m in endpoints.values()),
+                    time=round(sum(m['time'] for m in endpoints.values()), 4),
+                    bytes=sum(m['bytes'] for m in endpoints.values()),
+                    endpoints=endpoints)
+
+    def summary(self):
+        """Return one line per endpoint, the most time consuming first."""
+        endpoints = self.as_dict()['endpoints']
+        lines = []
+        for endpoint, m in sorted(endpoints.items(), key=lambda item: -item[1]['time']):
+            lines.append('{0}: {1} requests, {2:.3f}s total, {3:.3f}s max, {4} bytes, status {5}'.format(
+                endpoint, m['count'], m['time'], m['max_time'], m['bytes'],
+                ', '.join('{0}x{1}'.format(code, n) for code, n in sorted(m['status'].items()))))
+        return lines
+
+
+class CMLRateLimiter(object):
+    """Token bucket shared by the processes of the user on this machine that send requests to one CML host.
+
+    The bucket is a small file in the temporary directory, every request takes a token from it under an
+    exclusive lock.  It holds up to one second worth of tokens, so bursts stay small.
+    """
+
+    def __init__(self, host, rate, directory=None):
+        self.rate = float(rate)
+        self.burst = max(1.0, self.rate)
+        key = hashlib.sha256(host.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(directory or tempfile.gettempdir(), 'cml-rate-{0}-{1}'.format(key, os.getuid()))
+
+    def _take(self):
+        """Take a token if there is one, return 0 or else the seconds until the next one."""
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        except OSError:
+            # The rate limit is best effort
+            return 0
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            now = time.time()
+            try:
+                tokens, updated = [float(value) for value in os.read(fd, 64).split()]
+            except ValueError:
+                tokens, updated = self.burst, now
+            tokens = min(self.burst, tokens + max(now - updated, 0) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            if not wait:
+                tokens -= 1
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, '{0!r} {1!r}'.format(tokens, now).encode('ascii'))
+            return wait
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+    def acquire(self):
+        """Wait until a request may be sent."""
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class CMLRetryAdapter(HTTPAdapter):
+    """HTTPAdapter that retries failed requests that can be repeated safely, optionally rate limited.
+
+    GET, PUT and DELETE requests and logins are retried after connection errors, timeouts, 429 and 5xx
+    responses, with exponentially growing and randomized delays so that many processes that failed
+    together do not retry together.  Other requests are only retried when they could not connect.
+    """
+
+    IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+    RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+    # Maximum seconds of a Retry-After header that are honored
+    MAX_RETRY_AFTER = 60
+
+    def __init__(self, retries=0, timeout=None, rate_limiter=None, **kwargs):
+        self.retries = retries
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        super(CMLRetryAdapter, self).__init__(**kwargs)
+
+    def idempotent(self, request):
+        return request.method in self.IDEMPOTENT_METHODS or request.path_url.split('?')[0].endswith('/authenticate')
+
+    def retry_after(self, response):
+        try:
+            return min(float(response.headers.get('Retry-After')), self.MAX_RETRY_AFTER)
+        except (TypeError, ValueError):
+            return None
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        idempotent = self.retries > 0 and self.idempotent(request)
+        if timeout is None and idempotent:
+            # A request that can be repeated does not have to wait forever
+            timeout = self.timeout
+        backoff = Backoff(0.5, 15.0, factor=2, jitter=1.0)
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = super(CMLRetryAdapter, self).send(request, stream=stream, timeout=timeout, **kwargs)
+            except SSLError:
+                raise
+            except (RequestsConnectionError, Timeout) as e:
+                # A request that could not connect never reached the controller
+                if attempt >= self.retries or not (idempotent or isinstance(e, ConnectTimeout)):
+                    raise
+                delay = backoff.next()
+            else:
+                if attempt >= self.retries or not idempotent or response.status_code not in self.RETRY_STATUS:
+                    return response
+                delay = self.retry_after(response) or backoff.next()
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+
+class CMLClientLibrary(ClientLibrary):
+    """ClientLibrary with an optional token cache shared between processes.
+
+    With an adapter, e.g. the one of a persistent connection, all requests are sent through
+    it and the client neither checks the controller version nor logs in itself.  Otherwise
+    the requests go through a CMLRetryAdapter with retry_options.  With metrics, every request
+    of the client, including the login, is recorded in it.
+    """
+
+    def __init__(self,
+                 url,
+                 username,
+                 password,
+                 token_cache=None,
+                 adapter=None,
+                 metrics=None,
+                 retry_options=None,
+                 **kwargs):
+        self.token_cache = token_cache
+        self.adapter = adapter
+        self.metrics = metrics
+        self.retry_options = retry_options or {}
+        super(CMLClientLibrary, self).__init__(url, username, password, **kwargs)
+
+    def check_controller_version(self, controller_version=None):
+        # This is the first call made by ClientLibrary.__init__
+        if self.metrics is not None:
+            self.session.hooks['response'].append(self.metrics.record)
+        if self.adapter is not None:
+            self.session.mount(self._base_url, self.adapter)
+            return
+        self.session.mount(self._base_url, CMLRetryAdapter(**self.retry_options))
+        super(CMLClientLibrary, self).check_controller_version(controller_version)
+
+    def _make_test_auth_call(self):
+        # This is the first authenticated call made by ClientLibrary.__init__
+        if self.adapter is not None:
+            self.session.auth = None
+            return
+        self.session.auth = CMLTokenAuth(self, self.token_cache)
+        super(CMLClientLibrary, self)._make_test_auth_call()
+
+
+def cml_client(host,
+               username,
+               password,
+               token_cache_dir=None,
+               adapter=None,
+               metrics=None,
+               retries=0,
+               timeout=None,
+               rate_limit=0):
+    """Return a logged in client, reusing the cached token of the user when token_cache_dir is set.
+
+    Requests that can be repeated safely are retried up to retries times and time out after timeout
+    seconds.  With a rate_limit, all clients of the user on this machine together send at most that
+    many requests per second to the host.
+    """
+    token_cache = None
+    if token_cache_dir:
+        token_cache = CMLTokenCache(token_cache_dir, host, username, password)
+    retry_options = dict(retries=retries,
+                         timeout=timeout,
+                         rate_limiter=CMLRateLimiter(host, rate_limit) if rate_limit > 0 else None)
+    return CMLClientLibrary('https://{0}'.format(host),
+                            username,
+                            password,
+                            token_cache=token_cache,
+                            adapter=adapter,
+                            metrics=metrics,
+                            retry_options=retry_options,
+                            ssl_verify=False)
+
+
+def set_pool_size(client, size):
+    """Let the client keep up to size connections to the controller open for concurrent requests."""
+    if getattr(client, 'adapter', None) is None:
+        adapter = CMLRetryAdapter(pool_connections=1, pool_maxsize=size, **getattr(client, 'retry_options', {}))
+        client.session.mount(client._base_url, adapter)
+
+
+def run_concurrently(function, items, max_workers=8):
+    """Call function on every item with up to max_workers threads.
+
+    Without concurrent.futures, on Python 2 without the futures backport, the items are called one after the other.
+    Returns a list of (result, exception) tuples in the order of items, one of them is None.
+    """
+
+    def call(item):
+        try:
+            return function(item), None
+        except Exception as e:
+            return None, e
+
+    items = list(items)
+    if not items:
+        return []
+    if not HAS_CONCURRENT_FUTURES or max_workers <= 1:
+        return [call(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        return list(executor.map(call, items))
+
+
+class Backoff(object):
+    """Polling delays that grow from initial to maximum, and start over from initial on reset().
+
+    With jitter, every delay is shortened by a random fraction of up to jitter of itself.
+    """
+
+    def __init__(self, initial=1.0, maximum=15.0, factor=1.5, jitter=0.0):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.delay = initial
+
+    def next(self):
+        delay = self.delay
+        self.delay = min(self.delay * self.factor, self.maximum)
+        if self.jitter:
+            delay *= 1 - self.jitter * random.random()
+        return delay
+
+    def reset(self):
+        self.delay = self.initial
+
+
+def get_notes_marker(notes, prefix):
+    """Return the value recorded in the line of lab notes that starts with prefix, or None."""
+    for line in (notes or '').splitlines():
+        if line.startswith(prefix):
+            return line[len(prefix):].strip()
+    return None
+
+
+def strip_notes_marker(notes, prefix):
+    """Return lab notes without the line that starts with prefix."""
+    if notes is None:
+        return None
+    return '\n'.join(line for line in notes.splitlines() if not line.startswith(prefix))
+
+
+def set_notes_marker(notes, prefix, value):
+    """Return lab notes with value recorded after prefix in their last line."""
+    notes = (strip_notes_marker(notes, prefix) or '').rstrip('\n')
+    return '{0}{1}{2}{3}'.format(notes, '\n' if notes else '', prefix, value)
+
+
+def cml_api_get(client, path, params=None):
+    """Issue a GET against the CML API and return the decoded JSON body."""
+    response = client.session.get(client._base_url + path, params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def get_lab_tiles(client):
+    """Return a dict of lab id to lab summary (title, owner, state, ...) for all labs in one request."""
+    tiles = cml_api_get(client, 'populate_lab_tiles')
+    # populate_lab_tiles response has been changed in 2.1
+    # if it doesn't have a key "lab_tiles" then it's <2.1
+    return tiles.get('lab_tiles', tiles)
+
+
+class CMLLookupIndex(object):
+    """Memoized lookups of labs by title and of nodes by label for one client.
+
+    The titles of all labs come from a single populate_lab_tiles request, and only the lab that is
+    looked up is joined and synced.  The labels of the nodes of a lab are indexed on the first node
+    lookup in that lab.  Labs and nodes created or removed through the client are reported with
+    add_lab/remove_lab and add_node/remove_node to keep the index current.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._lab_ids = None
+        self._tiles = {}
+        self._labs = {}
+        self._node_ids = {}
+
+    def lab_id(self, title):
+        """Return the id of the first lab with this title, or None."""
+        if self._lab_ids is None:
+            self._lab_ids = {}
+            self._tiles = get_lab_tiles(self.client)
+            for lab_id, tile in self._tiles.items():
+                self._lab_ids.setdefault(tile['lab_title'], []).append(lab_id)
+        lab_ids = self._lab_ids.get(title)
+        return lab_ids[0] if lab_ids else None
+
+    def tile(self, lab_id):
+        """Return the summary of a lab from the populate_lab_tiles request made by lab_id, or None."""
+        return self._tiles.get(lab_id)
+
+    def get_lab(self, title):
+        lab_id = self.lab_id(title)
+        if lab_id is None:
+            return None
+        if lab_id not in self._labs:
+            self._labs[lab_id] = self.client.join_existing_lab(lab_id)
+        return self._labs[lab_id]
+
+    def get_node(self, lab, label):
+        node_ids = self._node_ids.get(lab.id)
+        if node_ids is None:
+            node_ids = self._node_ids[lab.id] = dict((node.label, node.id) for node in lab.nodes())
+        node_id = node_ids.get(label)
+        if node_id is None:
+            return None
+        try:
+            return lab.get_node_by_id(node_id)
+        except NodeNotFound:
+            # Removed by someone else since the index was built
+            del node_ids[label]
+            return None
+
+    def add_lab(self, title, lab):
+        if self._lab_ids is not None:
+            self._lab_ids.setdefault(title, []).append(lab.id)
+        self._labs[lab.id] = lab
+
+    def remove_lab(self, lab):
+        if self._lab_ids is not None:
+            for lab_ids in self._lab_ids.values():
+                if lab.id in lab_ids:
+                    lab_ids.remove(lab.id)
+        self._labs.pop(lab.id, None)
+        self._tiles.pop(lab.id, None)
+        self._node_ids.pop(lab.id, None)
+
+    def add_node(self, lab, node):
+        if lab.id in self._node_ids:
+            self._node_ids[lab.id][node.label] = node.id
+
+    def remove_node(self, lab, node):
+        if lab.id in self._node_ids:
+            self._node_ids[lab.id].pop(node.label, None)
+
+
+INTERFACE_COUNTERS = ('readbytes', 'readpackets', 'writebytes', 'writepackets')
+
+
+def interface_counters(simulation_stats, links):
+    """Return a dict of interface id to the counters of the interface in the simulation_stats of a lab.
+
+    The controller counts the traffic per link, so only linked interfaces have counters.
+    """
+    result = {}
+    for link in links:
+        link_data = simulation_stats.get('links', {}).get(link['id'])
+        if not link_data:
+            continue
+        counters = {}
+        for key in INTERFACE_COUNTERS:
+            try:
+                counters[key] = int(link_data[key])
+            except (TypeError, KeyError, ValueError):
+                counters[key] = 0
+        result[link['interface_a']] = counters
+        # reverse for other interface
+        result[link['interface_b']] = dict(readbytes=counters['writebytes'],
+                                           readpackets=counters['writepackets'],
+                                           writebytes=counters['readbytes'],
+                                           writepackets=counters['readpackets'])
+    return result
+
+
+def get_lab_topology(client, lab_id, configurations=True):
+    """Return the topology of a lab as returned by the API."""
+    return cml_api_get(client,
+                       'labs/{0}/topology'.format(lab_id),
+                       params={'exclude_configurations': not configurations})
+
+
+def get_lab_snapshot(client,
+                     lab_id,
+                     configurations=True,
+                     states=True,
+                     addresses=True,
+                     statistics=True,
+                     details=False,
+                     topology=None):
+    """Return the topology and operational state of a lab as plain dicts.
+
+    Instead of walking the lazily synced client objects, the snapshot is built from one
+    bulk request per kind of data (topology, element states, layer 3 addresses, link
+    statistics and optionally the lab details), so the request count does not depend on
+    the number of nodes or interfaces.  Disabled kinds are not requested at all, and a
+    topology from get_lab_topology that is still current can be passed in to reuse it.
+    """
+    if topology is None:
+        topology = get_lab_topology(client, lab_id, configurations)
+    lab = topology.get('lab')
+    if lab is None:
+        lab = dict(title=topology.get('lab_title'), description=topology.get('lab_description'),
+                   notes=topology.get('lab_notes'), owner=topology.get('lab_owner'))
+    snapshot = {
+        'id': lab_id,
+        'title': lab.get('title'),
+        'description': lab.get('description'),
+        'notes': lab.get('notes'),
+        'owner': lab.get('owner'),
+        'nodes': [],
+        'links': [],
+    }
+
+    nodes = {}
+    interfaces = {}
+    for node_data in topology['nodes']:
+        node_interfaces = node_data.get('interfaces', [])
+        if 'data' in node_data:
+            node_data = node_data['data']
+        node = {
+            'id': node_data.get('id'),
+            'label': node_data['label'],
+            'node_definition': node_data['node_definition'],
+            'image_definition': node_data.get('image_definition'),
+            'cpus': node_data.get('cpus'),
+            'ram': node_data.get('ram'),
+            'data_volume': node_data.get('data_volume'),
+            'x': node_data.get('x'),
+            'y': node_data.get('y'),
+            'tags': node_data.get('tags') or [],
+            'state': None,
+            'interfaces': [],
+        }
+        if configurations:
+            node['config'] = node_data.get('configuration')
+        nodes[node['id']] = node
+        snapshot['nodes'].append(node)
+        for interface_data in node_interfaces:
+            interface_data = dict(interface_data, node=node['id'])
+            interfaces[interface_data['id']] = interface_data
+    # Topologies older than 2.4 list the interfaces at the top level
+    for interface_data in topology.get('interfaces', []):
+        interfaces[interface_data['id']] = interface_data
+
+    for interface_id, interface_data in interfaces.items():
+        if 'data' in interface_data:
+            interface_data = dict(interface_data['data'], node=interface_data.get('node'))
+        interface = {
+            'id': interface_id,
+            'label': interface_data['label'],
+            'slot': interface_data.get('slot'),
+            'type': interface_data.get('type'),
+            'is_physical': interface_data.get('type') == 'physical',
+            'state': None,
+            'ipv4_addresses': None,
+            'ipv6_addresses': None,
+            'mac_address': None,
+            'readbytes': 0,
+            'readpackets': 0,
+            'writebytes': 0,
+            'writepackets': 0,
+        }
+        interfaces[interface_id] = interface
+        nodes[interface_data['node']]['interfaces'].append(interface)
+
+    for link_data in topology.get('links', []):
+        snapshot['links'].append({
+            'id': link_data['id'],
+            'interface_a': link_data['interface_a'],
+            'interface_b': link_data['interface_b'],
+            'state': None,
+        })
+
+    if states:
+        element_states = cml_api_get(client, 'labs/{0}/lab_element_state'.format(lab_id))
+        for node_id, state in element_states.get('nodes', {}).items():
+            if node_id in nodes:
+                nodes[node_id]['state'] = state
+        for interface_id, state in element_states.get('interfaces', {}).items():
+            if interface_id in interfaces:
+                interfaces[interface_id]['state'] = state
+        for link in snapshot['links']:
+            link['state'] = element_states.get('links', {}).get(link['id'])
+
+    if states and not any(node['state'] in ('STARTED', 'BOOTED') for node in snapshot['nodes']):
+        # Only running nodes have layer 3 addresses
+        addresses = False
+    if addresses:
+        layer3_addresses = cml_api_get(client, 'labs/{0}/layer3_addresses'.format(lab_id))
+        for node_id, node_data in layer3_addresses.items():
+            if node_id not in nodes:
+                continue
+            by_label = dict((interface['label'], interface) for interface in nodes[node_id]['interfaces'])
+            for mac_address, entry in node_data.get('interfaces', {}).items():
+                interface = by_label.get(entry.get('label'))
+                if interface is not None:
+                    interface['mac_address'] = mac_address
+                    interface['ipv4_addresses'] = entry.get('ip4')
+                    interface['ipv6_addresses'] = entry.get('ip6')
+
+    if statistics:
+        simulation_stats = cml_api_get(client, 'labs/{0}/simulation_stats'.format(lab_id))
+        for interface_id, counters in interface_counters(simulation_stats, snapshot['links']).items():
+            if interface_id in interfaces:
+                interfaces[interface_id].update(counters)
+
+    if details:
+        snapshot['details'] = cml_api_get(client, 'labs/{0}'.format(lab_id))
+
+    return snapshot
+
+
+class CMLClientCache(object):
+    """Logged in clients and their lookup indexes, kept for the life of the process.
+
+    Modules run in a new process for every task and do not use it.  When the modules run in the
+    Ansible worker process instead, the client serves all items of a loop of the task.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, key, login):
+        """Return the (client, index) for key, calling login to create the client the first time."""
+        if key not in self._entries:
+            client = login()
+            self._entries[key] = (client, CMLLookupIndex(client))
+        return self._entries[key]
 
 
 class cmlModule(object):
@@ -39,40 +771,89 @@ class cmlModule(object):
         self.status = None
         self.url = None
         self.params['force_basic_auth'] = True
-        self.user = self.params['user']
+        self.user = self.params['username']
         self.password = self.params['password']
         self.host = self.params['host']
         self.timeout = self.params['timeout']
         self.modifiable_methods = ['POST', 'PUT', 'DELETE']
 
         self.client = None
+        self.index = None
+        self.metrics = CMLMetrics() if self.params['metrics'] else None
 
         if not HAS_VIRL2CLIENT:
             module.fail_json(msg=missing_required_lib('virl2_client'), exception=VIRL2CLIENT_IMPORT_ERROR)
 
+        client_cache = getattr(module, 'client_cache', None)
+        if client_cache is not None and self.metrics is None:
+            key = (self.host, self.user, self.password, self.params['token_cache'], self.params['token_cache_dir'],
+                   self.params['persistent'], self.params['retries'], self.timeout, self.params['rate_limit'])
+            self.client, self.index = client_cache.get(key, self._login)
+        else:
+            self.login()
+            self.index = CMLLookupIndex(self.client)
+
+    def _login(self):
         self.login()
+        return self.client
 
     def login(self):
-        self.client = ClientLibrary('https://{0}'.format(self.host), self.user, self.password, ssl_verify=False)
+        token_cache_dir = self.params['token_cache_dir'] if self.params['token_cache'] else None
+        adapter = None
+        retry_options = dict(retries=self.params['retries'], timeout=self.timeout, rate_limit=self.params['rate_limit'])
+        if self.params['persistent']:
+
+            def persistent_client():
+                client = cml_client(self.host, self.user, self.password, token_cache_dir=token_cache_dir,
+                                    **retry_options)
+                # Requests from concurrent modules each get a pooled connection
+                set_pool_size(client, 16)
+                return client
+
+            # With retries, the daemon times requests out and retries them, a request may take that many
+            # attempts and the delays between them.  Without, it waits like a direct connection would.
+            retries = self.params['retries']
+            wait = None
+            if retries:
+                wait = self.timeout * (retries + 1) + CMLRetryAdapter.MAX_RETRY_AFTER * retries
+            # The worker of an in-process action plugin must not fork the daemon, it only uses a running one
+            in_process = getattr(self.module, 'client_cache', None) is not None
+            adapter = persistent_adapter(self.params['persistent_dir'],
+                                         self.host,
+                                         self.user,
+                                         self.password,
+                                         persistent_client,
+                                         idle_timeout=self.params['persistent_idle_timeout'],
+                                         timeout=wait,
+                                         settings=(token_cache_dir, self.params['retries'], self.timeout,
+                                                   self.params['rate_limit']),
+                                         spawn=not in_process)
+            if adapter is None and not in_process:
+                self.module.warn('Could not start the persistent CML connection, connecting directly')
+        self.client = cml_client(self.host,
+                                 self.user,
+                                 self.password,
+                                 token_cache_dir=token_cache_dir,
+                                 adapter=adapter,
+                                 metrics=self.metrics,
+                                 **retry_options)
 
     def get_lab_by_name(self, name):
-        for lab in self.client.all_labs():
-            if lab.name == name:
-                return lab
-        return None
+        return self.index.get_lab(name)
 
     def get_node_by_name(self, lab, name):
-        for node in lab.nodes():
-            if node.label == name:
-                return node
-        return None
+        return self.index.get_node(lab, name)
 
     def exit_json(self, **kwargs):
 
         self.result.update(**kwargs)
+        if self.metrics is not None:
+            self.result['cml_metrics'] = self.metrics.as_dict()
         self.module.exit_json(**self.result)
 
     def fail_json(self, msg, **kwargs):
 
         self.result.update(**kwargs)
+        if self.metrics is not None:
+            self.result['cml_metrics'] = self.metrics.as_dict()
         self.module.fail_json(msg=msg, **self.result)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Wait for the nodes of many CML labs at once.
+
+Every lab is polled on its own schedule with one request for its node states per poll, and its delay
+backs off while nothing changes.  The labs that are due are polled by a pool of threads that shares the
+pooled connections of one client, so the number of labs watched does not add processes or logins.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+import time
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import (Backoff, cml_api_get, run_concurrently,
+                                                                          set_pool_size)
+
+# Node states that satisfy a target state
+REACHED_BY = {
+    'BOOTED': ['BOOTED'],
+    'STARTED': ['STARTED', 'BOOTED'],
+    'STOPPED': ['STOPPED', 'DEFINED_ON_CORE'],
+    'DEFINED_ON_CORE': ['DEFINED_ON_CORE'],
+}
+
+
+def select_nodes(topology, names, tags):
+    """Return a dict of node id to label of the nodes to wait for."""
+    selected = {}
+    for node in topology['nodes']:
+        if names is None and tags is None:
+            selected[node['id']] = node['label']
+        elif node['label'] in (names or []) or set(node.get('tags') or []) & set(tags or []):
+            selected[node['id']] = node['label']
+    return selected
+
+
+class LabWatch(object):
+    """The nodes of one lab to wait for and the progress made so far."""
+
+    def __init__(self, lab_id, state, nodes=None, tags=None):
+        self.lab_id = lab_id
+        self.reached_by = REACHED_BY[state]
+        self.names = nodes
+        self.tags = tags
+        self.selected = None
+        self.states = {}
+        self.reached = {}
+        self.polls = 0
+        self.error = None
+
+    @property
+    def pending(self):
+        if self.selected is None:
+            return []
+        return sorted(label for label in self.selected.values() if label not in self.reached)
+
+    @property
+    def done(self):
+        return self.selected is not None and not self.pending
+
+    def update(self, node_states, elapsed):
+        """Record a poll of the node states, return whether any selected node changed its state."""
+        self.polls += 1
+        progress = False
+        for node_id, label in self.selected.items():
+            state = node_states.get(node_id)
+            if state != self.states.get(label):
+                progress = True
+            self.states[label] = state
+            if label not in self.reached and state in self.reached_by:
+                self.reached[label] = round(elapsed, 1)
+        return progress
+
+    def as_dict(self):
+        return dict(nodes=dict((label, dict(state=self.states.get(label), elapsed=self.reached.get(label)))
+                               for label in (self.selected or {}).values()),
+                    pending=self.pending,
+                    polls=self.polls)
+
+
+class LabWatcher(object):
+    """Poll the node states of many labs concurrently until every LabWatch is done or the timeout expires."""
+
+    def __init__(self, client, max_workers=8, delay=1.0, max_delay=15.0):
+        self.client = client
+        self.max_workers = max_workers
+        self.delay = delay
+        self.max_delay = max_delay
+        self.started = None
+
+    def poll(self, watch):
+        """Poll the node states of a lab once, return whether any node waited for changed its state."""
+        if watch.selected is None:
+            topology = cml_api_get(self.client, 'labs/{0}/topology'.format(watch.lab_id),
+                                   params={'exclude_configurations': True})
+            watch.selected = select_nodes(topology, watch.names, watch.tags)
+        element_state = cml_api_get(self.client, 'labs/{0}/lab_element_state'.format(watch.lab_id))
+        return watch.update(element_state.get('nodes', {}), time.time() - self.started)
+
+    def run(self, watches, timeout):
+        """Watch all labs until they are done or timeout seconds have passed."""
+        watches = list(watches)
+        if not watches:
+            return watches
+        max_workers = max(1, min(self.max_workers, len(watches)))
+        set_pool_size(self.client, max_workers)
+        self.started = time.time()
+        deadline = self.started + timeout
+        backoffs = [Backoff(self.delay, self.max_delay) for dummy in watches]
+        due = [self.started] * len(watches)
+        active = list(range(len(watches)))
+        while active:
+            ready = [index for index in active if due[index] <= time.time()]
+            outcomes = run_concurrently(lambda index: self.poll(watches[index]), ready, max_workers)
+            now = time.time()
+            for index, (progress, error) in zip(ready, outcomes):
+                if error is not None:
+                    # A lab that cannot be watched does not stop the others
+                    watches[index].error = error
+                    active.remove(index)
+                elif watches[index].done:
+                    active.remove(index)
+                else:
+                    if progress:
+                        backoffs[index].reset()
+                    # Every lab is polled once more when the timeout expires
+                    due[index] = min(now + backoffs[index].next(), deadline)
+            if not active or (ready and now >= deadline):
+                break
+            time.sleep(max(min(due[index] for index in active) - time.time(), 0))
+        return watches
@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1', 'status': ['preview'], 'supported_by': 'community'}
+
+DOCUMENTATION = r"""
+---
+module: cml_interface_stats
+short_description: Sample the traffic rates of the interfaces of a CML Lab
+description:
+  - Sample the traffic counters of the interfaces of a CML lab I(count) times, I(interval) seconds apart,
+    and compute the rates between the samples.
+  - Every sample is one API request for the counters of the whole lab, however many interfaces are selected.
+  - Returns in C(interfaces), keyed by C(node:interface), the node and interface labels and for each of
+    C(readbytes), C(readpackets), C(writebytes) and C(writepackets) the traffic in C(total) and the
+    C(min), C(max) and C(avg) per second rate over the sampled intervals.
+  - The controller counts the traffic of links, so only interfaces with a link have counters.
+author:
+  - Steven Carter (@stevenca)
+requirements:
+  - virl2_client
+version_added: '1.3.0'
+options:
+    lab:
+        description: The name of the CML lab (CML_LAB)
+        required: true
+        type: str
+    nodes:
+        description: Only sample the interfaces of the nodes with these names
+        required: false
+        type: list
+        elements: str
+    interfaces:
+        description: Only sample the interfaces with these labels, e.g. C(GigabitEthernet0/1)
+        required: false
+        type: list
+        elements: str
+    interval:
+        description: Seconds between two samples
+        required: false
+        type: float
+        default: 5
+    count:
+        description: Number of samples, at least 2
+        required: false
+        type: int
+        default: 2
+extends_documentation_fragment: cisco.cml.cml
+"""
+
+EXAMPLES = r"""
+- name: Validate the traffic
+  hosts: localhost
+  connection: local
+  gather_facts: no
+  tasks:
+    - name: Sample the uplinks of the routers for a minute
+      cisco.cml.cml_interface_stats:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        lab: "{{ cml_lab }}"
+        nodes:
+          - r1
+          - r2
+        interfaces:
+          - GigabitEthernet0/0
+        interval: 10
+        count: 7
+      register: stats
+
+    - name: Check that r1 sent at least 1 Mbit/s
+      assert:
+        that:
+          - stats.interfaces['r1:GigabitEthernet0/0'].writebytes.avg * 8 >= 1000000
+"""
+
+import time
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import (INTERFACE_COUNTERS, cmlModule, cml_api_get,
+                                                                          cml_argument_spec, interface_counters)
+
+
+def select_interfaces(topology, nodes, labels):
+    """Return a dict of interface id to (node label, interface label) of the linked interfaces to sample."""
+    linked = set()
+    for link in topology.get('links', []):
+        linked.update((link['interface_a'], link['interface_b']))
+    selected = {}
+    for node in topology['nodes']:
+        if nodes is not None and node['label'] not in nodes:
+            continue
+        for interface in node.get('interfaces', []):
+            if interface['id'] in linked and (labels is None or interface['label'] in labels):
+                selected[interface['id']] = (node['label'], interface['label'])
+    return selected
+
+
+def interface_rates(samples, interface_id):
+    """Return the total traffic and the per second rates of an interface between consecutive samples."""
+    result = dict((key, dict(total=0, min=None, max=None, avg=None)) for key in INTERFACE_COUNTERS)
+    for key in INTERFACE_COUNTERS:
+        rates = []
+        seconds = 0.0
+        for (then, before), (now, after) in zip(samples, samples[1:]):
+            delta = after[interface_id][key] - before[interface_id][key]
+            if delta < 0 or now <= then:
+                # The counters start over when the link is restarted
+                continue
+            rates.append(delta / (now - then))
+            result[key]['total'] += delta
+            seconds += now - then
+        if rates:
+            result[key].update(min=round(min(rates), 1),
+                               max=round(max(rates), 1),
+                               avg=round(result[key]['total'] / seconds, 1))
+    return result
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    argument_spec = cml_argument_spec()
+    argument_spec.update(
+        lab=dict(type='str', required=True, fallback=(env_fallback, ['CML_LAB'])),
+        nodes=dict(type='list', elements='str'),
+        interfaces=dict(type='list', elements='str'),
+        interval=dict(type='float', default=5),
+        count=dict(type='int', default=2),
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+    cml = cmlModule(module)
+    if cml.params['count'] < 2:
+        cml.fail_json("count must be at least 2")
+
+    lab_id = cml.index.lab_id(cml.params['lab'])
+    if lab_id is None:
+        cml.fail_json("Cannot find lab {0}".format(cml.params['lab']))
+
+    topology = cml_api_get(cml.client, 'labs/{0}/topology'.format(lab_id), params={'exclude_configurations': True})
+    if cml.params['nodes']:
+        missing = sorted(set(cml.params['nodes']) - set(node['label'] for node in topology['nodes']))
+        if missing:
+            cml.fail_json("Cannot find nodes {0} in lab {1}".format(', '.join(missing), cml.params['lab']))
+    selected = select_interfaces(topology, cml.params['nodes'], cml.params['interfaces'])
+    if not selected:
+        cml.fail_json("No linked interfaces match the nodes and interfaces in lab {0}".format(cml.params['lab']))
+
+    # Sample on a fixed schedule so that slow requests do not stretch the intervals
+    samples = []
+    started = time.time()
+    for sample in range(cml.params['count']):
+        if sample:
+            time.sleep(max(started + sample * cml.params['interval'] - time.time(), 0))
+        simulation_stats = cml_api_get(cml.client, 'labs/{0}/simulation_stats'.format(lab_id))
+        samples.append((time.time(), interface_counters(simulation_stats, topology.get('links', []))))
+
+    cml.result['interfaces'] = {}
+    for interface_id, (node_label, interface_label) in selected.items():
+        if not all(interface_id in counters for dummy, counters in samples):
+            # The link is not running
+            continue
+        result = dict(node=node_label, interface=interface_label)
+        result.update(interface_rates(samples, interface_id))
+        cml.result['interfaces']['{0}:{1}'.format(node_label, interface_label)] = result
+    cml.result['samples'] = len(samples)
+    cml.result['elapsed'] = round(samples[-1][0] - samples[0][0], 1)
+    cml.exit_json(**cml.result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
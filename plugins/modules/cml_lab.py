@@ -31,6 +31,8 @@ module: cml_lab
 short_description: Create, update or delete a CML Lab
 description:
   - Create, update or delete a CML Lab
+  - With I(reconcile), an existing lab is changed to match I(topology) or I(file) instead of being left
+    as it is.  Only the differences are applied, nodes without changes keep running.
 author:
   - Steven Carter (@stevenca)
 requirements:
@@ -60,6 +62,63 @@ options:
         required: false
         type: bool
         default: True
+    reconcile:
+        description:
+            - Change an existing lab to match I(topology) or I(file) when I(state=present) or I(state=started).
+            - Nodes are matched by label, interfaces by node and slot, and links by the interfaces they connect.
+            - Missing nodes, interfaces and links are added and the ones not in the topology are removed.  A node
+              with another node definition is replaced.
+            - The position and tags of a node are updated in place.  A node whose configuration, image definition
+              or resources change is stopped and wiped first and started again if it was running.
+            - The changes are returned in C(reconcile).  In check mode they are only computed.
+        required: false
+        type: bool
+        default: False
+    fingerprint:
+        description:
+            - Record a hash of the normalized I(topology) or I(file) in the lab notes when the lab is imported or
+              reconciled, and return it in C(fingerprint).
+            - When the lab already records the hash of the topology, the lab is not synced or reconciled and the
+              module returns after one request for the lab summaries.
+            - Changes made to the lab outside of this module are not detected while the hash matches.
+            - Requires PyYAML to normalize the topology.
+        required: false
+        type: bool
+        default: False
+    start_strategy:
+        description:
+            - How the nodes are started when the lab is started.
+            - C(all) starts all nodes at once.
+            - C(tags) starts the nodes in waves, one per tag in I(boot_tags) in that order and the nodes
+              without any of them last.
+            - C(weight) starts the nodes in waves of nodes with the same cpus and ram, the heaviest first.
+            - C(links) starts the nodes in waves by their distance over the links from the nodes with a tag
+              in I(boot_tags), or else from the external connectors and unmanaged switches, or else from the
+              nodes with the most links.
+            - A wave is started once all nodes of the previous wave have booted, and the links between the
+              booted nodes are started with every wave.  The seconds every wave took are returned in C(waves).
+        required: false
+        type: str
+        choices: ['all', 'tags', 'weight', 'links']
+        default: all
+    boot_tags:
+        description: The node tags that order the waves of I(start_strategy=tags) and I(start_strategy=links)
+        required: false
+        type: list
+        elements: str
+    max_booting:
+        description:
+            - Maximum number of nodes booting at the same time when the nodes are started in waves, C(0) for
+              no limit.
+            - With I(start_strategy=all), a limit starts all nodes as one wave.
+        required: false
+        type: int
+        default: 0
+    wait_timeout:
+        description: Seconds to wait for the waves to boot before failing
+        required: false
+        type: int
+        default: 1800
 extends_documentation_fragment: cisco.cml.cml
 """
 
@@ -101,13 +160,186 @@ EXAMPLES = r"""
 
     - name: Refresh Inventory
       meta: refresh_inventory
+
+- name: Apply the changes in the topology file to the running lab
+  hosts: localhost
+  gather_facts: no
+  tasks:
+    - name: Reconcile the lab
+      cisco.cml.cml_lab:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        lab: "{{ cml_lab }}"
+        state: started
+        file: "{{ cml_lab_file }}"
+        reconcile: yes
+      register: results
+
+- name: Boot a large lab without overloading the compute host
+  hosts: localhost
+  gather_facts: no
+  tasks:
+    - name: Start the core first, then the rest, at most 8 nodes at a time
+      cisco.cml.cml_lab:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        lab: "{{ cml_lab }}"
+        state: started
+        file: "{{ cml_lab_file }}"
+        start_strategy: tags
+        boot_tags:
+          - core
+          - distribution
+        max_booting: 8
 """
 
-from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import cmlModule, cml_argument_spec
-from ansible.module_utils.basic import AnsibleModule, env_fallback
+from ansible_collections.cisco.cml.plugins.module_utils.cml_boot import (START_STRATEGIES, StagedBoot, boot_waves,
+                                                                         link_endpoints)
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import cmlModule, cml_api_get, cml_argument_spec
+from ansible_collections.cisco.cml.plugins.module_utils.cml_topology import (
+    BOOT_PROPERTIES, HAS_YAML, YAML_IMPORT_ERROR, desired_model, diff_topology, get_fingerprint, live_model,
+    load_topology, plan_is_empty, plan_summary, set_fingerprint, topology_fingerprint)
+from ansible.module_utils.basic import AnsibleModule, env_fallback, missing_required_lib
 import os
 
 
+def read_topology(params):
+    if params['topology']:
+        return params['topology']
+    if os.path.isabs(params['file']):
+        topology_file = params['file']
+    else:
+        topology_file = os.getcwd() + '/' + params['file']
+    with open(topology_file) as f:
+        return f.read()
+
+
+def stop_and_wipe(node):
+    """Stop and wipe node, return True if it was running."""
+    active = node.is_active()
+    if active:
+        node.stop(wait=True)
+    if node.state != 'DEFINED_ON_CORE':
+        node.wipe(wait=True)
+    return active
+
+
+def start_lab(cml, lab):
+    """Start a lab, with start_strategy or max_booting in waves of nodes."""
+    if cml.params['start_strategy'] == 'all' and not cml.params['max_booting']:
+        lab.start(wait=cml.params['wait'])
+        return
+    # Nodes are started before a wave can fail
+    cml.result['changed'] = True
+    topology = cml_api_get(cml.client, 'labs/{0}/topology'.format(lab.id), params={'exclude_configurations': True})
+    waves = boot_waves(cml.client, topology, cml.params['start_strategy'], cml.params['boot_tags'])
+    boot = StagedBoot(cml.client, lab.id, waves, link_endpoints(topology), cml.params['max_booting'])
+    boot.run(cml.params['wait_timeout'],
+             wait=cml.params['wait'],
+             labels=dict((node['id'], node['label']) for node in topology['nodes']))
+    cml.result['waves'] = boot.results
+    if boot.pending:
+        cml.fail_json("Nodes did not boot in {0} seconds: {1}".format(cml.params['wait_timeout'],
+                                                                     ', '.join(boot.pending)))
+
+
+def recorded_fingerprint(cml, lab_id):
+    """Return the fingerprint recorded in the notes of a lab, from its tile if the tile has the notes."""
+    tile = cml.index.tile(lab_id) or {}
+    if 'lab_notes' in tile:
+        return get_fingerprint(tile['lab_notes'])
+    return get_fingerprint(cml_api_get(cml.client, 'labs/{0}'.format(lab_id)).get('lab_notes'))
+
+
+def reconcile_lab(cml, lab, desired, start, fingerprint=None):
+    """Change lab to match the desired model and return the summary of the changes.
+
+    With a fingerprint, it is recorded in the lab notes once the lab matches.
+    """
+    lab.sync_states()
+    lab.auto_sync = False
+    live = live_model(lab)
+    plan = diff_topology(desired, live)
+    if cml.module.check_mode:
+        return plan_summary(plan)
+    if fingerprint is not None:
+        notes = plan['update_lab'].get('notes', live['notes'])
+        if get_fingerprint(lab.notes) != fingerprint or notes != live['notes']:
+            lab.notes = set_fingerprint(notes, fingerprint)
+    if plan_is_empty(plan):
+        return plan_summary(plan)
+
+    nodes = live['node_objects']
+    interfaces = live['interface_objects']
+    restart = []
+
+    for key in plan['remove_links']:
+        link = live['link_objects'][key]
+        if link.state == 'STARTED':
+            link.stop(wait=True)
+        lab.remove_link(link, wait=False)
+    for label in plan['remove_nodes']:
+        node = nodes.pop(label)
+        stop_and_wipe(node)
+        lab.remove_node(node, wait=False)
+        cml.index.remove_node(lab, node)
+        for key in [key for key in interfaces if key[0] == label]:
+            del interfaces[key]
+
+    # Interfaces can only be removed from, and boot properties only changed on wiped nodes
+    for label in sorted(set(label for label, slot in plan['remove_interfaces']) |
+                        set(label for label, changes in plan['update_nodes'].items()
+                            if set(changes) & set(BOOT_PROPERTIES))):
+        if stop_and_wipe(nodes[label]):
+            restart.append(label)
+    for key in plan['remove_interfaces']:
+        lab.remove_interface(interfaces.pop(key), wait=False)
+    for label, changes in sorted(plan['update_nodes'].items()):
+        node = nodes[label]
+        for name, value in sorted(changes.items()):
+            if name == 'tags':
+                for tag in sorted(set(node.tags()) - set(value)):
+                    node.remove_tag(tag)
+                for tag in value:
+                    node.add_tag(tag)
+            elif name == 'configuration':
+                node.config = value
+            else:
+                setattr(node, name, value)
+
+    for label in plan['add_nodes']:
+        spec = desired['nodes'][label]
+        properties = dict((name, value) for name, value in spec['properties'].items() if value is not None)
+        node = lab.create_node(label,
+                               spec['node_definition'],
+                               properties.pop('x', 0),
+                               properties.pop('y', 0),
+                               wait=False,
+                               **properties)
+        nodes[label] = node
+        cml.index.add_node(lab, node)
+    for key in plan['add_interfaces']:
+        # Creating a slot also creates the missing slots below it
+        if key not in interfaces:
+            lab.create_interface(nodes[key[0]], key[1], wait=False)
+            for interface in nodes[key[0]].interfaces():
+                interfaces.setdefault((key[0], interface.slot), interface)
+    for a, b in plan['add_links']:
+        lab.create_link(interfaces[a], interfaces[b], wait=False)
+
+    for name, value in plan['update_lab'].items():
+        if name != 'notes' or fingerprint is None:
+            setattr(lab, name, value)
+
+    if start:
+        restart.extend(plan['add_nodes'])
+    for label in restart:
+        nodes[label].start(wait=False)
+    return plan_summary(plan)
+
+
 def run_module():
     # define available arguments/parameters a user can pass to the module
     argument_spec = cml_argument_spec()
@@ -117,7 +349,13 @@ def run_module():
                          lab=dict(type='str', required=True, fallback=(env_fallback, ['CML_LAB'])),
                          file=dict(type='str'),
                          topology=dict(type='str'),
-                         wait=dict(type='bool', default=True))
+                         wait=dict(type='bool', default=True),
+                         reconcile=dict(type='bool', default=False),
+                         fingerprint=dict(type='bool', default=False),
+                         start_strategy=dict(type='str', choices=START_STRATEGIES, default='all'),
+                         boot_tags=dict(type='list', elements='str'),
+                         max_booting=dict(type='int', default=0),
+                         wait_timeout=dict(type='int', default=1800))
 
     # the AnsibleModule object will be our abstraction working with Ansible
     # this includes instantiation, a couple of common attr would be the
@@ -125,15 +363,44 @@ def run_module():
     # supports check mode
     module = AnsibleModule(
         argument_spec=argument_spec,
+        required_if=[['start_strategy', 'tags', ['boot_tags']]],
         supports_check_mode=True,
     )
     cml = cmlModule(module)
     cml.result['changed'] = False
-    labs = cml.client.find_labs_by_title(cml.params['lab'])
-    if len(labs) > 0:
-        lab = labs[0]
-    else:
-        lab = None
+
+    desired = fingerprint = None
+    if (cml.params['state'] in ('present', 'started') and (cml.params['topology'] or cml.params['file'])
+            and (cml.params['reconcile'] or cml.params['fingerprint'])):
+        if not HAS_YAML:
+            cml.fail_json(missing_required_lib("PyYAML"), exception=YAML_IMPORT_ERROR)
+        try:
+            topology = read_topology(cml.params)
+        except (IOError, OSError) as e:
+            cml.fail_json("Cannot read topology file {0}: {1}".format(cml.params['file'], e))
+        try:
+            desired = desired_model(load_topology(topology))
+        except (ValueError, KeyError, TypeError) as e:
+            cml.fail_json("Invalid topology: {0}".format(e))
+        if cml.params['fingerprint']:
+            fingerprint = topology_fingerprint(desired)
+            cml.result['fingerprint'] = fingerprint
+
+    if fingerprint is not None:
+        # A lab that records the fingerprint of the topology was imported from or reconciled with it
+        lab_id = cml.index.lab_id(cml.params['lab'])
+        if lab_id is not None and recorded_fingerprint(cml, lab_id) == fingerprint:
+            tile = cml.index.tile(lab_id) or {}
+            if cml.params['state'] == 'present' or tile.get('state') == 'STARTED':
+                cml.exit_json(**cml.result)
+
+    lab = cml.get_lab_by_name(cml.params['lab'])
+
+    if lab is not None and cml.params['reconcile'] and desired is not None:
+        summary = reconcile_lab(cml, lab, desired, cml.params['state'] == 'started' and lab.state() == 'STARTED',
+                                fingerprint)
+        cml.result['reconcile'] = summary
+        cml.result['changed'] = any(summary.values())
 
     if cml.params['state'] == 'present':
         if lab is None:
@@ -148,22 +415,28 @@ def run_module():
             else:
                 lab = cml.client.create_lab(title=cml.params['lab'])
             lab.title = cml.params['lab']
+            if fingerprint is not None:
+                lab.notes = set_fingerprint(desired['notes'], fingerprint)
+            cml.index.add_lab(cml.params['lab'], lab)
             cml.result['changed'] = True
     elif cml.params['state'] == 'started':
         if lab is None:
             if cml.params['topology']:
                 lab = cml.client.import_lab(cml.params['topology'], title=cml.params['lab'])
-                lab.start(wait=cml.params['wait'])
+                start_lab(cml, lab)
             elif cml.params['file']:
                 lab = cml.client.import_lab_from_path(cml.params['file'], title=cml.params['lab'])
-                lab.start(wait=cml.params['wait'])
+                start_lab(cml, lab)
             else:
                 lab = cml.client.create_lab(title=cml.params['lab'])
-                lab.start(wait=cml.params['wait'])
+                start_lab(cml, lab)
             lab.title = cml.params['lab']
+            if fingerprint is not None:
+                lab.notes = set_fingerprint(desired['notes'], fingerprint)
+            cml.index.add_lab(cml.params['lab'], lab)
             cml.result['changed'] = True
         elif lab.state() == "STOPPED":
-            lab.start(wait=cml.params['wait'])
+            start_lab(cml, lab)
             cml.result['changed'] = True
     elif cml.params['state'] == 'absent':
         if lab:
@@ -174,6 +447,7 @@ def run_module():
             elif lab.state() == "STOPPED":
                 lab.wipe(wait=True)
             lab.remove()
+            cml.index.remove_lab(lab)
     elif cml.params['state'] == 'stopped':
         if lab:
             if lab.state() == "STARTED":
@@ -0,0 +1,233 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1', 'status': ['preview'], 'supported_by': 'community'}
+
+DOCUMENTATION = r"""
+---
+module: cml_lab_configs
+short_description: Save the configurations of the nodes of a CML Lab to files
+description:
+  - Extract the running configuration of the booted nodes of a CML lab and save the configuration of
+    every node to C(<label>.cfg) in a directory.
+  - Up to I(max_workers) nodes are extracted at the same time, so a lab takes about as long as its
+    slowest node.  Nodes that are not booted are saved with their stored configuration.
+  - Files whose content did not change are not written again.  New files are only readable by their owner.
+  - Extracting overwrites the stored configuration of a node on the controller, so in check mode nothing
+    is extracted and the stored configurations are compared with the files.
+  - Returns in C(nodes), keyed by node label, the C(path) and C(checksum) of every file, whether it
+    C(changed) and whether the configuration was C(extracted).  The configurations themselves are not
+    returned.
+author:
+  - Steven Carter (@stevenca)
+requirements:
+  - virl2_client
+version_added: '1.3.0'
+options:
+    lab:
+        description: The name of the CML lab (CML_LAB)
+        required: true
+        type: str
+    dest:
+        description: The directory the configurations are saved in, it is created if needed
+        required: true
+        type: path
+    nodes:
+        description: Only save the configurations of the nodes with these names
+        required: false
+        type: list
+        elements: str
+    tags:
+        description:
+            - Only save the configurations of the nodes with one of these tags.
+            - Together with I(nodes), save the nodes matching either of them.
+        required: false
+        type: list
+        elements: str
+    extract:
+        description: Extract the running configuration of the booted nodes before saving it
+        required: false
+        type: bool
+        default: true
+    max_workers:
+        description: Maximum number of nodes extracted at the same time
+        required: false
+        type: int
+        default: 8
+extends_documentation_fragment: cisco.cml.cml
+"""
+
+EXAMPLES = r"""
+- name: Snapshot a lab
+  hosts: localhost
+  connection: local
+  gather_facts: no
+  tasks:
+    - name: Save the running configurations of all nodes
+      cisco.cml.cml_lab_configs:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        lab: "{{ cml_lab }}"
+        dest: "configs/{{ cml_lab }}"
+        max_workers: 32
+
+    - name: Save the routers only
+      cisco.cml.cml_lab_configs:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        lab: "{{ cml_lab }}"
+        dest: configs/routers
+        tags:
+          - router
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from ansible.module_utils._text import to_bytes
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import (cmlModule, cml_api_get, cml_argument_spec,
+                                                                          run_concurrently, set_pool_size)
+from ansible_collections.cisco.cml.plugins.module_utils.cml_watch import select_nodes
+
+
+def config_path(dest, label):
+    return os.path.join(dest, '{0}.cfg'.format(label.replace(os.sep, '_')))
+
+
+def file_checksum(path):
+    """Return the sha256 of a file, or None if it does not exist."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(65536), b''):
+                digest.update(block)
+    except (IOError, OSError):
+        return None
+    return digest.hexdigest()
+
+
+def fetch_config(cml, lab_id, node_id, extract):
+    """Return the configuration of a node, extracted from the running node if extract is set."""
+    url = '{0}labs/{1}/nodes/{2}/'.format(cml.client._base_url, lab_id, node_id)
+    if extract:
+        response = cml.client.session.put(url + 'extract_configuration')
+        response.raise_for_status()
+        # The controller returns the extracted configuration, older ones only store it
+        config = response.json() if response.content else None
+        if isinstance(config, str):
+            return config
+    return cml_api_get(cml.client, 'labs/{0}/nodes/{1}/config'.format(lab_id, node_id))
+
+
+def save_config(cml, lab_id, node_id, label, extract):
+    """Fetch the configuration of a node and write it to its file if it differs, return the node result."""
+    content = to_bytes(fetch_config(cml, lab_id, node_id, extract) or '')
+    path = config_path(cml.params['dest'], label)
+    checksum = hashlib.sha256(content).hexdigest()
+    changed = checksum != file_checksum(path)
+    if changed and not cml.module.check_mode:
+        # AnsibleModule.atomic_move changes the umask of the process and is not safe to use from threads
+        fd, tmp_path = tempfile.mkstemp(dir=cml.params['dest'], prefix='.{0}'.format(os.path.basename(path)))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.rename(tmp_path, path)
+    return dict(path=path, checksum=checksum, changed=changed, extracted=extract)
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    argument_spec = cml_argument_spec()
+    argument_spec.update(
+        lab=dict(type='str', required=True, fallback=(env_fallback, ['CML_LAB'])),
+        dest=dict(type='path', required=True),
+        nodes=dict(type='list', elements='str'),
+        tags=dict(type='list', elements='str'),
+        extract=dict(type='bool', default=True),
+        max_workers=dict(type='int', default=8),
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+    cml = cmlModule(module)
+
+    lab_id = cml.index.lab_id(cml.params['lab'])
+    if lab_id is None:
+        cml.fail_json("Cannot find lab {0}".format(cml.params['lab']))
+
+    topology = cml_api_get(cml.client, 'labs/{0}/topology'.format(lab_id), params={'exclude_configurations': True})
+    selected = select_nodes(topology, cml.params['nodes'], cml.params['tags'])
+    if cml.params['nodes']:
+        missing = sorted(set(cml.params['nodes']) - set(selected.values()))
+        if missing:
+            cml.fail_json("Cannot find nodes {0} in lab {1}".format(', '.join(missing), cml.params['lab']))
+    states = {}
+    if cml.params['extract'] and not module.check_mode:
+        states = cml_api_get(cml.client, 'labs/{0}/lab_element_state'.format(lab_id)).get('nodes', {})
+
+    if not os.path.isdir(cml.params['dest']) and not module.check_mode:
+        try:
+            os.makedirs(cml.params['dest'])
+        except OSError as e:
+            cml.fail_json("Cannot create {0}: {1}".format(cml.params['dest'], e))
+
+    node_ids = sorted(selected, key=lambda node_id: selected[node_id])
+    set_pool_size(cml.client, cml.params['max_workers'])
+    outcomes = run_concurrently(
+        lambda node_id: save_config(cml, lab_id, node_id, selected[node_id], states.get(node_id) == 'BOOTED'),
+        node_ids, cml.params['max_workers'])
+
+    cml.result['nodes'] = {}
+    failed = []
+    for node_id, (outcome, error) in zip(node_ids, outcomes):
+        label = selected[node_id]
+        if error is None:
+            cml.result['nodes'][label] = outcome
+            cml.result['changed'] = cml.result['changed'] or outcome['changed']
+        else:
+            cml.result['nodes'][label] = dict(changed=False, failed=True, msg=str(error))
+            failed.append(label)
+    if failed:
+        cml.fail_json("Failed to save the configurations of nodes {0}".format(', '.join(failed)))
+    cml.exit_json(**cml.result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
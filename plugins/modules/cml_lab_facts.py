@@ -41,6 +41,21 @@ options:
         description: The name of the CML lab (CML_LAB)
         required: true
         type: str
+    gather_subset:
+        description:
+            - Restrict the facts collected to the given subsets.
+            - C(state) returns the state of each node.
+            - C(interfaces) returns the interfaces of each node with their state.
+            - C(addresses) adds the discovered addresses to the interfaces and sets C(ansible_host).
+            - C(counters) adds the traffic counters to the interfaces.
+            - C(config) returns the day0 configuration of each node.
+            - C(details) returns the lab details.
+            - Use C(all) for every subset.  A subset prefixed with C(!) is excluded, e.g. C(['all', '!config']).
+            - Subsets that are not requested are not fetched from the CML server.
+        required: false
+        type: list
+        elements: str
+        default: ['all']
 extends_documentation_fragment: cisco.cml.cml
 """
 EXAMPLES = r"""
@@ -59,83 +74,133 @@ EXAMPLES = r"""
 
     - debug:
         var: results
+
+    - name: Wait for all nodes to boot, only fetching the node states
+      cisco.cml.cml_lab_facts:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        lab: "{{ cml_lab }}"
+        gather_subset:
+          - state
+      register: results
+      until: results.cml_facts.nodes | dict2items | map(attribute='value.state') | unique == ['BOOTED']
+      retries: 40
+      delay: 15
 """
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import cmlModule, cml_argument_spec
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import cmlModule, cml_argument_spec, get_lab_snapshot
+
+GATHER_SUBSETS = frozenset(['state', 'interfaces', 'addresses', 'counters', 'config', 'details'])
+
+
+def get_subsets(cml):
+    subsets = set()
+    for subset in cml.params['gather_subset']:
+        exclude = subset.startswith('!')
+        name = subset[1:] if exclude else subset
+        if name == 'all':
+            names = GATHER_SUBSETS
+        elif name in GATHER_SUBSETS:
+            names = set([name])
+        else:
+            cml.fail_json("Unknown gather_subset {0}, expected one of: all, {1}".format(
+                subset, ', '.join(sorted(GATHER_SUBSETS))))
+        if exclude:
+            subsets.difference_update(names)
+        else:
+            subsets.update(names)
+    return subsets
 
 
-def run_module():
+def run_module(module_class=AnsibleModule):
     # define available arguments/parameters a user can pass to the module
     argument_spec = cml_argument_spec()
-    argument_spec.update(lab=dict(type='str', required=True), )
+    argument_spec.update(lab=dict(type='str', required=True),
+                         gather_subset=dict(type='list', elements='str', default=['all']))
 
     # the AnsibleModule object will be our abstraction working with Ansible
     # this includes instantiation, a couple of common attr would be the
     # args/params passed to the execution, as well as if the module
     # supports check mode
-    module = AnsibleModule(
+    module = module_class(
         argument_spec=argument_spec,
         supports_check_mode=True,
     )
     cml = cmlModule(module)
     cml_facts = {}
-    labs = cml.client.find_labs_by_title(cml.params['lab'])
-    if len(labs):
-        # Just take the first lab until we figure out how we want
-        # to handle duplicates
-        lab = labs[0]
-        lab.sync()
-        cml_facts['details'] = lab.details()
+    # Just take the first lab until we figure out how we want
+    # to handle duplicates
+    lab_id = cml.index.lab_id(cml.params['lab'])
+    if lab_id is not None:
+        subsets = get_subsets(cml)
+        with_interfaces = bool(subsets & set(['interfaces', 'addresses', 'counters']))
+        # The addresses are only reported for BOOTED nodes, so they need the node states
+        lab = get_lab_snapshot(cml.client, lab_id,
+                               configurations='config' in subsets,
+                               states=bool(subsets & set(['state', 'interfaces', 'addresses'])),
+                               addresses='addresses' in subsets,
+                               statistics='counters' in subsets,
+                               details='details' in subsets)
+        if 'details' in subsets:
+            cml_facts['details'] = lab['details']
         cml_facts['nodes'] = {}
-        for node in lab.nodes():
-            cml_facts['nodes'][node.label] = {
-                'state': node.state,
-                'image_definition': node.image_definition,
-                'node_definition': node.node_definition,
-                'cpus': node.cpus,
-                'ram': node.ram,
-                'config': node.config,
-                'data_volume': node.data_volume,
-                'tags': node.tags(),
-                'interfaces': {}
+        for node in lab['nodes']:
+            node_facts = {
+                'image_definition': node['image_definition'],
+                'node_definition': node['node_definition'],
+                'cpus': node['cpus'],
+                'ram': node['ram'],
+                'data_volume': node['data_volume'],
+                'tags': node['tags'],
             }
+            if 'state' in subsets:
+                node_facts['state'] = node['state']
+            if 'config' in subsets:
+                node_facts['config'] = node['config']
+            cml_facts['nodes'][node['label']] = node_facts
+            if not with_interfaces:
+                continue
+            node_facts['interfaces'] = {}
             ansible_host = None
             ansible_host_interface = None
-            for interface in node.interfaces():
-                if node.state == 'BOOTED':
-                    # Fill out the oper data if the node is not fully booted
-                    interface_data = {
-                        'state': interface.state,
-                        'ipv4_addresses': interface.discovered_ipv4,
-                        'ipv6_addresses': interface.discovered_ipv6,
-                        'mac_address': interface.discovered_mac_address,
-                        'is_physical': interface.is_physical,
-                        'readbytes': interface.readbytes,
-                        'readpackets': interface.readpackets,
-                        'writebytes': interface.writebytes,
-                        'writepackets': interface.writepackets
-                    }
-                    # See if we can use this for ansible_host
-                    if interface.discovered_ipv4 and not ansible_host:
-                        ansible_host = interface.discovered_ipv4[0]
-                        ansible_host_interface = interface.label
-                else:
-                    # Otherwise, set oper data to empty
-                    interface_data = {
-                        'state': interface.state,
-                        'ipv4_addresses': [],
-                        'ipv6_addresses': [],
-                        'mac_address': None,
-                        'is_physical': interface.is_physical,
-                        'readbytes': interface.readbytes,
-                        'readpackets': interface.readpackets,
-                        'writebytes': interface.writebytes,
-                        'writepackets': interface.writepackets
-                    }
-                cml_facts['nodes'][node.label]['interfaces'][interface.label] = interface_data
-            cml_facts['nodes'][node.label]['ansible_host'] = ansible_host
-            cml_facts['nodes'][node.label]['ansible_host_interface'] = ansible_host_interface
+            for interface in node['interfaces']:
+                interface_data = {
+                    'is_physical': interface['is_physical'],
+                }
+                if 'interfaces' in subsets:
+                    interface_data['state'] = interface['state']
+                if 'addresses' in subsets:
+                    if node['state'] == 'BOOTED':
+                        # Fill out the oper data if the node is fully booted
+                        interface_data.update({
+                            'ipv4_addresses': interface['ipv4_addresses'],
+                            'ipv6_addresses': interface['ipv6_addresses'],
+                            'mac_address': interface['mac_address'],
+                        })
+                        # See if we can use this for ansible_host
+                        if interface['ipv4_addresses'] and not ansible_host:
+                            ansible_host = interface['ipv4_addresses'][0]
+                            ansible_host_interface = interface['label']
+                    else:
+                        # Otherwise, set oper data to empty
+                        interface_data.update({
+                            'ipv4_addresses': [],
+                            'ipv6_addresses': [],
+                            'mac_address': None,
+                        })
+                if 'counters' in subsets:
+                    interface_data.update({
+                        'readbytes': interface['readbytes'],
+                        'readpackets': interface['readpackets'],
+                        'writebytes': interface['writebytes'],
+                        'writepackets': interface['writepackets']
+                    })
+                node_facts['interfaces'][interface['label']] = interface_data
+            if 'addresses' in subsets:
+                node_facts['ansible_host'] = ansible_host
+                node_facts['ansible_host_interface'] = ansible_host_interface
     cml.result['cml_facts'] = cml_facts
     cml.exit_json(**cml.result)
 
@@ -0,0 +1,490 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1', 'status': ['preview'], 'supported_by': 'community'}
+
+DOCUMENTATION = r"""
+---
+module: cml_lab_pool
+short_description: Manage a pool of started CML Labs to claim and release
+description:
+  - Keep a pool of identical CML labs built from one topology started, so that a lab can be claimed
+    in seconds instead of waiting for it to boot.
+  - The pool a lab belongs to and its state in the pool are recorded in a line of the lab notes.  A lab
+    is C(starting) while it boots, C(free) once it converged, C(claimed) while in use and C(broken) when
+    it failed to boot.
+  - With I(state=present), labs are imported from I(topology) or I(file) until I(size) labs are free or
+    starting.  Broken labs, labs starting for longer than I(wait_timeout) and surplus free labs are removed.
+    Unless I(wait) is set, the new labs are started in the background and the module returns right away.
+  - With I(state=claimed), a free lab is marked claimed and renamed to I(lab).  Returns the C(lab_id) and
+    C(title) of the claimed lab.
+  - The claim is best-effort, not atomic, the controller cannot update a lab only if it is unchanged.  The
+    claim is read back twice, each time after waiting at least a second and at least as long as it took from
+    checking that the lab is free to marking it claimed.  If the title or the claim changed, another job claimed
+    the lab at the same time and the module moves on to the next free lab.  Claims whose requests are delayed by
+    longer than that, e.g. by a low I(rate_limit), can still end up with the same lab.
+  - With I(state=released), the claimed lab I(lab) gets a pool title back and is stopped and wiped, or
+    imported again with I(reset=recreate), and started in the background.  It is free again once it converged.
+  - With I(state=absent), all labs of the pool are removed, claimed ones included.
+author:
+  - Steven Carter (@stevenca)
+requirements:
+  - virl2_client
+version_added: '1.3.0'
+options:
+    pool:
+        description: The name of the pool, free labs are titled C(<pool>-<n>)
+        required: true
+        type: str
+    state:
+        description: The desired state of the pool, or to claim or release a lab of it
+        required: false
+        type: str
+        choices: ['absent', 'present', 'claimed', 'released']
+        default: present
+    lab:
+        description:
+            - With I(state=claimed), the title the claimed lab is renamed to (CML_LAB).
+            - With I(state=released), the title of the claimed lab to release.
+        required: false
+        type: str
+    file:
+        description: The name of the topology file the labs are imported from
+        required: false
+        type: str
+    topology:
+        description: The topology the labs are imported from
+        required: false
+        type: str
+    size:
+        description: Number of labs to keep free or starting with I(state=present)
+        required: false
+        type: int
+        default: 1
+    reset:
+        description:
+            - How a released lab is reset.
+            - C(wipe) stops and wipes the nodes, changes made to the topology of the lab while it was claimed
+              are kept.
+            - C(recreate) removes the lab and imports I(topology) or I(file) again.
+        required: false
+        type: str
+        choices: ['wipe', 'recreate']
+        default: wipe
+    wait:
+        description: Wait for the new or released labs to boot instead of starting them in the background
+        required: false
+        type: bool
+        default: false
+    wait_timeout:
+        description: Seconds a lab may take to boot before it is marked broken
+        required: false
+        type: int
+        default: 600
+    claim_timeout:
+        description: Seconds to wait for a free lab with I(state=claimed)
+        required: false
+        type: int
+        default: 0
+    max_workers:
+        description: Maximum number of labs imported, started or removed at the same time
+        required: false
+        type: int
+        default: 8
+extends_documentation_fragment: cisco.cml.cml
+"""
+
+EXAMPLES = r"""
+- name: Keep three CI labs ready
+  hosts: localhost
+  connection: local
+  gather_facts: no
+  tasks:
+    - name: Fill the pool
+      cisco.cml.cml_lab_pool:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        pool: ci
+        file: "{{ cml_lab_file }}"
+        size: 3
+
+- name: Run a test in a lab of the pool
+  hosts: localhost
+  connection: local
+  gather_facts: no
+  tasks:
+    - name: Claim a lab
+      cisco.cml.cml_lab_pool:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        pool: ci
+        state: claimed
+        lab: "ci-job-{{ job_id }}"
+        claim_timeout: 300
+
+    - name: Release the lab
+      cisco.cml.cml_lab_pool:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        pool: ci
+        state: released
+        lab: "ci-job-{{ job_id }}"
+"""
+
+import json
+import os
+import random
+import time
+import uuid
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+from ansible_collections.cisco.cml.plugins.module_utils.cml_persistent import detach
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import (Backoff, cmlModule, cml_api_get,
+                                                                          cml_argument_spec, get_lab_tiles,
+                                                                          get_notes_marker, run_concurrently,
+                                                                          set_notes_marker)
+
+POOL_MARKER = 'cisco.cml lab pool: '
+
+# Minimum seconds between marking a lab claimed and each of the two read backs of the claim
+CLAIM_SETTLE = 1.0
+
+
+def get_pool_marker(notes):
+    """Return the pool marker recorded in lab notes, or None."""
+    try:
+        marker = json.loads(get_notes_marker(notes, POOL_MARKER) or 'null')
+    except ValueError:
+        return None
+    return marker if isinstance(marker, dict) else None
+
+
+def set_pool_marker(notes, marker):
+    """Return lab notes with the pool marker recorded in their last line."""
+    return set_notes_marker(notes, POOL_MARKER, json.dumps(marker, sort_keys=True))
+
+
+def new_marker(pool, state, claim=None):
+    return dict(pool=pool, state=state, claim=claim, since=int(time.time()))
+
+
+def lab_notes(client, lab_id, tile):
+    if 'lab_notes' in tile:
+        return tile['lab_notes']
+    return cml_api_get(client, 'labs/{0}'.format(lab_id)).get('lab_notes')
+
+
+def pool_labs(client, pool, tiles):
+    """Return a dict of lab id to (title, notes, marker) of the labs of the pool."""
+    labs = {}
+    for lab_id, tile in tiles.items():
+        notes = lab_notes(client, lab_id, tile)
+        marker = get_pool_marker(notes)
+        if marker is not None and marker.get('pool') == pool:
+            labs[lab_id] = (tile['lab_title'], notes, marker)
+    return labs
+
+
+def pool_titles(pool, tiles, count):
+    """Return count titles for free labs of the pool that no lab has."""
+    taken = set(tile['lab_title'] for tile in tiles.values())
+    titles = []
+    n = 0
+    while len(titles) < count:
+        n += 1
+        title = '{0}-{1}'.format(pool, n)
+        if title not in taken:
+            titles.append(title)
+    return titles
+
+
+def lab_request(client, method, lab_id, path='', **kwargs):
+    url = '{0}labs/{1}{2}'.format(client._base_url, lab_id, '/' + path if path else '')
+    response = client.session.request(method, url, **kwargs)
+    response.raise_for_status()
+    return response
+
+
+def mark_lab(client, lab_id, pool, state, title=None, notes=None):
+    """Record the state of a lab in its notes, and rename it with title, in one request."""
+    if notes is None:
+        notes = cml_api_get(client, 'labs/{0}'.format(lab_id)).get('lab_notes')
+    fields = dict(notes=set_pool_marker(notes, new_marker(pool, state)))
+    if title is not None:
+        fields['title'] = title
+    lab_request(client, 'PATCH', lab_id, json=fields)
+
+
+def import_lab(cml, topology, title):
+    """Import a lab of the pool marked starting, return its id."""
+    response = cml.client.session.post(cml.client._base_url + 'import', params=dict(title=title), data=topology)
+    response.raise_for_status()
+    lab_id = response.json()['id']
+    mark_lab(cml.client, lab_id, cml.params['pool'], 'starting')
+    return lab_id
+
+
+def remove_lab(cml, lab_id):
+    for action in ('stop', 'wipe'):
+        lab_request(cml.client, 'PUT', lab_id, action)
+    lab_request(cml.client, 'DELETE', lab_id)
+
+
+def boot_lab(cml, lab_id):
+    """Start a lab and mark it free once it converged, or broken if it does not."""
+    try:
+        lab_request(cml.client, 'PUT', lab_id, 'start')
+        deadline = time.time() + cml.params['wait_timeout']
+        backoff = Backoff()
+        while not cml_api_get(cml.client, 'labs/{0}/check_if_converged'.format(lab_id)):
+            if time.time() > deadline:
+                raise RuntimeError('The lab did not converge in {0} seconds'.format(cml.params['wait_timeout']))
+            time.sleep(backoff.next())
+        mark_lab(cml.client, lab_id, cml.params['pool'], 'free')
+    except Exception:
+        try:
+            mark_lab(cml.client, lab_id, cml.params['pool'], 'broken')
+        except Exception:
+            pass
+        raise
+
+
+def release_lab(cml, lab_id, title, topology):
+    """Reset a released lab and boot it again."""
+    if topology is not None:
+        remove_lab(cml, lab_id)
+        lab_id = import_lab(cml, topology, title)
+    else:
+        for action in ('stop', 'wipe'):
+            lab_request(cml.client, 'PUT', lab_id, action)
+    boot_lab(cml, lab_id)
+
+
+def run_in_background(cml, function):
+    """Run function in a process detached from the module, with its own client."""
+    if not detach():
+        return
+    status = 0
+    try:
+        # The connections of the module's client are shared with the module process
+        cml.login()
+        function()
+    except Exception:
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def read_topology(params):
+    if params['topology']:
+        return params['topology']
+    with open(params['file']) as f:
+        return f.read()
+
+
+def pool_present(cml, tiles, labs, topology):
+    now = time.time()
+    ready = []
+    stale = []
+    for lab_id, (title, notes, marker) in sorted(labs.items(), key=lambda item: item[1][0]):
+        if marker['state'] == 'broken' or (marker['state'] == 'starting'
+                                           and now - marker.get('since', 0) > cml.params['wait_timeout']):
+            stale.append(lab_id)
+        elif marker['state'] in ('free', 'starting'):
+            ready.append(lab_id)
+    surplus = [lab_id for lab_id in ready[cml.params['size']:] if labs[lab_id][2]['state'] == 'free']
+    titles = pool_titles(cml.params['pool'], tiles, max(cml.params['size'] - len(ready), 0))
+    cml.result['created'] = titles
+    cml.result['removed'] = [labs[lab_id][0] for lab_id in stale + surplus]
+    cml.result['changed'] = bool(titles or stale or surplus)
+    if cml.module.check_mode or not cml.result['changed']:
+        return
+
+    created = []
+    for lab_id, error in run_concurrently(lambda title: import_lab(cml, topology, title), titles,
+                                          cml.params['max_workers']):
+        if error is not None:
+            cml.fail_json("Failed to import a lab of pool {0}: {1}".format(cml.params['pool'], error))
+        created.append(lab_id)
+
+    def converge():
+        run_concurrently(lambda lab_id: remove_lab(cml, lab_id), stale + surplus, cml.params['max_workers'])
+        return run_concurrently(lambda lab_id: boot_lab(cml, lab_id), created, cml.params['max_workers'])
+
+    if not cml.params['wait']:
+        run_in_background(cml, converge)
+        return
+    failed = [title for title, (dummy, error) in zip(titles, converge()) if error is not None]
+    if failed:
+        cml.fail_json("Labs of pool {0} did not boot: {1}".format(cml.params['pool'], ', '.join(failed)))
+
+
+def claim_lab(cml, lab_id, title):
+    """Mark a free lab claimed and rename it, return whether the claim held.
+
+    A competing claim that checked the lab before this one marked it lands at most about as long after
+    the check as this claim took, so the claim is read back twice after at least that long.
+    """
+    checked = time.time()
+    # The lab may have been claimed since the lab summaries were read
+    notes = cml_api_get(cml.client, 'labs/{0}'.format(lab_id)).get('lab_notes')
+    if (get_pool_marker(notes) or {}).get('state') != 'free':
+        return False
+    claim = uuid.uuid4().hex
+    marker = new_marker(cml.params['pool'], 'claimed', claim)
+    lab_request(cml.client, 'PATCH', lab_id, json=dict(title=title, notes=set_pool_marker(notes, marker)))
+    settle = max(CLAIM_SETTLE, time.time() - checked)
+    for dummy in range(2):
+        time.sleep(settle)
+        lab = cml_api_get(cml.client, 'labs/{0}'.format(lab_id))
+        if lab.get('lab_title') != title or (get_pool_marker(lab.get('lab_notes')) or {}).get('claim') != claim:
+            return False
+    return True
+
+
+def pool_claimed(cml, tiles, labs):
+    title = cml.params['lab']
+    for lab_id, (lab_title, notes, marker) in labs.items():
+        if lab_title == title and marker['state'] == 'claimed':
+            cml.result.update(lab_id=lab_id, title=title)
+            return
+    if any(tile['lab_title'] == title for tile in tiles.values()):
+        cml.fail_json("A lab titled {0} already exists".format(title))
+
+    deadline = time.time() + cml.params['claim_timeout']
+    backoff = Backoff()
+    while True:
+        free = [lab_id for lab_id, (dummy, dummy, marker) in labs.items() if marker['state'] == 'free']
+        # Concurrent claims start with different labs
+        random.shuffle(free)
+        for lab_id in free:
+            if cml.module.check_mode:
+                cml.result.update(changed=True, lab_id=lab_id, title=title)
+                return
+            if claim_lab(cml, lab_id, title):
+                cml.result.update(changed=True, lab_id=lab_id, title=title)
+                return
+        if time.time() > deadline:
+            cml.fail_json("No free lab in pool {0}".format(cml.params['pool']))
+        time.sleep(min(backoff.next(), max(deadline - time.time(), 0)) or 0.1)
+        tiles = get_lab_tiles(cml.client)
+        labs = pool_labs(cml.client, cml.params['pool'], tiles)
+
+
+def pool_released(cml, tiles, labs, topology):
+    for lab_id, (lab_title, notes, marker) in labs.items():
+        if lab_title == cml.params['lab']:
+            break
+    else:
+        cml.fail_json("Cannot find lab {0} in pool {1}".format(cml.params['lab'], cml.params['pool']))
+    cml.result['lab_id'] = lab_id
+    if marker['state'] != 'claimed':
+        cml.result['title'] = lab_title
+        return
+    title = pool_titles(cml.params['pool'], tiles, 1)[0]
+    cml.result.update(changed=True, title=title)
+    if cml.module.check_mode:
+        return
+    # The lab is renamed right away, so that the claimed title can be used again
+    mark_lab(cml.client, lab_id, cml.params['pool'], 'starting', title=title, notes=notes)
+    if not cml.params['wait']:
+        run_in_background(cml, lambda: release_lab(cml, lab_id, title, topology))
+        return
+    try:
+        release_lab(cml, lab_id, title, topology)
+    except Exception as e:
+        cml.fail_json("Failed to release lab {0}: {1}".format(cml.params['lab'], e))
+
+
+def pool_absent(cml, labs):
+    cml.result['removed'] = sorted(title for title, dummy, dummy in labs.values())
+    cml.result['changed'] = bool(labs)
+    if cml.module.check_mode:
+        return
+    failed = [labs[lab_id][0] for lab_id, (dummy, error) in
+              zip(list(labs), run_concurrently(lambda lab_id: remove_lab(cml, lab_id), list(labs),
+                                               cml.params['max_workers'])) if error is not None]
+    if failed:
+        cml.fail_json("Failed to remove labs of pool {0}: {1}".format(cml.params['pool'], ', '.join(failed)))
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    argument_spec = cml_argument_spec()
+    argument_spec.update(
+        pool=dict(type='str', required=True),
+        state=dict(type='str', choices=['absent', 'present', 'claimed', 'released'], default='present'),
+        lab=dict(type='str', fallback=(env_fallback, ['CML_LAB'])),
+        file=dict(type='str'),
+        topology=dict(type='str'),
+        size=dict(type='int', default=1),
+        reset=dict(type='str', choices=['wipe', 'recreate'], default='wipe'),
+        wait=dict(type='bool', default=False),
+        wait_timeout=dict(type='int', default=600),
+        claim_timeout=dict(type='int', default=0),
+        max_workers=dict(type='int', default=8),
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        mutually_exclusive=[['file', 'topology']],
+        required_if=[['state', 'present', ['file', 'topology'], True], ['state', 'claimed', ['lab']],
+                     ['state', 'released', ['lab']], ['reset', 'recreate', ['file', 'topology'], True]],
+        supports_check_mode=True,
+    )
+    cml = cmlModule(module)
+
+    topology = None
+    if cml.params['state'] == 'present' or (cml.params['state'] == 'released' and cml.params['reset'] == 'recreate'):
+        try:
+            topology = read_topology(cml.params)
+        except (IOError, OSError) as e:
+            cml.fail_json("Cannot read {0}: {1}".format(cml.params['file'], e))
+
+    tiles = get_lab_tiles(cml.client)
+    labs = pool_labs(cml.client, cml.params['pool'], tiles)
+    if cml.params['state'] == 'present':
+        pool_present(cml, tiles, labs, topology)
+    elif cml.params['state'] == 'claimed':
+        pool_claimed(cml, tiles, labs)
+    elif cml.params['state'] == 'released':
+        pool_released(cml, tiles, labs, topology)
+    else:
+        pool_absent(cml, labs)
+    cml.exit_json(**cml.result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
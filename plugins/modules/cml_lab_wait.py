@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1', 'status': ['preview'], 'supported_by': 'community'}
+
+DOCUMENTATION = r"""
+---
+module: cml_lab_wait
+short_description: Wait for the nodes of a CML Lab to reach a state
+description:
+  - Wait until the nodes of a CML Lab reach a state, e.g. until all nodes have booted.
+  - The node states are polled with one API request per poll.  The delay between polls grows while
+    no node changes its state and starts over from I(delay) when one does.
+  - Returns in C(nodes) the state of every node waited for and the seconds it took to reach the
+    target state, and in C(pending) the nodes that did not reach it.
+author:
+  - Steven Carter (@stevenca)
+requirements:
+  - virl2_client
+version_added: '1.3.0'
+options:
+    lab:
+        description: The name of the CML lab (CML_LAB)
+        required: true
+        type: str
+    state:
+        description:
+            - The state to wait for.
+            - C(STARTED) is also reached by C(BOOTED) nodes, C(STOPPED) also by wiped nodes.
+        required: false
+        type: str
+        choices: ['BOOTED', 'STARTED', 'STOPPED', 'DEFINED_ON_CORE']
+        default: BOOTED
+    nodes:
+        description: Only wait for the nodes with these names
+        required: false
+        type: list
+        elements: str
+    tags:
+        description:
+            - Only wait for the nodes with one of these tags.
+            - Together with I(nodes), wait for the nodes matching either of them.
+            - The module fails when no node matches.
+        required: false
+        type: list
+        elements: str
+    wait_timeout:
+        description: Seconds to wait for the nodes before failing
+        required: false
+        type: int
+        default: 600
+    delay:
+        description: Seconds between the first polls
+        required: false
+        type: float
+        default: 1
+    max_delay:
+        description: Maximum seconds between polls
+        required: false
+        type: float
+        default: 15
+extends_documentation_fragment: cisco.cml.cml
+"""
+
+EXAMPLES = r"""
+- name: Wait for the lab to boot
+  hosts: localhost
+  connection: local
+  gather_facts: no
+  tasks:
+    - name: Wait for all nodes to boot
+      cisco.cml.cml_lab_wait:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        lab: "{{ cml_lab }}"
+        wait_timeout: 1200
+      register: results
+
+    - name: Wait for the routers to start
+      cisco.cml.cml_lab_wait:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        lab: "{{ cml_lab }}"
+        state: STARTED
+        tags:
+          - router
+"""
+
+import time
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import cmlModule, cml_api_get, cml_argument_spec
+from ansible_collections.cisco.cml.plugins.module_utils.cml_watch import REACHED_BY, LabWatch, LabWatcher, select_nodes
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    argument_spec = cml_argument_spec()
+    argument_spec.update(
+        lab=dict(type='str', required=True, fallback=(env_fallback, ['CML_LAB'])),
+        state=dict(type='str', choices=list(REACHED_BY), default='BOOTED'),
+        nodes=dict(type='list', elements='str'),
+        tags=dict(type='list', elements='str'),
+        wait_timeout=dict(type='int', default=600),
+        delay=dict(type='float', default=1),
+        max_delay=dict(type='float', default=15),
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+    cml = cmlModule(module)
+    started = time.time()
+
+    lab_id = cml.index.lab_id(cml.params['lab'])
+    if lab_id is None:
+        cml.fail_json("Cannot find lab {0}".format(cml.params['lab']))
+
+    topology = cml_api_get(cml.client, 'labs/{0}/topology'.format(lab_id), params={'exclude_configurations': True})
+    selected = select_nodes(topology, cml.params['nodes'], cml.params['tags'])
+    if cml.params['nodes']:
+        missing = sorted(set(cml.params['nodes']) - set(selected.values()))
+        if missing:
+            cml.fail_json("Cannot find nodes {0} in lab {1}".format(', '.join(missing), cml.params['lab']))
+    if not selected:
+        # A wait for no nodes would succeed right away, e.g. after a typo in a tag
+        if cml.params['tags']:
+            cml.fail_json("No nodes match the tags {0} in lab {1}".format(', '.join(cml.params['tags']),
+                                                                           cml.params['lab']))
+        cml.fail_json("Lab {0} has no nodes".format(cml.params['lab']))
+
+    watch = LabWatch(lab_id, cml.params['state'], cml.params['nodes'], cml.params['tags'])
+    watch.selected = selected
+    watcher = LabWatcher(cml.client, 1, cml.params['delay'], cml.params['max_delay'])
+    watcher.run([watch], cml.params['wait_timeout'])
+
+    cml.result.update(watch.as_dict())
+    cml.result['elapsed'] = round(time.time() - started, 1)
+    if watch.error is not None:
+        cml.fail_json("Cannot wait for the nodes of lab {0}: {1}".format(cml.params['lab'], watch.error))
+    if watch.pending:
+        cml.fail_json("Timed out waiting for nodes to reach {0}: {1}".format(
+            cml.params['state'], ', '.join('{0} ({1})'.format(label, watch.states[label]) for label in watch.pending)))
+    cml.exit_json(**cml.result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
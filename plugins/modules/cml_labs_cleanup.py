@@ -0,0 +1,243 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1', 'status': ['preview'], 'supported_by': 'community'}
+
+DOCUMENTATION = r"""
+---
+module: cml_labs_cleanup
+short_description: Stop, wipe or delete many CML Labs
+description:
+  - Select CML labs by title, owner, node tags or age and stop, wipe or delete them.
+  - The labs are torn down concurrently, every lab is stopped, wiped and deleted in that order as needed.
+  - Returns in C(labs), keyed by lab id, the title, the state before the cleanup, the C(changed) and
+    C(failed) status and the seconds the cleanup of every selected lab took.
+  - A lab has to match all of the given selections.  At least one of I(labs), I(owner), I(tags) and
+    I(older_than) is required.
+author:
+  - Steven Carter (@stevenca)
+requirements:
+  - virl2_client
+version_added: '1.3.0'
+options:
+    labs:
+        description: Select the labs whose title matches one of these shell-style patterns, e.g. C(ci-*)
+        required: false
+        type: list
+        elements: str
+    owner:
+        description: Select the labs owned by the user with this name
+        required: false
+        type: str
+    tags:
+        description: Select the labs with a node that has one of these tags
+        required: false
+        type: list
+        elements: str
+    older_than:
+        description: Select the labs created more than this many hours ago
+        required: false
+        type: int
+    state:
+        description: The state the selected labs are brought to
+        required: false
+        type: str
+        choices: ['absent', 'stopped', 'wiped']
+        default: absent
+    max_workers:
+        description: Maximum number of labs torn down at the same time
+        required: false
+        type: int
+        default: 8
+extends_documentation_fragment: cisco.cml.cml
+"""
+
+EXAMPLES = r"""
+- name: Nightly cleanup
+  hosts: localhost
+  connection: local
+  gather_facts: no
+  tasks:
+    - name: Delete the CI labs older than a day
+      cisco.cml.cml_labs_cleanup:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        labs:
+          - ci-*
+        owner: ci
+        older_than: 24
+        max_workers: 16
+      register: results
+
+    - name: Wipe the training labs
+      cisco.cml.cml_labs_cleanup:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        labs:
+          - training-*
+        state: wiped
+"""
+
+import fnmatch
+import time
+import traceback
+from datetime import datetime, timedelta
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import (cmlModule, cml_api_get, cml_argument_spec,
+                                                                          get_lab_tiles, run_concurrently,
+                                                                          set_pool_size)
+
+REQUESTS_IMPORT_ERROR = None
+try:
+    import requests
+except ImportError:
+    HAS_REQUESTS = False
+    REQUESTS_IMPORT_ERROR = traceback.format_exc()
+else:
+    HAS_REQUESTS = True
+
+
+def created_before(tile, cutoff):
+    """Return whether the lab of tile was created before cutoff, a naive UTC datetime."""
+    # The controller returns UTC timestamps like 2024-01-01T00:00:00+00:00
+    created = tile.get('created')
+    return bool(created) and datetime.strptime(created[:19], '%Y-%m-%dT%H:%M:%S') < cutoff
+
+
+def select_labs(cml):
+    """Return the tiles of the labs matching the selections, keyed by lab id."""
+    params = cml.params
+    tiles = get_lab_tiles(cml.client)
+    if params['labs']:
+        tiles = dict((lab_id, tile) for lab_id, tile in tiles.items()
+                     if any(fnmatch.fnmatchcase(tile['lab_title'], pattern) for pattern in params['labs']))
+    if params['owner']:
+        try:
+            owner_id = cml.client.user_management.user_id(params['owner'])
+        except requests.exceptions.RequestException as e:
+            cml.fail_json("Cannot find user {0}: {1}".format(params['owner'], e))
+        tiles = dict((lab_id, tile) for lab_id, tile in tiles.items() if tile.get('owner') == owner_id)
+    if params['older_than'] is not None:
+        cutoff = datetime.utcnow() - timedelta(hours=params['older_than'])
+        tiles = dict((lab_id, tile) for lab_id, tile in tiles.items() if created_before(tile, cutoff))
+    if params['tags']:
+        # Node tags are only in the topology, fetch it for the labs that are still selected
+        lab_ids = sorted(tiles)
+        topologies = run_concurrently(
+            lambda lab_id: cml_api_get(cml.client, 'labs/{0}/topology'.format(lab_id),
+                                       params={'exclude_configurations': True}), lab_ids, params['max_workers'])
+        tags = set(params['tags'])
+        selected = {}
+        for lab_id, (topology, error) in zip(lab_ids, topologies):
+            if error is not None:
+                cml.fail_json("Cannot get the topology of lab {0}: {1}".format(tiles[lab_id]['lab_title'], error))
+            if any(tags & set(node.get('tags') or []) for node in topology['nodes']):
+                selected[lab_id] = tiles[lab_id]
+        tiles = selected
+    return tiles
+
+
+def cleanup_lab(lab, state, target, check_mode):
+    """Bring one lab from state to target, return whether it changed."""
+    changed = False
+    if state not in ('STOPPED', 'DEFINED_ON_CORE'):
+        if not check_mode:
+            lab.stop(wait=True)
+        changed = True
+    if target in ('wiped', 'absent') and state != 'DEFINED_ON_CORE':
+        if not check_mode:
+            lab.wipe(wait=True)
+        changed = True
+    if target == 'absent':
+        if not check_mode:
+            lab.remove()
+        changed = True
+    return changed
+
+
+def timed(function, *args):
+    started = time.time()
+    return function(*args), round(time.time() - started, 1)
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    argument_spec = cml_argument_spec()
+    argument_spec.update(
+        labs=dict(type='list', elements='str'),
+        owner=dict(type='str'),
+        tags=dict(type='list', elements='str'),
+        older_than=dict(type='int'),
+        state=dict(type='str', choices=['absent', 'stopped', 'wiped'], default='absent'),
+        max_workers=dict(type='int', default=8),
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        required_one_of=[['labs', 'owner', 'tags', 'older_than']],
+        supports_check_mode=True,
+    )
+    if not HAS_REQUESTS:
+        module.fail_json(msg=missing_required_lib('requests'), exception=REQUESTS_IMPORT_ERROR)
+    cml = cmlModule(module)
+    started = time.time()
+
+    set_pool_size(cml.client, cml.params['max_workers'])
+    tiles = select_labs(cml)
+    lab_ids = sorted(tiles)
+    labs = dict((lab_id, cml.client.join_existing_lab(lab_id, sync_lab=False)) for lab_id in lab_ids)
+    outcomes = run_concurrently(
+        lambda lab_id: timed(cleanup_lab, labs[lab_id], tiles[lab_id]['state'], cml.params['state'], module.check_mode),
+        lab_ids, cml.params['max_workers'])
+
+    cml.result['labs'] = {}
+    failed = []
+    for lab_id, (outcome, error) in zip(lab_ids, outcomes):
+        result = dict(title=tiles[lab_id]['lab_title'], state=tiles[lab_id]['state'])
+        if error is None:
+            result.update(changed=outcome[0], failed=False, elapsed=outcome[1])
+            cml.result['changed'] = cml.result['changed'] or outcome[0]
+        else:
+            result.update(changed=False, failed=True, msg=str(error))
+            failed.append(tiles[lab_id]['lab_title'])
+        cml.result['labs'][lab_id] = result
+    cml.result['elapsed'] = round(time.time() - started, 1)
+    if failed:
+        cml.fail_json("Failed to clean up labs: {0}".format(', '.join(failed)))
+    cml.exit_json(**cml.result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1', 'status': ['preview'], 'supported_by': 'community'}
+
+DOCUMENTATION = r"""
+---
+module: cml_labs_wait
+short_description: Wait for the nodes of many CML Labs to reach a state
+description:
+  - Wait until the nodes of many CML labs reach a state, e.g. until all labs have booted, in one task.
+  - The labs are watched concurrently over one connection pool.  The node states of every lab are
+    polled with one API request per poll, and the delay between the polls of a lab grows while none
+    of its nodes changes its state.
+  - Returns in C(labs), keyed by lab id, the title of every lab, the state of the nodes waited for and
+    the seconds they took to reach the target state, the nodes that did not reach it in C(pending)
+    and the number of polls.
+author:
+  - Steven Carter (@stevenca)
+requirements:
+  - virl2_client
+version_added: '1.3.0'
+options:
+    labs:
+        description: Wait for the labs whose title matches one of these shell-style patterns, e.g. C(ci-*)
+        required: true
+        type: list
+        elements: str
+    state:
+        description:
+            - The state to wait for.
+            - C(STARTED) is also reached by C(BOOTED) nodes, C(STOPPED) also by wiped nodes.
+        required: false
+        type: str
+        choices: ['BOOTED', 'STARTED', 'STOPPED', 'DEFINED_ON_CORE']
+        default: BOOTED
+    tags:
+        description: Only wait for the nodes with one of these tags
+        required: false
+        type: list
+        elements: str
+    wait_timeout:
+        description: Seconds to wait for all labs before failing
+        required: false
+        type: int
+        default: 600
+    delay:
+        description: Seconds between the first polls of a lab
+        required: false
+        type: float
+        default: 1
+    max_delay:
+        description: Maximum seconds between the polls of a lab
+        required: false
+        type: float
+        default: 15
+    max_workers:
+        description: Maximum number of requests to the controller at the same time
+        required: false
+        type: int
+        default: 8
+extends_documentation_fragment: cisco.cml.cml
+"""
+
+EXAMPLES = r"""
+- name: Wait for the CI labs
+  hosts: localhost
+  connection: local
+  gather_facts: no
+  tasks:
+    - name: Wait for all nodes of the CI labs to boot
+      cisco.cml.cml_labs_wait:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        labs:
+          - ci-*
+        wait_timeout: 1800
+      register: results
+
+    - name: Wait for the routers of two labs to start
+      cisco.cml.cml_labs_wait:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        labs:
+          - lab-a
+          - lab-b
+        state: STARTED
+        tags:
+          - router
+"""
+
+import fnmatch
+import time
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import cmlModule, cml_argument_spec, get_lab_tiles
+from ansible_collections.cisco.cml.plugins.module_utils.cml_watch import REACHED_BY, LabWatch, LabWatcher
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    argument_spec = cml_argument_spec()
+    argument_spec.update(
+        labs=dict(type='list', elements='str', required=True),
+        state=dict(type='str', choices=list(REACHED_BY), default='BOOTED'),
+        tags=dict(type='list', elements='str'),
+        wait_timeout=dict(type='int', default=600),
+        delay=dict(type='float', default=1),
+        max_delay=dict(type='float', default=15),
+        max_workers=dict(type='int', default=8),
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+    cml = cmlModule(module)
+    started = time.time()
+
+    tiles = dict((lab_id, tile) for lab_id, tile in get_lab_tiles(cml.client).items()
+                 if any(fnmatch.fnmatchcase(tile['lab_title'], pattern) for pattern in cml.params['labs']))
+    if not tiles:
+        cml.fail_json("Cannot find labs matching {0}".format(', '.join(cml.params['labs'])))
+
+    watches = [LabWatch(lab_id, cml.params['state'], tags=cml.params['tags']) for lab_id in sorted(tiles)]
+    watcher = LabWatcher(cml.client, cml.params['max_workers'], cml.params['delay'], cml.params['max_delay'])
+    watcher.run(watches, cml.params['wait_timeout'])
+
+    cml.result['labs'] = {}
+    failed = []
+    for watch in watches:
+        result = dict(title=tiles[watch.lab_id]['lab_title'], **watch.as_dict())
+        if watch.error is not None:
+            result['msg'] = str(watch.error)
+        if watch.error is not None or watch.pending:
+            failed.append(result['title'])
+        cml.result['labs'][watch.lab_id] = result
+    cml.result['elapsed'] = round(time.time() - started, 1)
+    if failed:
+        cml.fail_json("Labs did not reach {0}: {1}".format(cml.params['state'], ', '.join(failed)))
+    cml.exit_json(**cml.result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -118,7 +118,7 @@ from ansible.module_utils.basic import AnsibleModule, env_fallback
 from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import cmlModule, cml_argument_spec
 
 
-def run_module():
+def run_module(module_class=AnsibleModule):
     # define available arguments/parameters a user can pass to the module
     argument_spec = cml_argument_spec()
     argument_spec.update(
@@ -138,22 +138,21 @@ def run_module():
     # this includes instantiation, a couple of common attr would be the
     # args/params passed to the execution, as well as if the module
     # supports check mode
-    module = AnsibleModule(
+    module = module_class(
         argument_spec=argument_spec,
         supports_check_mode=True,
     )
     cml = cmlModule(module)
 
-    labs = cml.client.find_labs_by_title(cml.params['lab'])
-    if len(labs) > 0:
-        lab = labs[0]
-    else:
+    lab = cml.get_lab_by_name(cml.params['lab'])
+    if lab is None:
         cml.fail_json("Cannot find lab {0}".format(cml.params['lab']))
 
     node = cml.get_node_by_name(lab, cml.params['name'])
     if cml.params['state'] == 'present':
         if node is None:
             node = lab.create_node(label=cml.params['name'], node_definition=cml.params['node_definition'])
+            cml.index.add_node(lab, node)
             cml.result['changed'] = True
     elif cml.params['state'] == 'started':
         if node is None:
@@ -0,0 +1,307 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1', 'status': ['preview'], 'supported_by': 'community'}
+
+DOCUMENTATION = r"""
+---
+module: cml_nodes
+short_description: Create, update or delete many nodes in a CML Lab
+description:
+  - Create, update, start, stop, wipe or delete many nodes of a CML Lab in one task.
+  - The lab is looked up once and the nodes are changed concurrently.
+  - Returns the C(changed) and C(failed) status of every node in C(nodes), keyed by node name.
+author:
+  - Steven Carter (@stevenca)
+requirements:
+  - virl2_client
+version_added: '1.3.0'
+options:
+    lab:
+        description: The name of the CML lab (CML_LAB)
+        required: true
+        type: str
+    nodes:
+        description: The nodes to change
+        required: true
+        type: list
+        elements: dict
+        suboptions:
+            name:
+                description: The name of the node
+                required: true
+                type: str
+            state:
+                description:
+                    - The desired state of the node
+                    - The config and image definition can only be changed while the node is wiped.
+                required: false
+                type: str
+                choices: ['absent', 'present', 'started', 'stopped', 'wiped']
+                default: present
+            node_definition:
+                description: The node definition of this node, required to create it
+                required: false
+                type: str
+            image_definition:
+                description: The image definition of this node
+                required: false
+                type: str
+            config:
+                description: The day0 configuration of this node
+                required: false
+                type: str
+            x:
+                description: X coordinate on topology canvas
+                required: false
+                type: int
+            y:
+                description: Y coordinate on topology canvas
+                required: false
+                type: int
+            tags:
+                description: List of tags
+                required: false
+                type: list
+                elements: str
+    wait:
+        description: Wait for every node to converge after it was started, stopped or wiped
+        required: false
+        type: bool
+        default: False
+    max_workers:
+        description: Maximum number of nodes changed at the same time
+        required: false
+        type: int
+        default: 8
+extends_documentation_fragment: cisco.cml.cml
+"""
+
+EXAMPLES = r"""
+- name: Start the CML nodes in one task
+  hosts: cml_hosts
+  connection: local
+  gather_facts: no
+  tasks:
+    - name: Describe the node of each host
+      set_fact:
+        cml_node_spec:
+          name: "{{ inventory_hostname }}"
+          state: started
+
+    - name: Start the nodes
+      cisco.cml.cml_nodes:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        lab: "{{ cml_lab }}"
+        nodes: "{{ ansible_play_hosts | map('extract', hostvars, 'cml_node_spec') | list }}"
+      delegate_to: localhost
+      run_once: yes
+      register: results
+
+- name: Start two nodes with a day0 configuration
+  hosts: localhost
+  connection: local
+  gather_facts: no
+  tasks:
+    - cisco.cml.cml_nodes:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        lab: "{{ cml_lab }}"
+        nodes:
+          - name: r1
+            state: started
+            config: "{{ lookup('template', 'r1.j2') }}"
+          - name: r2
+            state: started
+            tags:
+              - ansible_group=routers
+"""
+
+from ansible.module_utils.basic import AnsibleModule, env_fallback
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import (cmlModule, cml_argument_spec,
+                                                                          run_concurrently, set_pool_size)
+
+
+def update_node(node, spec, check_mode):
+    """Apply the properties of spec that differ from node, return whether anything changed."""
+    changed = False
+    if node.state == 'DEFINED_ON_CORE':
+        # The day0 configuration and image can only be changed on a wiped node
+        if spec['config'] is not None and node.config != spec['config']:
+            if not check_mode:
+                node.config = spec['config']
+            changed = True
+        if spec['image_definition'] and node.image_definition != spec['image_definition']:
+            if not check_mode:
+                node.image_definition = spec['image_definition']
+            changed = True
+    if spec['tags'] is not None:
+        current = node.tags()
+        for tag in [t for t in current if t not in spec['tags']]:
+            if not check_mode:
+                node.remove_tag(tag)
+            changed = True
+        for tag in [t for t in spec['tags'] if t not in current]:
+            if not check_mode:
+                node.add_tag(tag)
+            changed = True
+    if spec['x'] is not None and node.x != spec['x']:
+        if not check_mode:
+            node.x = spec['x']
+        changed = True
+    if spec['y'] is not None and node.y != spec['y']:
+        if not check_mode:
+            node.y = spec['y']
+        changed = True
+    return changed
+
+
+def apply_node(lab, node, spec, wait, check_mode):
+    """Bring one node to the state of spec, return whether it changed."""
+    state = spec['state']
+    if state == 'absent':
+        if node is None:
+            return False
+        if not check_mode:
+            if node.state != 'DEFINED_ON_CORE':
+                if node.state != 'STOPPED':
+                    node.stop(wait=True)
+                node.wipe(wait=True)
+            node.remove_on_server()
+        return True
+
+    if node is None:
+        if state != 'present':
+            raise ValueError("Node must be created before it is {0}".format(state))
+        if not spec['node_definition']:
+            raise ValueError("node_definition is required to create the node")
+        if not check_mode:
+            properties = dict(configuration=spec['config'],
+                              image_definition=spec['image_definition'],
+                              tags=spec['tags'])
+            lab.create_node(label=spec['name'],
+                            node_definition=spec['node_definition'],
+                            x=spec['x'] or 0,
+                            y=spec['y'] or 0,
+                            wait=False,
+                            **dict((k, v) for k, v in properties.items() if v is not None))
+        return True
+
+    changed = update_node(node, spec, check_mode)
+    if state == 'started':
+        if node.state not in ['STARTED', 'BOOTED']:
+            if not check_mode:
+                node.start(wait=wait)
+            changed = True
+    elif state == 'stopped':
+        if node.state not in ['STOPPED', 'DEFINED_ON_CORE']:
+            if not check_mode:
+                node.stop(wait=wait)
+            changed = True
+    elif state == 'wiped':
+        if node.state not in ['DEFINED_ON_CORE']:
+            if not check_mode:
+                node.wipe(wait=wait)
+            changed = True
+    return changed
+
+
+def run_module():
+    # define available arguments/parameters a user can pass to the module
+    argument_spec = cml_argument_spec()
+    argument_spec.update(
+        lab=dict(type='str', required=True, fallback=(env_fallback, ['CML_LAB'])),
+        nodes=dict(type='list',
+                   elements='dict',
+                   required=True,
+                   options=dict(
+                       name=dict(type='str', required=True),
+                       state=dict(type='str',
+                                  choices=['absent', 'present', 'started', 'stopped', 'wiped'],
+                                  default='present'),
+                       node_definition=dict(type='str'),
+                       image_definition=dict(type='str'),
+                       config=dict(type='str'),
+                       tags=dict(type='list', elements='str'),
+                       x=dict(type='int'),
+                       y=dict(type='int'),
+                   )),
+        wait=dict(type='bool', default=False),
+        max_workers=dict(type='int', default=8),
+    )
+
+    # the AnsibleModule object will be our abstraction working with Ansible
+    # this includes instantiation, a couple of common attr would be the
+    # args/params passed to the execution, as well as if the module
+    # supports check mode
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+    cml = cmlModule(module)
+
+    lab = cml.get_lab_by_name(cml.params['lab'])
+    if lab is None:
+        cml.fail_json("Cannot find lab {0}".format(cml.params['lab']))
+
+    specs = cml.params['nodes']
+    names = [spec['name'] for spec in specs]
+    duplicates = sorted(set(name for name in names if names.count(name) > 1))
+    if duplicates:
+        cml.fail_json("Nodes given more than once: {0}".format(', '.join(duplicates)))
+
+    # Fetch the node states once, and keep the worker threads from syncing the lab concurrently
+    lab.sync_states()
+    lab.auto_sync = False
+    nodes = dict((node.label, node) for node in lab.nodes())
+
+    set_pool_size(cml.client, cml.params['max_workers'])
+    outcomes = run_concurrently(
+        lambda spec: apply_node(lab, nodes.get(spec['name']), spec, cml.params['wait'], module.check_mode), specs,
+        cml.params['max_workers'])
+
+    cml.result['nodes'] = {}
+    failed = []
+    for spec, (changed, error) in zip(specs, outcomes):
+        if error is None:
+            cml.result['nodes'][spec['name']] = dict(changed=changed, failed=False)
+            cml.result['changed'] = cml.result['changed'] or changed
+        else:
+            cml.result['nodes'][spec['name']] = dict(changed=False, failed=True, msg=str(error))
+            failed.append(spec['name'])
+    if failed:
+        cml.fail_json("Failed to change nodes: {0}".format(', '.join(failed)))
+    cml.exit_json(**cml.result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,10 @@ module: cml_users
 short_description: Manage CML Users
 description:
   - Manage CML Users
+  - Manage one user with I(name), or many users with I(users).  The users are fetched once, the changes are
+    computed from that list and applied concurrently.
+  - The full name, description, admin flag and groups of an existing user are updated when they are given and
+    differ.  The password is only set when the user is created.
 author:
   - Yoshitaka Nagami (@exjobo)
 requirements:
@@ -41,13 +45,12 @@ options:
     name:
         description:
             - Name of the user to create, remove or modify.
+            - One of I(name) and I(users) is required.
         type: str
-        required: true
     fullname:
         description:
             - Full Name of the user to create, remove or modify.
         type: str
-        default: ""
     user_pass:
         description:
             - Desired password.
@@ -61,19 +64,63 @@ options:
     admin:
         description:
             - Whether to create admin user.
+            - New users are not admins unless this is set.
         type: bool
-        default: no
     groups:
         description:
-            - List of groups user will be added to.
+            - List of groups user will be added to, by name or id.
         type: list
         elements: str
-        default: []
     description:
         description:
             - Optionally sets the description of user account.
         type: str
-        default: ""
+    users:
+        description:
+            - The users to manage, instead of I(name).
+        type: list
+        elements: dict
+        suboptions:
+            name:
+                description: Name of the user
+                type: str
+                required: true
+            fullname:
+                description: Full Name of the user
+                type: str
+            user_pass:
+                description: Password of the user, required to create it
+                type: str
+            state:
+                description: Whether the account should exist or not
+                type: str
+                choices: [ absent, present ]
+                default: present
+            admin:
+                description: Whether the user is an admin
+                type: bool
+            groups:
+                description: List of groups of the user, by name or id
+                type: list
+                elements: str
+            description:
+                description: Description of the user account
+                type: str
+    exclusive:
+        description:
+            - Delete the users that are not in I(users).
+            - The user the module logs in as is never deleted, and admin users only with I(exclusive_admins).
+        type: bool
+        default: no
+    exclusive_admins:
+        description:
+            - With I(exclusive), also delete the admin users that are not in I(users).
+        type: bool
+        default: no
+    max_workers:
+        description: Maximum number of users changed at the same time
+        type: int
+        default: 8
 """
 EXAMPLES = r"""
 - name: Manage users
@@ -98,11 +145,20 @@ EXAMPLES = r"""
         password: "{{ cml_password }}"
         name: "old_user"
         state: "absent"
+
+    - name: Create the accounts of a class and remove all other accounts
+      cisco.cml.cml_users:
+        host: "{{ cml_host }}"
+        user: "{{ cml_username }}"
+        password: "{{ cml_password }}"
+        users: "{{ students | map('combine', {'groups': ['students']}) | list }}"
+        exclusive: yes
 """
 
 import traceback
 from ansible.module_utils.basic import AnsibleModule, missing_required_lib
-from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import cmlModule, cml_argument_spec
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import (cmlModule, cml_argument_spec,
+                                                                          run_concurrently, set_pool_size)
 
 REQUESTS_IMPORT_ERROR = None
 try:
@@ -114,28 +170,100 @@ else:
     HAS_REQUESTS = True
 
 
-def get_userid(cml):
-    try:
-        userid = cml.client.user_management.user_id(cml.params['name'])
-        return userid
-    except requests.exceptions.RequestException as e:
-        if e.response.status_code == 404:
-            return None
+USER_FIELDS = ('fullname', 'description', 'admin', 'groups')
+
+
+def user_changes(user, spec, group_ids):
+    """Return the fields of spec that are given and differ from user."""
+    changes = {}
+    for field in USER_FIELDS:
+        desired = spec.get(field)
+        if desired is None:
+            continue
+        if field == 'groups':
+            desired = sorted(set(group_ids.get(group, group) for group in desired))
+            current = sorted(user.get('groups') or [])
+        else:
+            current = user.get(field)
+            if current is None and field != 'admin':
+                current = ''
+        if desired != current:
+            changes[field] = desired
+    return changes
+
+
+def plan_users(specs, users, group_ids, exclusive, login, exclusive_admins=False):
+    """Return a list of (action, name, argument) for the users to create, update and delete.
+
+    With exclusive, the unlisted users other than login are deleted, admins only with exclusive_admins.
+    """
+    by_name = dict((user['username'], user) for user in users)
+    plan = []
+    for spec in specs:
+        user = by_name.get(spec['name'])
+        if spec['state'] == 'absent':
+            if user is not None:
+                plan.append(('delete', spec['name'], user['id']))
+        elif user is None:
+            plan.append(('create', spec['name'], spec))
         else:
-            cml.fail_json(name=cml.params['name'], msg=e, rc=-1)
+            changes = user_changes(user, spec, group_ids)
+            if changes:
+                plan.append(('update', spec['name'], (user['id'], changes)))
+    if exclusive:
+        listed = set(spec['name'] for spec in specs)
+        for name, user in sorted(by_name.items()):
+            if name not in listed and name != login and (exclusive_admins or not user.get('admin')):
+                plan.append(('delete', name, user['id']))
+    return plan
+
+
+def apply_user(cml, action, name, argument, group_ids):
+    if action == 'create':
+        if not argument.get('user_pass'):
+            raise ValueError("user_pass is required to create the user")
+        cml.client.user_management.create_user(
+            username=name,
+            pwd=argument['user_pass'],
+            fullname=argument.get('fullname') or '',
+            description=argument.get('description') or '',
+            admin=bool(argument.get('admin')),
+            groups=[group_ids.get(group, group) for group in argument.get('groups') or []],
+        )
+    elif action == 'update':
+        user_id, changes = argument
+        # Unlike update_user, a PATCH with the changed fields can also clear the full name and description
+        response = cml.client.session.patch(cml.client._base_url + 'users/{0}'.format(user_id), json=changes)
+        response.raise_for_status()
+    else:
+        cml.client.user_management.delete_user(argument)
 
 
 def run_module():
     # define available arguments/parameters a user can pass to the module
     argument_spec = cml_argument_spec()
     argument_spec.update(
-        name=dict(type='str', required=True),
-        fullname=dict(type='str', default=""),
+        name=dict(type='str'),
+        fullname=dict(type='str'),
         user_pass=dict(type='str', no_log=True),
         state=dict(type='str', default='present', choices=['absent', 'present']),
-        admin=dict(type='bool', default=False),
-        groups=dict(type='list', elements='str', default=[]),
-        description=dict(type='str', default=""),
+        admin=dict(type='bool'),
+        groups=dict(type='list', elements='str'),
+        description=dict(type='str'),
+        users=dict(type='list',
+                   elements='dict',
+                   options=dict(
+                       name=dict(type='str', required=True),
+                       fullname=dict(type='str'),
+                       user_pass=dict(type='str', no_log=True),
+                       state=dict(type='str', default='present', choices=['absent', 'present']),
+                       admin=dict(type='bool'),
+                       groups=dict(type='list', elements='str'),
+                       description=dict(type='str'),
+                   )),
+        exclusive=dict(type='bool', default=False),
+        exclusive_admins=dict(type='bool', default=False),
+        max_workers=dict(type='int', default=8),
     )
 
     # the AnsibleModule object will be our abstraction working with Ansible
@@ -144,45 +272,63 @@ def run_module():
     # supports check mode
     module = AnsibleModule(
         argument_spec=argument_spec,
+        mutually_exclusive=[['name', 'users']],
+        required_one_of=[['name', 'users']],
         supports_check_mode=True,
     )
-    cml = cmlModule(module)
-    cml.result['changed'] = False
-    cml.result['name'] = cml.params['name']
-    cml.result['state'] = cml.params['state']
-    userid = get_userid(cml)
 
     if not HAS_REQUESTS:
         # Needs: from ansible.module_utils.basic import missing_required_lib
         module.fail_json(msg=missing_required_lib('requests'), exception=REQUESTS_IMPORT_ERROR)
 
-    if cml.params['state'] == 'present':
-        if userid is None:
-            if module.check_mode:
-                module.exit_json(changed=True)
-            module.debug('Create user %s' % cml.params['name'])
-            try:
-                cml.client.user_management.create_user(
-                    username=cml.params['name'],
-                    pwd=cml.params['user_pass'],
-                    fullname=cml.params['fullname'],
-                    description=cml.params['description'],
-                    admin=cml.params['admin'],
-                    groups=cml.params['groups'],
-                )
-                cml.result['changed'] = True
-            except requests.exceptions.RequestException as e:
-                cml.fail_json(name=cml.params['name'], msg=e, rc=-1)
-    elif cml.params['state'] == 'absent':
-        if userid is not None:
-            if module.check_mode:
-                module.exit_json(changed=True)
-            try:
-                cml.client.user_management.delete_user(userid)
-                cml.result['changed'] = True
-            except requests.exceptions.RequestException as e:
-                cml.fail_json(name=cml.params['name'], msg=e, rc=-1)
+    if module.params['exclusive'] and module.params['users'] is None:
+        module.fail_json(msg="exclusive requires users")
+
+    cml = cmlModule(module)
+    cml.result['changed'] = False
+    if cml.params['users'] is None:
+        cml.result['name'] = cml.params['name']
+        cml.result['state'] = cml.params['state']
+        specs = [dict((key, cml.params[key]) for key in ('name', 'state', 'user_pass') + USER_FIELDS)]
+    else:
+        specs = cml.params['users']
+        names = [spec['name'] for spec in specs]
+        duplicates = sorted(set(name for name in names if names.count(name) > 1))
+        if duplicates:
+            cml.fail_json("Users given more than once: {0}".format(', '.join(duplicates)))
+
+    try:
+        users = cml.client.user_management.users()
+        group_ids = {}
+        if any(spec['groups'] for spec in specs):
+            group_ids = dict((group['name'], group['id']) for group in cml.client.group_management.groups())
+    except requests.exceptions.RequestException as e:
+        cml.fail_json(msg=e, rc=-1)
+
+    plan = plan_users(specs, users, group_ids, cml.params['exclusive'], cml.user, cml.params['exclusive_admins'])
+    cml.result['changed'] = bool(plan)
+    if module.check_mode:
+        outcomes = [(None, None)] * len(plan)
+    else:
+        set_pool_size(cml.client, cml.params['max_workers'])
+        outcomes = run_concurrently(lambda step: apply_user(cml, step[0], step[1], step[2], group_ids), plan,
+                                    cml.params['max_workers'])
 
+    results = {}
+    failed = []
+    for (action, name, argument), (dummy, error) in zip(plan, outcomes):
+        results[name] = dict(action={'create': 'created', 'update': 'updated', 'delete': 'deleted'}[action],
+                             changed=error is None, failed=error is not None)
+        if action == 'update':
+            results[name]['fields'] = sorted(argument[1])
+        if error is not None:
+            results[name]['msg'] = str(error)
+            failed.append('{0} ({1})'.format(name, error))
+    if cml.params['users'] is not None:
+        cml.result['users'] = results
+    if failed:
+        cml.result['changed'] = len(failed) < len(plan)
+        cml.fail_json("Failed to change users: {0}".format(', '.join(failed)), rc=-1)
     cml.exit_json(**cml.result)
 
 
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Run the CML modules in the controller process.
+
+The CML modules only talk to the CML API, so with a local connection there is no need to package
+them and start an interpreter for every host.  The action plugins run the module code in the Ansible
+worker process instead, with a stand-in for AnsibleModule, and the environment of the task applied to
+os.environ.  A worker runs one task on one host, so the logged in client and the labs it looked up are
+only reused by the items of a loop, not by other hosts or tasks.
+"""
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+import logging
+import os
+import sys
+import traceback
+from ansible.module_utils._text import to_text
+from ansible.module_utils.common.arg_spec import ArgumentSpecValidator
+from ansible.module_utils.common.parameters import remove_values
+from ansible.plugins.action import ActionBase
+from ansible_collections.cisco.cml.plugins.module_utils.cml_utils import HAS_VIRL2CLIENT, CMLClientCache
+
+# One per worker process, i.e. per task and host, shared only by the items of a loop
+_CLIENT_CACHE = CMLClientCache()
+
+# virl2_client logs warnings like "SSL Verification disabled", which would end up on the stderr of the worker
+logging.getLogger('virl2_client').addHandler(logging.NullHandler())
+
+
+class _ModuleExit(BaseException):
+    """Raised by exit_json and fail_json to end the module code like the sys.exit of AnsibleModule."""
+
+    def __init__(self, result):
+        super(_ModuleExit, self).__init__()
+        self.result = result
+
+
+def no_log_values(argument_spec, params):
+    """Return the values of the no_log options in params, including those of suboptions."""
+    values = set()
+    for name, spec in argument_spec.items():
+        value = params.get(name)
+        if value is None:
+            continue
+        if spec.get('no_log'):
+            values.add(to_text(value))
+        elif spec.get('options'):
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict):
+                    values.update(no_log_values(spec['options'], item))
+    return values
+
+
+class CMLControllerModule(object):
+    """The part of AnsibleModule the CML modules use, for running them in the controller process."""
+
+    def __init__(self,
+                 args,
+                 check_mode,
+                 client_cache,
+                 argument_spec,
+                 supports_check_mode=False,
+                 mutually_exclusive=None,
+                 required_together=None,
+                 required_one_of=None,
+                 required_if=None,
+                 required_by=None):
+        self.check_mode = check_mode
+        self.client_cache = client_cache
+        self.warnings = []
+        if check_mode and not supports_check_mode:
+            raise _ModuleExit(dict(skipped=True, msg='The module does not support check mode'))
+        validator = ArgumentSpecValidator(argument_spec,
+                                          mutually_exclusive=mutually_exclusive,
+                                          required_together=required_together,
+                                          required_one_of=required_one_of,
+                                          required_if=required_if,
+                                          required_by=required_by)
+        validation = validator.validate(args)
+        self.params = validation.validated_parameters
+        self.no_log_values = no_log_values(argument_spec, self.params)
+        if validation.error_messages:
+            self.fail_json(msg=validation.errors.msg)
+
+    def warn(self, warning):
+        self.warnings.append(warning)
+
+    def exit_json(self, **kwargs):
+        result = dict(kwargs)
+        if self.warnings:
+            result['warnings'] = self.warnings
+        # Like AnsibleModule.exit_json, mask the values of no_log options such as the password
+        raise _ModuleExit(remove_values(result, self.no_log_values))
+
+    def fail_json(self, msg, **kwargs):
+        self.exit_json(failed=True, msg=msg, **kwargs)
+
+
+class CMLActionBase(ActionBase):
+    """Run the run_module function of a CML module in the controller process.
+
+    Subclasses set module to the module, e.g. ansible_collections.cisco.cml.plugins.modules.cml_node.
+    Tasks with a connection other than local, e.g. delegated to another host, run the module there.  So
+    do local tasks when virl2_client is not installed in the controller's Python, or when the host has
+    another ansible_python_interpreter, which may be the one virl2_client is installed in.
+    """
+
+    module = None
+
+    def _environment(self):
+        """Return the templated environment of the task, which AnsibleModule would get in os.environ."""
+        environment = {}
+        self._compute_environment_string(environment)
+        return dict((to_text(name), to_text(value)) for name, value in environment.items())
+
+    def _in_process(self, task_vars):
+        if getattr(self._connection, 'transport', None) != 'local' or not HAS_VIRL2CLIENT:
+            return False
+        interpreter = self._templar.template((task_vars or {}).get('ansible_python_interpreter'))
+        if not interpreter or str(interpreter).startswith('auto'):
+            return True
+        # The implicit localhost is given the controller's Python
+        return os.path.realpath(str(interpreter)) == os.path.realpath(sys.executable)
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(CMLActionBase, self).run(tmp, task_vars)
+        if not self._in_process(task_vars):
+            result.update(self._execute_module(task_vars=task_vars))
+            return result
+
+        def module_class(**kwargs):
+            return CMLControllerModule(self._task.args, self._play_context.check_mode, _CLIENT_CACHE, **kwargs)
+
+        # The fallbacks of the options, e.g. CML_HOST, read the environment of the task
+        environment = self._environment()
+        saved = dict((name, os.environ.get(name)) for name in environment)
+        os.environ.update(environment)
+        try:
+            self.module.run_module(module_class=module_class)
+        except _ModuleExit as e:
+            result.update(e.result)
+        except Exception as e:
+            result.update(failed=True, msg='{0}: {1}'.format(type(e).__name__, e), exception=traceback.format_exc())
+        else:
+            result.update(failed=True, msg='The module returned without a result')
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        return result
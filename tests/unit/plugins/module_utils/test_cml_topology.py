@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2017 Cisco and/or its affiliates.
+#
+# This file is part of Ansible
+#
+# Ansible is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Ansible is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ansible.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import pytest
+
+from ansible_collections.cisco.cml.plugins.module_utils.cml_topology import (HAS_YAML, desired_model, diff_topology,
+                                                                             live_model, load_topology, plan_is_empty,
+                                                                             plan_summary, topology_fingerprint)
+
+pytestmark = pytest.mark.skipif(not HAS_YAML, reason='needs PyYAML')
+
+# A CML export: the interface ids start over at i0 on every node and loopbacks have no slot
+EXPORT = """
+lab:
+  description: Two routers behind an external connector
+  notes: ''
+  title: demo
+  version: 0.1.0
+links:
+  - id: l0
+    n1: n0
+    n2: n1
+    i1: i1
+    i2: i1
+    label: r1-GigabitEthernet0/0<->r2-GigabitEthernet0/0
+  - id: l1
+    n1: n2
+    n2: n0
+    i1: i0
+    i2: i2
+    label: ext-conn-0-port<->r1-GigabitEthernet0/1
+nodes:
+  - id: n0
+    label: r1
+    node_definition: iosv
+    x: 0
+    y: 0
+    configuration: hostname r1
+    image_definition: null
+    tags:
+      - core
+    interfaces:
+      - id: i0
+        label: Loopback0
+        type: loopback
+      - id: i1
+        slot: 0
+        label: GigabitEthernet0/0
+        type: physical
+      - id: i2
+        slot: 1
+        label: GigabitEthernet0/1
+        type: physical
+  - id: n1
+    label: r2
+    node_definition: iosv
+    x: 200
+    y: 0
+    configuration: hostname r2
+    tags: []
+    interfaces:
+      - id: i0
+        label: Loopback0
+        type: loopback
+      - id: i1
+        slot: 0
+        label: GigabitEthernet0/0
+        type: physical
+      - id: i2
+        slot: 1
+        label: GigabitEthernet0/1
+        type: physical
+  - id: n2
+    label: ext-conn-0
+    node_definition: external_connector
+    x: 0
+    y: -200
+    configuration: bridge0
+    tags: []
+    interfaces:
+      - id: i0
+        slot: 0
+        label: port
+        type: physical
+"""
+
+# The same topology as returned by the API, with globally unique interface ids
+API_TOPOLOGY = {
+    'lab': {'description': 'Two routers behind an external connector', 'notes': ''},
+    'nodes': [
+        {'id': 'n0', 'label': 'r1', 'node_definition': 'iosv', 'x': 0, 'y': 0, 'configuration': 'hostname r1',
+         'tags': ['core'],
+         'interfaces': [{'id': 'i0', 'label': 'Loopback0', 'slot': None},
+                        {'id': 'i1', 'label': 'GigabitEthernet0/0', 'slot': 0},
+                        {'id': 'i2', 'label': 'GigabitEthernet0/1', 'slot': 1}]},
+        {'id': 'n1', 'label': 'r2', 'node_definition': 'iosv', 'x': 200, 'y': 0, 'configuration': 'hostname r2',
+         'tags': [],
+         'interfaces': [{'id': 'i3', 'label': 'Loopback0', 'slot': None},
+                        {'id': 'i4', 'label': 'GigabitEthernet0/0', 'slot': 0},
+                        {'id': 'i5', 'label': 'GigabitEthernet0/1', 'slot': 1}]},
+        {'id': 'n2', 'label': 'ext-conn-0', 'node_definition': 'external_connector', 'x': 0, 'y': -200,
+         'configuration': 'bridge0', 'tags': [],
+         'interfaces': [{'id': 'i6', 'label': 'port', 'slot': 0}]},
+    ],
+    'links': [{'id': 'l0', 'interface_a': 'i1', 'interface_b': 'i4'},
+              {'id': 'l1', 'interface_a': 'i6', 'interface_b': 'i2'}],
+}
+
+
+class FakeNode:
+
+    def __init__(self, label, node_definition, config, x, y, tags):
+        self.label = label
+        self.node_definition = node_definition
+        self.config = config
+        self.x = x
+        self.y = y
+        self._tags = tags
+        self.image_definition = 'iosv-159-3' if node_definition == 'iosv' else None
+        self.ram = 512 if node_definition == 'iosv' else 0
+        self.cpus = 1 if node_definition == 'iosv' else 0
+        self.cpu_limit = 100
+        self.data_volume = 0
+        self.boot_disk_size = 0
+
+    def tags(self):
+        return list(self._tags)
+
+
+class FakeInterface:
+
+    def __init__(self, node, slot, label):
+        self.node = node
+        self.slot = slot
+        self.label = label
+
+
+class FakeLink:
+
+    def __init__(self, interface_a, interface_b):
+        self.interface_a = interface_a
+        self.interface_b = interface_b
+
+
+class FakeLab:
+    """The parts of a synced virl2_client Lab that live_model reads, for the lab imported from EXPORT."""
+
+    def __init__(self):
+        self.description = 'Two routers behind an external connector'
+        self.notes = ''
+        r1 = FakeNode('r1', 'iosv', 'hostname r1', 0, 0, ['core'])
+        r2 = FakeNode('r2', 'iosv', 'hostname r2', 200, 0, [])
+        ext = FakeNode('ext-conn-0', 'external_connector', 'bridge0', 0, -200, [])
+        self._nodes = [r1, r2, ext]
+        self._interfaces = dict(r1=[FakeInterface(r1, None, 'Loopback0'),
+                                    FakeInterface(r1, 0, 'GigabitEthernet0/0'),
+                                    FakeInterface(r1, 1, 'GigabitEthernet0/1')],
+                                r2=[FakeInterface(r2, None, 'Loopback0'),
+                                    FakeInterface(r2, 0, 'GigabitEthernet0/0'),
+                                    FakeInterface(r2, 1, 'GigabitEthernet0/1')],
+                                ext=[FakeInterface(ext, 0, 'port')])
+        self._links = [FakeLink(self._interfaces['r2'][1], self._interfaces['r1'][1]),
+                       FakeLink(self._interfaces['r1'][2], self._interfaces['ext'][0])]
+
+    def nodes(self):
+        return list(self._nodes)
+
+    def interfaces(self):
+        return [interface for interfaces in self._interfaces.values() for interface in interfaces]
+
+    def links(self):
+        return list(self._links)
+
+
+def rewired(export):
+    """Return the export with r1 GigabitEthernet0/0 linked to r2 GigabitEthernet0/1 instead of 0/0."""
+    return export.replace('    i1: i1\n    i2: i1\n', '    i1: i1\n    i2: i2\n', 1)
+
+
+def test_export_links_are_resolved_per_node():
+    model = desired_model(load_topology(EXPORT))
+    assert model['links'] == set([(('r1', 0), ('r2', 0)), (('ext-conn-0', 0), ('r1', 1))])
+    assert model['nodes']['r1']['interfaces'] == {None: 'Loopback0', 0: 'GigabitEthernet0/0',
+                                                  1: 'GigabitEthernet0/1'}
+
+
+def test_api_topology_gives_the_same_model():
+    assert desired_model(API_TOPOLOGY) == desired_model(load_topology(EXPORT))
+
+
+def test_export_matches_the_live_lab():
+    plan = diff_topology(desired_model(load_topology(EXPORT)), live_model(FakeLab()))
+    assert plan_is_empty(plan), plan_summary(plan)
+
+
+def test_rewired_link_is_replaced():
+    plan = diff_topology(desired_model(load_topology(rewired(EXPORT))), live_model(FakeLab()))
+    summary = plan_summary(plan)
+    assert summary['remove_links'] == ['r1:0-r2:0']
+    assert summary['add_links'] == ['r1:0-r2:1']
+    assert not summary['remove_nodes'] and not summary['add_interfaces'] and not summary['remove_interfaces']
+
+
+def test_new_node_does_not_add_its_loopback():
+    lab = FakeLab()
+    lab._nodes = lab._nodes[1:]
+    del lab._interfaces['r1']
+    lab._links = []
+    plan = diff_topology(desired_model(load_topology(EXPORT)), live_model(lab))
+    assert plan['add_nodes'] == ['r1']
+    assert plan['add_interfaces'] == [('r1', 0), ('r1', 1)]
+    assert sorted(plan['add_links']) == sorted([(('r1', 0), ('r2', 0)), (('ext-conn-0', 0), ('r1', 1))])
+
+
+def test_fingerprint_changes_with_the_wiring():
+    assert (topology_fingerprint(desired_model(load_topology(EXPORT)))
+            != topology_fingerprint(desired_model(load_topology(rewired(EXPORT)))))
+
+
+def test_fingerprint_does_not_depend_on_ids_or_format():
+    assert (topology_fingerprint(desired_model(load_topology(EXPORT)))
+            == topology_fingerprint(desired_model(API_TOPOLOGY)))